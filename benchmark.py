@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+
+"""Benchmarks of the pipeline steps on the 3mfk mock scaled to any number of poses"""
+
+import argparse
+import os
+import time
+import json
+import shutil
+import resource
+import multiprocessing
+import numpy as np
+import docking_dna
+import model_builder
+import molecule
+import scoring_engine
+import fft_sampling
+import pose_store
+
+
+""" Benchmark configuration """
+mock_folder = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'mock', '3mfk')
+mock_name = '3mfk'
+bench_name = 'bench'
+default_poses = [10000, 100000, 1000000]
+default_models = 100
+scored_poses = 256
+sampled_rotations = 4
+translation_jitter = 0.5
+energy_jitter = 1.0
+time_tolerance = 0.25
+memory_tolerance = 0.25
+output_file = 'bench_output.txt'
+baseline_file = 'bench_baseline.json'
+""" End of configuration """
+
+molecule_suffixes = ['.ini', '_rec.pdb', '_lig.pdb', '_rec.pdb.H', '_lig.pdb.H', '_rec.pdb.amber', '_lig.pdb.amber']
+
+
+def scale_poses(work_path, num_poses, seed=0):
+    """Writes a bench project of num_poses poses built from the mock ones.
+
+    Poses are taken from the mock cyclically with their translations jittered,
+    and every pose keeps the mock energy terms of its source pose, jittered too.
+    """
+    if not os.path.exists(work_path):
+        os.makedirs(work_path)
+    for suffix in molecule_suffixes:
+        shutil.copyfile(os.path.join(mock_folder, mock_name + suffix), os.path.join(work_path, bench_name + suffix))
+    random = np.random.RandomState(seed)
+    rotations, translations, _ = model_builder.read_rot(os.path.join(mock_folder, mock_name + '.rot'))
+    sources = np.arange(num_poses) % len(rotations)
+    jittered = translations[sources] + random.normal(0.0, translation_jitter, (num_poses, 3))
+    confs = np.arange(1, num_poses + 1)
+    table = np.hstack([rotations[sources].reshape(-1, 9), jittered, confs[:, np.newaxis]])
+    np.savetxt(os.path.join(work_path, bench_name + '.rot'), table, fmt=['%8.3f'] * 12 + ['%6d'], delimiter=' ')
+
+    energies = {}
+    with open(os.path.join(mock_folder, mock_name + '.ene')) as input_file:
+        for line in input_file.readlines()[2:]:
+            fields = line.split()
+            energies[int(fields[0])] = [float(field) for field in fields[1:4]]
+    terms = np.array([energies[conf] for conf in range(1, len(rotations) + 1)])[sources]
+    terms += random.normal(0.0, energy_jitter, terms.shape)
+    scoring_engine.write_ene(os.path.join(work_path, bench_name + '.ene'), confs, terms[:, 0], terms[:, 1],
+                             terms[:, 2])
+
+    with open(os.path.join(mock_folder, mock_name + '.ftdock')) as input_file:
+        lines = input_file.readlines()
+    header = [line for line in lines if not line.startswith('G_DATA')]
+    data = [line for line in lines if line.startswith('G_DATA')]
+    with open(os.path.join(work_path, bench_name + '.ftdock'), 'w') as output:
+        output.writelines(header)
+        for conf, source in zip(confs, sources):
+            output.write('G_DATA%7d' % conf + data[source][13:])
+    return work_path
+
+
+def bench_get_top_from_ene(work_path, num_poses, num_models, num_cores):
+    return len(docking_dna.get_top_from_ene(os.path.join(work_path, bench_name + '.ene'), top=num_poses))
+
+
+def bench_ene_to_csv(work_path, num_poses, num_models, num_cores):
+    docking_dna.ene_to_csv(os.path.join(work_path, bench_name + '.ene'), os.path.join(work_path, 'result.csv'),
+                           top=num_poses)
+    return num_poses
+
+
+def bench_read_rot(work_path, num_poses, num_models, num_cores):
+    return len(model_builder.read_rot(os.path.join(work_path, bench_name + '.rot'))[2])
+
+
+def bench_pose_store(work_path, num_poses, num_models, num_cores):
+    store_file = os.path.join(work_path, bench_name + pose_store.store_suffix)
+    pose_store.rot_to_store(os.path.join(work_path, bench_name + '.rot'), store_file)
+    return len(pose_store.PoseStore(store_file).poses()[2])
+
+
+def bench_generate_models(work_path, num_poses, num_models, num_cores):
+    docking_dna.generate_models(work_path, bench_name, num_models, num_cores)
+    return num_models
+
+
+def bench_create_top_structures(work_path, num_poses, num_models, num_cores):
+    top = docking_dna.get_top_from_ene(os.path.join(work_path, bench_name + '.ene'), top=docking_dna.top_models)
+    docking_dna.create_top_structures(os.path.join(work_path, docking_dna.models_dest_folder),
+                                      docking_dna.models_prefix, bench_name, top,
+                                      os.path.join(work_path, 'top_structures.pdb'))
+    return len(top)
+
+
+def bench_packaging(work_path, num_poses, num_models, num_cores):
+    archive_file = docking_dna.create_compress_results(work_path, bench_name, num_cores)
+    os.remove(os.path.join(work_path, archive_file))
+    return len(os.listdir(os.path.join(work_path, docking_dna.models_dest_folder)))
+
+
+def bench_scoring_engine(work_path, num_poses, num_models, num_cores):
+    with docking_dna.cd(work_path):
+        receptor = scoring_engine.ScoringMolecule(bench_name + scoring_engine.receptor_suffix,
+                                                  bench_name + scoring_engine.receptor_amber_suffix)
+        ligand = scoring_engine.ScoringMolecule(bench_name + scoring_engine.ligand_suffix,
+                                                bench_name + scoring_engine.ligand_amber_suffix)
+        rotations, translations, _ = model_builder.read_rot(bench_name + scoring_engine.rot_suffix)
+    count = min(scored_poses, len(rotations))
+    engine = scoring_engine.ScoringEngine(receptor, ligand, rotations[:count], translations[:count])
+    engine.score_poses(np.arange(count))
+    return count
+
+
+def bench_fft_sampling(work_path, num_poses, num_models, num_cores):
+    receptor = molecule.load(os.path.join(work_path, bench_name + '_rec.pdb')).coordinates
+    ligand = molecule.load(os.path.join(work_path, bench_name + '_lig.pdb')).coordinates
+    sampler = fft_sampling.FFTSampler(receptor, ligand)
+    receptor_transform = fft_sampling.forward(sampler.receptor_grid())
+    for angles in fft_sampling.rotation_angles(fft_sampling.angle_step)[:sampled_rotations]:
+        sampler.correlate(receptor_transform, fft_sampling.rotation_matrix(*angles), fft_sampling.keep_per_rotation)
+    return sampled_rotations
+
+
+# Benchmarks in the order they run, later ones may use the output of earlier ones.
+# The native engines do not depend on the number of poses, so they only run at the smallest scale.
+benchmarks = [('get_top_from_ene', bench_get_top_from_ene, True),
+              ('ene_to_csv', bench_ene_to_csv, True),
+              ('read_rot', bench_read_rot, True),
+              ('pose_store', bench_pose_store, True),
+              ('generate_models', bench_generate_models, True),
+              ('create_top_structures', bench_create_top_structures, True),
+              ('packaging', bench_packaging, True),
+              ('scoring_engine', bench_scoring_engine, False),
+              ('fft_sampling', bench_fft_sampling, False)]
+
+
+def measure(function, args):
+    """Wall time, peak RSS and item count of a function run in a child process, or the error it ended with"""
+    receiver, sender = multiprocessing.Pipe(False)
+
+    def target():
+        try:
+            start = time.time()
+            items = function(*args)
+            elapsed = time.time() - start
+            usage = [resource.getrusage(who).ru_maxrss for who in [resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN]]
+            sender.send((elapsed, max(usage) * 1024, items, None))
+        except Exception, e:
+            sender.send((None, None, None, '%s: %s' % (type(e).__name__, str(e))))
+    process = multiprocessing.Process(target=target)
+    process.start()
+    # Only the child holds the sending end, so its death ends the wait
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = None
+    process.join()
+    if result is None:
+        # Killed, out of memory for instance, or crashed
+        return None, None, None, 'no result, exit code %s' % process.exitcode
+    return result
+
+
+def run_benchmarks(work_path, poses, num_models, num_cores, repeat=1, only=None):
+    """Results of every benchmark at every scale, keyed by 'name@poses'"""
+    results = {}
+    for scale, num_poses in enumerate(sorted(poses)):
+        scale_path = os.path.join(work_path, str(num_poses))
+        scale_poses(scale_path, num_poses)
+        for name, function, scaled in benchmarks:
+            if (only and name not in only) or (not scaled and scale > 0):
+                continue
+            runs = [measure(function, (scale_path, num_poses, num_models, num_cores)) for _ in range(repeat)]
+            errors = [run[3] for run in runs if run[3]]
+            if errors:
+                results['%s@%d' % (name, num_poses)] = {'error': errors[0]}
+                continue
+            seconds = min(run[0] for run in runs)
+            results['%s@%d' % (name, num_poses)] = {'seconds': seconds, 'peak_rss_bytes': max(run[1] for run in runs),
+                                                    'items': runs[0][2],
+                                                    'items_per_second': runs[0][2] / seconds if seconds else None}
+        shutil.rmtree(scale_path, ignore_errors=True)
+    return results
+
+
+def compare(results, baseline):
+    """Regression messages of the results that got slower or bigger than the baseline allows"""
+    regressions = []
+    for key in sorted(results):
+        result, reference = results[key], baseline.get(key)
+        if not reference or 'error' in reference:
+            continue
+        if 'error' in result:
+            regressions.append('%s failed: %s' % (key, result['error']))
+            continue
+        if result['seconds'] > reference['seconds'] * (1 + time_tolerance):
+            regressions.append('%s time %.3f s, baseline %.3f s' % (key, result['seconds'], reference['seconds']))
+        if result['peak_rss_bytes'] > reference['peak_rss_bytes'] * (1 + memory_tolerance):
+            regressions.append('%s memory %.1f MB, baseline %.1f MB' % (key, result['peak_rss_bytes'] / 1048576.0,
+                                                                        reference['peak_rss_bytes'] / 1048576.0))
+    return regressions
+
+
+def report(results, baseline, regressions):
+    lines = ['%-32s %12s %12s %14s %12s' % ('Benchmark', 'Seconds', 'Peak MB', 'Items/s', 'Baseline s')]
+    for key in sorted(results, key=lambda key: (int(key.split('@')[1]), key)):
+        result = results[key]
+        if 'error' in result:
+            lines.append('%-32s %s' % (key, result['error']))
+            continue
+        reference = baseline.get(key, {}).get('seconds')
+        lines.append('%-32s %12.3f %12.1f %14.1f %12s' % (key, result['seconds'], result['peak_rss_bytes'] / 1048576.0,
+                                                          result['items_per_second'] or 0.0,
+                                                          '%.3f' % reference if reference else '-'))
+    lines.append('')
+    lines.extend(['REGRESSION %s' % regression for regression in regressions] or ['No regressions'])
+    return '\n'.join(lines) + '\n'
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(prog="benchmark")
+    parser.add_argument("--poses", help="Comma separated numbers of poses",
+                        default=','.join(str(num_poses) for num_poses in default_poses))
+    parser.add_argument("--models", help="Models to generate and package",
+                        type=docking_dna.CommandLineParser.valid_integer_number, default=default_models)
+    parser.add_argument("--cores", help="Cores for the steps that use them",
+                        type=docking_dna.CommandLineParser.valid_integer_number, default=1)
+    parser.add_argument("--repeat", help="Runs of every benchmark, the fastest is kept",
+                        type=docking_dna.CommandLineParser.valid_integer_number, default=1)
+    parser.add_argument("--only", help="Comma separated benchmarks to run")
+    parser.add_argument("--work", help="Scratch folder for the scaled projects", default='bench_work')
+    parser.add_argument("--baseline", help="Baseline JSON file", default=baseline_file)
+    parser.add_argument("--save_baseline", help="Store the results as the new baseline", action="store_true")
+    parser.add_argument("--output", help="Report file", default=output_file)
+    args = parser.parse_args()
+
+    poses = [int(num_poses) for num_poses in args.poses.split(',')]
+    only = args.only.split(',') if args.only else None
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as input_file:
+            baseline = json.load(input_file)
+
+    results = run_benchmarks(os.path.abspath(args.work), poses, args.models, args.cores, args.repeat, only)
+    regressions = compare(results, baseline)
+    text = report(results, baseline, regressions)
+    with open(args.output, 'w') as output:
+        output.write(text)
+    print text
+    if args.save_baseline:
+        baseline.update(results)
+        with open(args.baseline, 'w') as output:
+            json.dump(baseline, output, indent=4, sort_keys=True)
+    shutil.rmtree(args.work, ignore_errors=True)
+    if regressions and not args.save_baseline:
+        raise SystemExit(1)
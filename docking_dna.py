@@ -3,27 +3,76 @@
 import argparse
 import os
 import multiprocessing
-import subprocess
 import shutil
 import glob
 import json
+import string
+import time
 from utils import logger
+import model_builder
+import molecule
+import scoring_engine
+import sharding
+import fft_sampling
+import grid_cache
+import result_cache
+import stages
+import streaming
+import executor
+import packaging
+import metrics
+import energy_table
+import pose_store
+import pose_clustering
+import refinement
+import restraints
+import staging
+import symmetry
+import trajectory
 
 
 """ Script configuration """
 tmp_folder_name = '.tmp'
 uploads_folder_name = 'uploads'
 json_results_file_name = '.results.json'
+json_metrics_file_name = '.metrics.json'
+prometheus_metrics_file_name = '.metrics.prom'
+prometheus_textfile_folder = None
+batch_metrics_file_name = 'batch_metrics.json'
 ini_file_script = 'prepare_ini_file.py'
+native_ini = True
+bin_folder = '/home/user/bin'
+tool_paths = ['ftdock', 'pydock3/pydock3', 'pydock3/pydock3/parallel', 'support', 'mug']
+tool_python_paths = ['pydock3/pydock3']
 pydock_bin = 'pydock3'
 sampling_script = 'run_ftdock.sh'
 scoring_script = 'parallel_scoring.py'
+native_sampling = True
+native_scoring = False
+stream_stages = False
+receptor_symmetry = None
+cluster_cutoff = None
+refine_top = None
 models_dest_folder = 'models'
 models_prefix = 'mug_'
+models_format = 'pdb'
 results_csv_file = 'result.csv'
-mock_folder_dna = "/home/user/bin/mug/mock/3mfk"
-mock_folder_protein = "/home/user/bin/mug/mock/3mfk_monomers"
+archive_format = 'gzip'
+models_segment_file = '.models_segment'
+staging_folder = None
+staging_budget = 8 * 1024 ** 3
+shard_folder = None
+cache_folder = "/home/user/bin/mug/cache"
+cache_max_size = 20 * 1024 ** 3
+grid_cache_folder = None
+grid_cache_max_size = 8 * 1024 ** 3
 top_models = 10
+setup_timeout = 2 * 3600
+sampling_timeout = 48 * 3600
+scoring_timeout = 48 * 3600
+cpu_affinity = None
+batch_jobs_in_flight = 3
+batch_job_cores = None
 """ End of configuration """
 
 
@@ -45,6 +94,21 @@ class CommandLineParser(object):
             raise argparse.ArgumentTypeError("%s is an invalid value" % ivalue)
         return ivalue
 
+    @staticmethod
+    def valid_weights(weights):
+        """ele=W,desolv=W,vdw=W as (ele, desolv, vdw) weights, the missing ones as configured for scoring"""
+        values = {'ele': scoring_engine.ele_weight, 'desolv': scoring_engine.desolv_weight,
+                  'vdw': scoring_engine.vdw_weight}
+        try:
+            for weight in weights.split(','):
+                term, value = weight.split('=')
+                if term.strip().lower() not in values:
+                    raise ValueError
+                values[term.strip().lower()] = float(value)
+        except ValueError:
+            raise argparse.ArgumentTypeError("%s are invalid weights" % weights)
+        return values['ele'], values['desolv'], values['vdw']
+
 
 class cd:
     """Context manager for changing the current working directory"""
@@ -59,6 +123,27 @@ class cd:
         os.chdir(self.saved_path)
 
 
+def tool_environment():
+    """Adds the folders of the external tools under bin_folder to PATH and PYTHONPATH, once"""
+    for variable, folders in [('PATH', tool_paths), ('PYTHONPATH', tool_python_paths)]:
+        paths = [path for path in os.environ.get(variable, '').split(os.pathsep) if path]
+        paths += [folder for folder in [os.path.join(bin_folder, name) for name in folders] if folder not in paths]
+        os.environ[variable] = os.pathsep.join(paths)
+
+
+def link_or_copy(source, destination):
+    """Hard link of source as destination, or a copy if they are on different file systems"""
+    partial = destination + '.partial'
+    if os.path.lexists(partial):
+        os.remove(partial)
+    try:
+        os.link(source, partial)
+    except OSError:
+        shutil.copy2(source, partial)
+    os.rename(partial, destination)
+    return destination
+
+
 def read_config(config_json_file):
     data = None
     receptor_id = None
@@ -67,6 +152,7 @@ def read_config(config_json_file):
     project_name = None
     models = None
     scoring = None
+    restraint_arguments = None
     try:
         with open(config_json_file) as data_file:
             data = json.load(data_file)
@@ -84,9 +170,19 @@ def read_config(config_json_file):
                     models = argument['value']
                 if argument['name'] == 'scoring':
                     scoring = argument['value']
+                if argument['name'] in ['receptor_restraints', 'ligand_restraints', 'restraints_minimum']:
+                    if restraint_arguments is None:
+                        restraint_arguments = {'receptor_restraints': [], 'ligand_restraints': [],
+                                               'restraints_minimum': 1}
+                    value = argument['value']
+                    if argument['name'] == 'restraints_minimum':
+                        value = int(value)
+                    elif not isinstance(value, list):
+                        value = [residue.strip() for residue in value.split(',') if residue.strip()]
+                    restraint_arguments[argument['name']] = value
     except Exception, e:
         logger.error('Error reading config JSON: %s' % str(e))
-    return receptor_id, ligand_id, project_path, project_name, int(models), scoring
+    return receptor_id, ligand_id, project_path, project_name, int(models), scoring, restraint_arguments
 
 
 def read_metadata(metadata_json_file):
@@ -103,32 +199,20 @@ def read_metadata(metadata_json_file):
 
 def get_top_from_ene(ene_file, top=10):
     """Parses the top models conformations from a .ene file"""
-    top_list = []
-    line_count = 0
-    with open(ene_file) as input_file:
-        for line in input_file:
-            line_count += 1
-            if line_count > 2:
-                fields = line.split()
-                conf = fields[0]
-                top_list.append(conf)
-                if line_count == top+2:
-                    return top_list
-    return top_list
+    table = energy_table.open_table(ene_file)
+    return [str(conf) for conf in energy_table.top(table, top, 'RANK')['Conf']]
+
+
+def count_poses(file_name, header_lines=0):
+    """Number of non empty lines after the header of a .rot or .ene file"""
+    with open(file_name) as input_file:
+        return sum(1 for line_number, line in enumerate(input_file) if line_number >= header_lines and line.strip())
 
 
 def ene_to_csv(ene_file, csv_file, top=100, has_header=True):
     """Energy file to CSV file format"""
-    with open(ene_file) as input_file:
-        with open(csv_file, 'w') as output_file:
-            lines_to_write=top
-            if has_header:
-                lines_to_write += 1
-            line_count = 0
-            for line in input_file:
-                if line and line[0] not in ['#', '-'] and line_count <= lines_to_write:
-                    output_file.write((','.join([field.strip() for field in line.split()])) + os.linesep)
-                line_count += 1
+    table = energy_table.open_table(ene_file)
+    energy_table.to_csv(energy_table.top(table, top, 'RANK'), csv_file, header=has_header)
 
 
 def prepare_workspace(project_path, log_file):
@@ -153,54 +237,347 @@ def prepare_workspace(project_path, log_file):
     return source_data_path, tmp_path, results_path
 
 
+def write_ini(project_name, receptor_pdb, ligand_pdb):
+    """pyDock .ini file selecting every chain of the receptor and of the ligand, in their order.
+
+    Ligand chains with the ID of a receptor chain get a free ID in newmol.
+    Raises ValueError when atoms have no chain ID, pyDock cannot select them.
+    """
+    sections = []
+    used = set()
+    for section, pdb_file in [('receptor', receptor_pdb), ('ligand', ligand_pdb)]:
+        chains = []
+        for chain in molecule.load(pdb_file).atoms['chain']:
+            if chain not in chains:
+                chains.append(chain)
+        if '' in chains:
+            raise ValueError("%s has atoms without chain ID" % pdb_file)
+        free = [chain for chain in string.ascii_uppercase + string.digits if chain not in used and chain not in chains]
+        new_chains = [chain if chain not in used else free.pop(0) for chain in chains]
+        used.update(new_chains)
+        sections.append('[%s]\npdb=%s\nmol=%s\nnewmol=%s\n' % (section, pdb_file, ','.join(chains),
+                                                             ','.join(new_chains)))
+    ini_file = "%s.ini" % project_name
+    with open(ini_file, 'w') as output:
+        output.write('\n'.join(sections))
+    return ini_file
+
+
 def setup_molecules(working_path, receptor_pdb, ligand_pdb, project_name):
     with cd(working_path):
         logger.progress("Setup", status="RUNNING")
-        command = "%s %s %s %s" % (ini_file_script, project_name, receptor_pdb, ligand_pdb)
-        process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE)
-        #print 'Waiting for pid %s' % str(process.pid)
-        process.wait()
-        command = "%s %s setup > setup.log" % (pydock_bin, project_name)
-        process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE)
-        #print 'Waiting for pid %s' % str(process.pid)
-        process.wait()
+        log_file = os.path.join(working_path, 'setup.log')
+        ini_file = None
+        if native_ini:
+            try:
+                ini_file = write_ini(project_name, receptor_pdb, ligand_pdb)
+            except ValueError, e:
+                logger.info('Chain selection left to %s: %s' % (ini_file_script, str(e)))
+        if not ini_file:
+            command = "%s %s %s %s" % (ini_file_script, project_name, receptor_pdb, ligand_pdb)
+            executor.run(command, log_file, "Setup", setup_timeout, cpu_affinity)
+        command = "%s %s setup" % (pydock_bin, project_name)
+        executor.run(command, log_file, "Setup", setup_timeout, cpu_affinity)
         logger.progress("Setup", status="DONE")
         return os.path.join(working_path, "%s_rec.pdb" % project_name), os.path.join(working_path, "%s_lig.pdb" % project_name)
 
 
-def sampling(working_path, receptor_pdb, ligand_pdb, project_name, num_cores, mock=False, mock_folder=""):
+def sampling_parameters():
+    """Description of the sampling engine and its parameters, part of the cache keys"""
+    if native_sampling:
+        return 'native %s%s' % (str(fft_sampling.parameters()),
+                                ' symmetry %s' % str(receptor_symmetry) if receptor_symmetry else '')
+    return sampling_script
+
+
+def receptor_symmetry_of(receptor_pdb):
+    """C2 symmetry of the receptor the native sampling restricts its rotations with, None to scan them all.
+
+    receptor_symmetry is 'auto' to detect it from the receptor chains, or the
+    axis and a point of the axis as a {'axis': [x, y, z], 'point': [x, y, z]} dict.
+    """
+    if not receptor_symmetry or not native_sampling:
+        if receptor_symmetry:
+            logger.info('Receptor symmetry is only used by the native sampling, %s scans every rotation' %
+                        sampling_script)
+        return None
+    if receptor_symmetry == 'auto':
+        found = symmetry.detect(molecule.load(receptor_pdb))
+        if found is None:
+            logger.info('No two-fold symmetry found in the receptor, every rotation is scanned')
+        return found
+    return symmetry.C2Symmetry(receptor_symmetry['axis'], receptor_symmetry['point'])
+
+
+def is_native_scoring(scoring_module):
+    """Whether the in-process engine scores the poses instead of pyDock, it has to be enabled"""
+    return native_scoring and scoring_module in scoring_engine.scoring_modules
+
+
+def scoring_parameters(scoring_module):
+    """Description of the scoring engine and its parameters, part of the cache keys"""
+    if is_native_scoring(scoring_module):
+        return 'native %s %s' % (scoring_module, str(scoring_engine.parameters()))
+    return '%s %s' % (scoring_script, scoring_module)
+
+
+def sampling_key(cache, project_name, receptor_pdb, ligand_pdb):
+    """Cache key of the sampling results of the project in the current folder, None without a cache"""
+    if not cache:
+        return None
+    try:
+        return cache.key('sampling', sampling_parameters(), result_cache.normalized_structure(receptor_pdb),
+                         result_cache.normalized_structure(ligand_pdb),
+                         result_cache.chain_selection("%s.ini" % project_name))
+    except IOError:
+        return None
+
+
+def sampling(working_path, receptor_pdb, ligand_pdb, project_name, num_cores, cache=None):
     with cd(working_path):
         logger.progress("Sampling", status="RUNNING")
-        if not mock:
-            command = "%s %s %s %s %s" % (sampling_script, project_name, receptor_pdb, ligand_pdb, str(num_cores))
-            process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE)
-            #print 'Waiting for pid %s' % str(process.pid)
-            process.wait()
-            command = "%s %s rotftdock" % (pydock_bin, project_name)
-            process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE)
-            #print 'Waiting for pid %s' % str(process.pid)
-            process.wait()
+        artifacts = {'.ftdock': "%s.ftdock" % project_name, '.rot': "%s.rot" % project_name}
+        receptor_c2 = receptor_symmetry_of(receptor_pdb)
+        key = sampling_key(cache, project_name, receptor_pdb, ligand_pdb)
+        if key and cache.fetch(key, artifacts):
+            logger.info("Sampling results found in cache: %s" % key)
         else:
-            shutil.copy2(os.path.join(mock_folder, '3mfk.ftdock'), os.path.join(working_path, "%s.ftdock" % project_name))
-            shutil.copy2(os.path.join(mock_folder, '3mfk.rot'), os.path.join(working_path, "%s.rot" % project_name))
+            if native_sampling and shard_folder:
+                try:
+                    sharding.sample(project_name, receptor_pdb, ligand_pdb, num_cores, shard_folder,
+                                    sampling_angles(receptor_c2))
+                except sharding.ShardFailed, e:
+                    logger.error('Sharded sampling failed: %s' % str(e))
+            elif native_sampling:
+                fft_sampling.sample(project_name, receptor_pdb, ligand_pdb, num_cores, sampling_angles(receptor_c2))
+            else:
+                log_file = os.path.join(working_path, 'sampling.log')
+                command = "%s %s %s %s %s" % (sampling_script, project_name, receptor_pdb, ligand_pdb, str(num_cores))
+                executor.run(command, log_file, "Sampling", sampling_timeout, cpu_affinity)
+                command = "%s %s rotftdock" % (pydock_bin, project_name)
+                executor.run(command, log_file, "Sampling", sampling_timeout, cpu_affinity)
+            if key and all(check_output(file_name) for file_name in artifacts.values()):
+                cache.store(key, artifacts)
+        # Binary pose store memory-mapped by the scoring and the models generation
+        if all(check_output(file_name) for file_name in artifacts.values()):
+            write_pose_store(project_name, receptor_pdb, receptor_c2)
         logger.progress("Sampling", status="DONE")
         return os.path.join(working_path, "%s.ftdock" % project_name)
 
 
-def scoring(working_path, project_name, num_cores, scoring_module="dockser", mock=False, mock_folder=""):
+def sampling_angles(receptor_c2):
+    """FTDock angles the native sampling scans, None for all of them"""
+    if not receptor_c2:
+        return None
+    # The mates of the poses of the other half are the same complexes
+    angles = symmetry.asymmetric_angles(fft_sampling.rotation_angles(fft_sampling.angle_step), receptor_c2)
+    logger.info('Receptor two-fold symmetry, %d rotations scanned' % len(angles))
+    return angles
+
+
+def write_pose_store(project_name, receptor_pdb, receptor_c2=None):
+    return pose_store.rot_to_store("%s.rot" % project_name, "%s%s" % (project_name, pose_store.store_suffix),
+                                   "%s.ftdock" % project_name, receptor_pdb,
+                                   {'symmetry': receptor_c2.header()} if receptor_c2 else None)
+
+
+def streamed_docking(working_path, receptor_pdb, ligand_pdb, project_name, num_cores, num_models, build_models,
+                     scoring_module="dockser", cache=None):
+    """Native sampling and scoring in one pass, and the PDB models if build_models, before the scoring ends.
+
+    The results are cached under the keys of the sampling and scoring stages.
+    Sampling results found in the cache are used instead, the later stages
+    then run as usual. Returns the names of the later stages whose outputs
+    are written.
+    """
+    with cd(working_path):
+        logger.progress("Streaming", status="RUNNING")
+        artifacts = {'.ftdock': "%s.ftdock" % project_name, '.rot': "%s.rot" % project_name}
+        receptor_c2 = receptor_symmetry_of(receptor_pdb)
+        key = sampling_key(cache, project_name, receptor_pdb, ligand_pdb)
+        if key and cache.fetch(key, artifacts):
+            logger.info("Sampling results found in cache, not streaming: %s" % key)
+            write_pose_store(project_name, receptor_pdb, receptor_c2)
+            logger.progress("Streaming", status="DONE")
+            return set()
+        segment = []
+
+        def sampled():
+            write_pose_store(project_name, receptor_pdb, receptor_c2)
+            if build_models:
+                segment.append(open_models(working_path, project_name, num_cores))
+
+        def confirmed(confs):
+            if segment:
+                add_models(working_path, project_name, confs, segment[0], open_pose_store(project_name))
+        try:
+            scored = streaming.stream(project_name, receptor_pdb, ligand_pdb, num_cores, num_models,
+                                      sampling_angles(receptor_c2), sampled, confirmed)
+            logger.info('Streaming scored %d poses, %d kept' % (scored, len(open_pose_store(project_name))))
+            energy_table.open_table("%s.ene" % project_name)
+        except (IOError, ValueError), e:
+            logger.error('Streaming failed: %s' % str(e))
+            return set()
+        if key:
+            cache.store(key, artifacts)
+            ene_key = scoring_key(cache, project_name, scoring_module)
+            if ene_key:
+                cache.store(ene_key, {'.ene': "%s.ene" % project_name})
+        done = set(['scoring'])
+        if segment:
+            finish_models(working_path, project_name, get_top_from_ene("%s.ene" % project_name, top=num_models),
+                          segment[0])
+            done.add('models')
+        logger.progress("Streaming", status="DONE")
+        return done
+
+
+def open_pose_store(project_name, suffix=pose_store.store_suffix):
+    """Pose store of the project in the current folder, None if there is no valid one"""
+    try:
+        return pose_store.PoseStore("%s%s" % (project_name, suffix))
+    except (IOError, ValueError):
+        return None
+
+
+def scoring_store(project_name, filtered):
+    """Poses to cluster and score, the ones kept by the restraints filter if filtered"""
+    if filtered:
+        return open_pose_store(project_name, restraints.filtered_suffix)
+    return open_pose_store(project_name)
+
+
+def filtering(working_path, project_name, restraints_arguments):
+    with cd(working_path):
+        logger.progress("Filtering", status="RUNNING")
+        store = open_pose_store(project_name)
+        try:
+            # Restraints tell the symmetric halves of the receptor apart, so the mates are filtered too
+            if store is not None and symmetry.C2Symmetry.from_header(store.header):
+                symmetry.with_mates(store, "%s%s" % (project_name, symmetry.mates_suffix))
+                store = open_pose_store(project_name, symmetry.mates_suffix)
+            kept = restraints.filter_poses(project_name, restraints_arguments['receptor_restraints'],
+                                           restraints_arguments['ligand_restraints'],
+                                           restraints_arguments['restraints_minimum'], store,
+                                           "%s%s" % (project_name, restraints.filtered_suffix))
+            logger.info('Restraints filter kept %d of %d poses' % (kept, len(store)))
+        except (AttributeError, TypeError, ValueError), e:
+            logger.error('Restraints filter failed: %s' % str(e))
+        logger.progress("Filtering", status="DONE")
+        return os.path.join(working_path, "%s%s" % (project_name, restraints.filtered_suffix))
+
+
+def is_clustered(scoring_module):
+    """Whether only cluster representatives are scored, the native engine only supports it"""
+    return cluster_cutoff is not None and is_native_scoring(scoring_module)
+
+
+def clustering(working_path, project_name, filtered=False):
+    with cd(working_path):
+        logger.progress("Clustering", status="RUNNING")
+        pose_clustering.cluster_poses(project_name, cluster_cutoff, scoring_store(project_name, filtered))
+        logger.progress("Clustering", status="DONE")
+        return os.path.join(working_path, pose_clustering.clusters_file(project_name))
+
+
+def scoring_key(cache, project_name, scoring_module, filtered=False):
+    """Cache key of the scoring results of the project in the current folder, None without a cache"""
+    if not cache:
+        return None
+    inputs = ["%s_rec.pdb.H" % project_name, "%s_lig.pdb.H" % project_name,
+              "%s_rec.pdb.amber" % project_name, "%s_lig.pdb.amber" % project_name, "%s.rot" % project_name]
+    if filtered:
+        inputs.append("%s%s" % (project_name, restraints.filtered_suffix))
+    if is_clustered(scoring_module):
+        inputs.append(pose_clustering.clusters_file(project_name))
+    try:
+        return cache.key('scoring', scoring_parameters(scoring_module),
+                         *[result_cache.file_digest(file_name) for file_name in inputs])
+    except IOError:
+        return None
+
+
+def scoring(working_path, project_name, num_cores, scoring_module="dockser", cache=None, filtered=False):
     with cd(working_path):
         logger.progress("Scoring", status="RUNNING")
-        if not mock:
-            command = "%s %s %s %s" % (scoring_script, project_name, str(num_cores), scoring_module)
-            process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE)
-            #print 'Waiting for pid %s' % str(process.pid)
-            process.wait()
+        artifacts = {'.ene': "%s.ene" % project_name}
+        key = scoring_key(cache, project_name, scoring_module, filtered)
+        if key and cache.fetch(key, artifacts):
+            logger.info("Scoring results found in cache: %s" % key)
         else:
-            shutil.copy2(os.path.join(mock_folder, '3mfk.ene'), os.path.join(working_path, "%s.ene" % project_name))
+            if is_native_scoring(scoring_module):
+                try:
+                    clusters = None
+                    if is_clustered(scoring_module):
+                        clusters = pose_clustering.read_clusters(project_name)
+                    store = scoring_store(project_name, filtered)
+                    if filtered and store is None:
+                        raise IOError("Restraints filter output not found")
+                    if shard_folder:
+                        sharding.score(project_name, num_cores, shard_folder, scoring_module, store, clusters)
+                    else:
+                        scoring_engine.score(project_name, num_cores, scoring_module, store, clusters)
+                except (IOError, ValueError, sharding.ShardFailed), e:
+                    logger.error('Native scoring failed: %s' % str(e))
+            else:
+                command = "%s %s %s %s" % (scoring_script, project_name, str(num_cores), scoring_module)
+                executor.run(command, os.path.join(working_path, 'scoring.log'), "Scoring", scoring_timeout,
+                             cpu_affinity)
+            if key and all(check_output(file_name) for file_name in artifacts.values()):
+                cache.store(key, artifacts)
+        # Binary energy table read by the later stages
+        if check_output(artifacts['.ene']):
+            try:
+                energy_table.open_table(artifacts['.ene'])
+            except ValueError, e:
+                logger.error('Energy table not readable: %s' % str(e))
         logger.progress("Scoring", status="DONE")
         return os.path.join(working_path, "%s.ene" % project_name)
 
 
+def rerank(working_path, project_name, weights):
+    """Writes the energy table again with the total energy under new (ele, desolv, vdw) weights.
+
+    The energy terms come from the binary table of the scoring, so no pose is scored again.
+    """
+    ene_file = os.path.join(working_path, "%s.ene" % project_name)
+    table = energy_table.by_conf(energy_table.open_table(ene_file))
+    scoring_engine.write_ene(ene_file, table['Conf'], table['Ele'], table['Desolv'], table['VDW'], weights)
+    logger.info('Energies ranked again with weights Ele %g, Desolv %g, VDW %g' % tuple(weights))
+    return ene_file
+
+
+def is_refined(scoring_module):
+    """Whether the best poses are refined after the scoring, the native engine only supports it"""
+    return refine_top is not None and is_native_scoring(scoring_module)
+
+
+def ranking_files(project_name, refined=False, filtered=False):
+    """Energy table and pose store suffix the models and the CSV export are built from"""
+    if refined:
+        return "%s%s" % (project_name, refinement.refined_ene_suffix), refinement.refined_store_suffix
+    if filtered:
+        return "%s.ene" % project_name, restraints.filtered_suffix
+    return "%s.ene" % project_name, pose_store.store_suffix
+
+
+def refining(working_path, project_name, num_cores, weights=None, filtered=False):
+    with cd(working_path):
+        logger.progress("Refining", status="RUNNING")
+        refined_ene, refined_store = ranking_files(project_name, refined=True)
+        store = scoring_store(project_name, filtered)
+        try:
+            if store is None:
+                raise IOError("Pose store not found")
+            added = refinement.refine(project_name, refine_top, num_cores, store, "%s.ene" % project_name,
+                                      refined_ene, "%s%s" % (project_name, refined_store), weights)
+            logger.info('Refinement added %d poses around the best %d' % (added, refine_top))
+        except (IOError, ValueError, KeyError), e:
+            logger.error('Refinement failed: %s' % str(e))
+        logger.progress("Refining", status="DONE")
+        return os.path.join(working_path, refined_ene)
+
+
 def create_top_structures(working_path, models_refix, project_name, top, file_name):
     with cd(working_path):
         with open(file_name, 'w') as output:
@@ -210,41 +587,114 @@ def create_top_structures(working_path, models_refix, project_name, top, file_na
                     pdb_file_name = "%s%s_%s.pdb" % (models_prefix, project_name, conf)
                     with open(pdb_file_name) as input_pdb:
                         output.write('MODEL %d\n' % num_model)
-                        for line in input_pdb:
-                            output.write(line)
+                        shutil.copyfileobj(input_pdb, output)
                         output.write('ENDMDL\n')
                     num_model += 1
                 except IOError:
                     pass
 
 
-def generate_models(working_path, project_name, num_models):
+def archive_name(project_name):
+    """File name of the compressed results for the configured format"""
+    return "%s%s" % (project_name, packaging.archive_suffixes[packaging.available_format(archive_format)])
+
+
+def models_trajectory(project_name):
+    """File name of the models trajectory, None when models are written as PDB files"""
+    if models_format == 'trajectory':
+        return "%s%s" % (project_name, trajectory.trajectory_suffix)
+    return None
+
+
+def remove_models(working_path):
+    models_path = os.path.join(working_path, models_dest_folder)
+    if os.path.islink(models_path):
+        # Spilled out of the staging area, its copy goes as well
+        shutil.rmtree(os.path.realpath(models_path), ignore_errors=True)
+        os.remove(models_path)
+    elif os.path.exists(models_path):
+        shutil.rmtree(models_path)
+    return models_path
+
+
+def models_size(working_path, project_name, num_models):
+    """Upper estimate of the bytes of the PDB models, and of the archive holding them"""
+    complex_size = sum(os.path.getsize(os.path.join(working_path, "%s%s" % (project_name, suffix)))
+                       for suffix in [model_builder.receptor_suffix, model_builder.ligand_suffix])
+    return num_models * complex_size
+
+
+def open_models(working_path, project_name, num_cores=1):
+    """Empty models folder, and the archive segment its models are added to"""
+    models_path = os.path.join(working_path, models_dest_folder)
+    if os.path.islink(models_path):
+        # Placed on the project storage by the staging area, emptied where it is
+        shutil.rmtree(os.path.realpath(models_path), ignore_errors=True)
+        os.makedirs(os.path.realpath(models_path))
+    else:
+        os.makedirs(remove_models(working_path))
+    segment = packaging.ArchiveWriter(os.path.join(working_path, models_segment_file),
+                                      packaging.available_format(archive_format), num_cores)
+    segment.add_directory(project_name)
+    segment.add_directory(os.path.join(project_name, models_dest_folder))
+    return segment
+
+
+def add_models(working_path, project_name, confs, segment, store=None):
+    """Builds the models of confs straight into the models folder, archiving them on the way"""
+    return model_builder.make_pdb(project_name, confs, models_prefix, os.path.join(working_path, models_dest_folder),
+                                  segment, os.path.join(project_name, models_dest_folder), store)
+
+
+def finish_models(working_path, project_name, confs, segment):
+    """Closes the models segment and writes the top structures of the models of confs, best first"""
+    models_path = os.path.join(working_path, models_dest_folder)
+    segment.close(finish=False)
+    # Keep the top
+    top = confs[:top_models]
+    create_top_structures(models_path, models_prefix, project_name, top,
+                          os.path.join(working_path, 'top_structures.pdb'))
+    # Top models, linked to their model files
+    for i, conf in enumerate(top):
+        link_or_copy(os.path.join(models_path, "%s%s_%s.pdb" % (models_prefix, project_name, conf)),
+                     os.path.join(working_path, 'top_%d.pdb' % (i+1)))
+
+
+def generate_models(working_path, project_name, num_models, num_cores=1, refined=False, filtered=False):
     with cd(working_path):
         logger.progress("Generating models", status="RUNNING")
-        command = "%s %s makePDB 1 %s %s.ene %s" % (pydock_bin, project_name, str(num_models), project_name, models_prefix)
-	#print 'Generating structures: %s' % str(command)
-        process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE)
-        #print 'Waiting for pid %s' % str(process.pid)
-        process.wait()
-        # Keep the top
-        top = get_top_from_ene("%s.ene" % project_name, top=top_models)
-	#print 'Top structures are: %s' % str(top)
-        create_top_structures(working_path, models_prefix, project_name, top, 'top_structures.pdb')
-        # Create top 10
-        for i in range(top_models):
-            shutil.copy2("%s%s_%s.pdb" % (models_prefix, project_name, top[0]) , 'top_%d.pdb' % (i+1))
-        models_path = os.path.join(working_path, models_dest_folder)
-        if not os.path.exists(models_path):
-            os.makedirs(models_path)
-        else:
-            shutil.rmtree(models_path)
-        models = glob.glob("%s*.pdb" % models_prefix)
-        for model in models:
-            shutil.move(model, models_path)
+        ene_file, store_suffix = ranking_files(project_name, refined, filtered)
+        confs = get_top_from_ene(ene_file, top=num_models)
+        if models_trajectory(project_name):
+            remove_models(working_path)
+            generate_trajectory(project_name, confs, open_pose_store(project_name, store_suffix))
+            logger.progress("Generating models", status="DONE")
+            return True
+        segment = open_models(working_path, project_name, num_cores)
+        add_models(working_path, project_name, confs, segment, open_pose_store(project_name, store_suffix))
+        finish_models(working_path, project_name, confs, segment)
         logger.progress("Generating models", status="DONE")
         return True
 
 
+def generate_trajectory(project_name, confs, store=None):
+    """Writes the models as a single trajectory file, and the top structures extracted from it"""
+    for file_name in [models_segment_file, models_segment_file + packaging.index_suffix]:
+        if os.path.exists(file_name):
+            os.remove(file_name)
+    models = trajectory.Trajectory(trajectory.make_trajectory(project_name, confs, models_trajectory(project_name),
+                                                              store))
+    top = confs[:top_models]
+    with open('top_structures.pdb', 'w') as output:
+        for num_model, conf in enumerate(top):
+            output.write('MODEL %d\n' % (num_model + 1))
+            output.write(models.model(conf))
+            output.write('ENDMDL\n')
+    # Top models
+    for i, conf in enumerate(top):
+        models.extract(conf, 'top_%d.pdb' % (i+1))
+
+
 def clean_workspace(working_path, project_name):
     """Cleans the workspace from temporal folder and scratch files"""
     with cd(working_path):
@@ -271,208 +721,145 @@ def clean_workspace(working_path, project_name):
         logger.progress("Cleaning", status="DONE")
 
 
-def create_compress_results(working_path, project_name):
+def create_compress_results(working_path, project_name, num_cores=1):
+    """Archives the working files under a project_name folder, leaving them in place for resuming.
+
+    The models archived while they were generated are reused as they are.
+    """
     with cd(working_path):
-        to_move = glob.glob('*')
-        if not os.path.exists(project_name):
-            os.makedirs(project_name)
-        for thing in to_move:
-            try:
-                shutil.move(thing, project_name)
-            except:
-                pass
-        command = "tar zcf %s.tgz %s" % (project_name, project_name)
-        process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE)
-        process.wait()
-        return "%s.tgz" % project_name
+        compression = packaging.available_format(archive_format)
+        archive_file = archive_name(project_name)
+        segment = None
+        try:
+            with open(models_segment_file + packaging.index_suffix) as input_file:
+                if json.load(input_file)['format'] == compression and os.path.exists(models_segment_file):
+                    segment = models_segment_file
+        except (IOError, ValueError, KeyError):
+            pass
+        skip = [archive_file, archive_file + packaging.index_suffix, project_name]
+        to_archive = [thing for thing in sorted(glob.glob('*')) if thing not in skip and not thing.endswith('.partial')]
+        archive = packaging.ArchiveWriter(archive_file, compression, num_cores, segment)
+        if not segment:
+            archive.add_directory(project_name)
+        for thing in to_archive:
+            if segment and thing == models_dest_folder:
+                continue
+            archive.add_tree(thing, os.path.join(project_name, thing))
+        return archive.close()
 
 
-def prepare_results(working_path, results_path, project_name, num_models):
+def export_csv(working_path, results_path, project_name, num_models, refined=False):
+    """Writes the CSV energy table, using absolute paths as it runs next to other stages"""
+    ene_file = os.path.join(working_path, ranking_files(project_name, refined)[0])
+    csv_file = os.path.join(results_path, results_csv_file)
+    ene_to_csv(ene_file, csv_file, top=num_models)
+    return csv_file
+
+
+def top_count(num_models):
+    """Number of top models of a run, written as top_1.pdb and on"""
+    return min(num_models, top_models)
+
+
+def prepare_results(working_path, results_path, project_name, num_models, num_cores=1):
     with cd(working_path):
         # Clean workspace from temporal results
         clean_workspace(working_path, project_name)
-        # Move top PDB to results folder
-        try:
-            shutil.move('top_structures.pdb', results_path)
-        except:
-            pass
-        for i in range(top_models):
+        # Link top PDB to results folder
+        for file_name in ['top_structures.pdb'] + ['top_%d.pdb' % (i+1) for i in range(top_count(num_models))]:
             try:
-                shutil.move('top_%d.pdb' % (i+1), results_path)
+                link_or_copy(file_name, os.path.join(results_path, file_name))
+            except (IOError, OSError):
+                pass
+        if models_trajectory(project_name):
+            link_or_copy(models_trajectory(project_name), os.path.join(results_path, models_trajectory(project_name)))
+        # Create compress file and its index of members
+        archive_file = create_compress_results(working_path, project_name, num_cores)
+        for file_name in [archive_file, archive_file + packaging.index_suffix]:
+            try:
+                shutil.move(file_name, os.path.join(results_path, file_name))
             except:
                 pass
-        # Create CSV file
-        ene_file = "%s.ene" % project_name
-        csv_file = os.path.join(results_path, results_csv_file)
-        ene_to_csv(ene_file, csv_file, top=num_models)
-        # Create compress file
-        tgz_file = create_compress_results(working_path, project_name)
-        try:
-            shutil.move(tgz_file, results_path)
-        except:
-            pass
 
 
-def mark_as_complete(results_path, project_name):
-    json_file_name = os.path.join(results_path, json_results_file_name)
-    with open(json_file_name, 'w') as output:
-        content = """
-{
-"output_files": [
-        {
-            "name": "top_structures",
-            "source_id": [
-                ""
-            ],
-            "taxon_id": "",
-            "meta_data": {
-            },
-            "file_path": "%s/top_structures.pdb"
-        },
-        {
-            "name": "results",
-            "source_id": [
-                ""
-            ],
-            "taxon_id": "",
-            "meta_data": {
-            },
-            "file_path": "%s/%s.tgz"
-        },
-        {
-            "name": "energy_table",
-            "source_id": [
-                ""
-            ],
-            "taxon_id": "",
-            "meta_data": {
-            },
-            "file_path": "%s/%s"
-        },
-        {
-            "name": "top10",
-            "source_id": [
-                ""
-            ],
-            "taxon_id": "",
-            "meta_data": {
-            },
-            "file_path": "%s/top_1.pdb"
-        },
-        {
-            "name": "top10",
-            "source_id": [
-                ""
-            ],
-            "taxon_id": "",
-            "meta_data": {
-            },
-            "file_path": "%s/top_2.pdb"
-        },
-        {
-            "name": "top10",
-            "source_id": [
-                ""
-            ],
-            "taxon_id": "",
-            "meta_data": {
-            },
-            "file_path": "%s/top_3.pdb"
-        },
-        {
-            "name": "top10",
-            "source_id": [
-                ""
-            ],
-            "taxon_id": "",
-            "meta_data": {
-            },
-            "file_path": "%s/top_4.pdb"
-        },
-        {
-            "name": "top10",
-            "source_id": [
-                ""
-            ],
-            "taxon_id": "",
-            "meta_data": {
-            },
-            "file_path": "%s/top_5.pdb"
-        },
-        {
-            "name": "top10",
-            "source_id": [
-                ""
-            ],
-            "taxon_id": "",
-            "meta_data": {
-            },
-            "file_path": "%s/top_6.pdb"
-        },
-        {
-            "name": "top10",
-            "source_id": [
-                ""
-            ],
-            "taxon_id": "",
-            "meta_data": {
-            },
-            "file_path": "%s/top_7.pdb"
-        },
-        {
-            "name": "top10",
-            "source_id": [
-                ""
-            ],
-            "taxon_id": "",
-            "meta_data": {
-            },
-            "file_path": "%s/top_8.pdb"
-        },
-        {
-            "name": "top10",
-            "source_id": [
-                ""
-            ],
-            "taxon_id": "",
-            "meta_data": {
-            },
-            "file_path": "%s/top_9.pdb"
-        },
-        {
-            "name": "top10",
+def result_files(project_name, archive_file=None, trajectory_file=None, num_top=None):
+    """Files of the results folder listed by mark_as_complete, and the index of the archive"""
+    archive_file = archive_file or "%s.tgz" % project_name
+    num_top = top_models if num_top is None else num_top
+    return (['top_structures.pdb', archive_file, archive_file + packaging.index_suffix, results_csv_file] +
+            ([trajectory_file] if trajectory_file else []) + ['top_%d.pdb' % (i+1) for i in range(num_top)])
+
+
+results_entry = """        {
+            "name": %s,
             "source_id": [
                 ""
             ],
             "taxon_id": "",
             "meta_data": {
             },
-            "file_path": "%s/top_10.pdb"
-        }
-        ]
-}
-""" % (results_path, results_path, project_name, results_path, results_csv_file, results_path, results_path, results_path, results_path, results_path, results_path, results_path, results_path, results_path, results_path)
-        output.write(content)
+            "file_path": %s
+        }"""
+
+
+def mark_as_complete(results_path, project_name, archive_file=None, trajectory_file=None, num_top=None):
+    """Writes the results JSON, with an entry for each of the num_top (top_models by default) top models"""
+    num_top = top_models if num_top is None else num_top
+    outputs = [('top_structures', 'top_structures.pdb'), ('results', archive_file or "%s.tgz" % project_name),
+               ('energy_table', results_csv_file)]
+    if trajectory_file:
+        outputs.append(('models', trajectory_file))
+    outputs += [('top10', 'top_%d.pdb' % (i+1)) for i in range(num_top)]
+    entries = [results_entry % (json.dumps(name), json.dumps("%s/%s" % (results_path, file_name)))
+               for name, file_name in outputs]
+    json_file_name = os.path.join(results_path, json_results_file_name)
+    with open(json_file_name, 'w') as output:
+        output.write('\n{\n"output_files": [\n%s\n        ]\n}\n' % ',\n'.join(entries))
 
     return json_file_name
 
 
-def check_output(file_name):
-    """Check if file exists and contains actual data"""
+def check_output(file_name, size=None, digest=None):
+    """Check if file exists and contains actual data, with the expected size and SHA-1 if given"""
     try:
         if os.stat(file_name).st_size > 0:
+            if size is not None and os.stat(file_name).st_size != size:
+                return False
+            if digest is not None and result_cache.file_digest(file_name) != digest:
+                return False
             return True
         else:
             # Empty file
             return False
-    except OSError:
+    except (OSError, IOError):
         # No file
         return False
 
 
-def run_pipeline(args, num_cores):
+def write_metrics(recorder, results_path, project_name):
+    """Writes the stage metrics next to the results JSON and to the Prometheus textfile folder if any"""
+    try:
+        recorder.write(os.path.join(results_path, json_metrics_file_name),
+                       os.path.join(results_path, prometheus_metrics_file_name))
+        if prometheus_textfile_folder:
+            metrics.write_atomically(os.path.join(prometheus_textfile_folder, "pydockdna_%s.prom" % project_name),
+                                     metrics.prometheus([recorder.report()]))
+    except (IOError, OSError), e:
+        logger.error('Error writing metrics: %s' % str(e))
+
+
+def unless_streamed(name, function, streamed):
+    """function, skipped when the streaming wrote the outputs of the name stage in this run"""
+    def run():
+        if name not in streamed:
+            return function()
+    return run
+
+
+def run_pipeline(args, num_cores, budget=None):
     # Prepare all required parameters to run the pipeline
-    receptor_id, ligand_id, project_path, project_name, num_models, scoring_function = read_config(args.config)
+    receptor_id, ligand_id, project_path, project_name, num_models, scoring_function, restraints_arguments = \
+        read_config(args.config)
     
     metadata = read_metadata(args.in_metadata)
 
@@ -485,43 +872,254 @@ def run_pipeline(args, num_cores):
     # Prepare workspace and get the relevant paths for the pipeline
     source_data_path, working_path, results_path = prepare_workspace(project_path, log_file)
 
-    # Setup molecules
-    receptor_pdb, ligand_pdb = setup_molecules(working_path, receptor_pdb_file, ligand_pdb_file, project_name)
-   
-    # Activate mocks if required
-    mocking = False
-    mock_folder = ""
-    rec_file = os.path.basename(metadata[receptor_id]['file_path'])
-    lig_file = os.path.basename(metadata[ligand_id]['file_path'])
-    if rec_file == '3mfk_homodimer.pdb' and lig_file == '3mfk_dna.pdb':
-        mocking = True
-        mock_folder = mock_folder_dna
-        logger.info("Mocking Protein-DNA: %s" % mock_folder)
-    if (rec_file == '3mfk_monomer2.pdb' and lig_file == '3mfk_monomer1.pdb') or (rec_file == '3mfk_monomer1.pdb' and lig_file == '3mfk_monomer2.pdb'):
-        mocking = True
-        mock_folder = mock_folder_protein
-        logger.info("Mocking Protein-Protein: %s" % mock_folder)
- 
-    # Sampling step
-    sampling_output_file = sampling(working_path, receptor_pdb, ligand_pdb, project_name, num_cores, mocking, mock_folder)
-    if not check_output(sampling_output_file):
-        logger.error('Sampling process, FTDock output file not found')
-        raise SystemExit
+    # Working files on local storage, spilled to the project storage over the budget, final results copied at the end
+    area = None
+    staged_results_path = results_path
+    if staging_folder:
+        try:
+            area = staging.StagingArea(staging_folder, project_path, staging_budget, working_path)
+            working_path, staged_results_path = area.working_path, area.results_path
+        except (IOError, OSError), e:
+            logger.info('Staging folder not available: %s' % str(e))
+    # Parsed molecules kept with the working files of the job, for its stages and a resumed run
+    molecule.cache_folder = os.path.join(working_path, molecule.cache_folder_name)
+
+    # Cache of previously computed sampling and scoring results
+    cache = None
+    if cache_folder:
+        try:
+            cache = result_cache.ResultCache(cache_folder, cache_max_size)
+        except OSError, e:
+            logger.info('Results cache not available: %s' % str(e))
+    # Receptor grids shared by the jobs docking against the same receptor, precomputed by receptor_grids.py
+    grid_cache.cache_folder, grid_cache.cache_max_size = grid_cache_folder, grid_cache_max_size
+
+    def working_file(suffix):
+        return os.path.join(working_path, "%s%s" % (project_name, suffix))
+
+    receptor_pdb, ligand_pdb = working_file('_rec.pdb'), working_file('_lig.pdb')
+    molecules = [working_file(suffix) for suffix in ['_rec.pdb.H', '_lig.pdb.H', '_rec.pdb.amber', '_lig.pdb.amber']]
+    top_files = ['top_structures.pdb'] + ['top_%d.pdb' % (i+1) for i in range(top_count(num_models))]
+
+    # Pipeline stages with the files they read and write, checkpointed in the working path
+    recorder = metrics.Recorder(project_name)
+    weights = getattr(args, 'rerank', None)
+    scheduler = stages.Scheduler(working_path, check_output, resume=args.resume or bool(weights), budget=budget,
+                                 recorder=recorder)
+    scheduler.add('setup', lambda: setup_molecules(working_path, receptor_pdb_file, ligand_pdb_file, project_name),
+                  inputs=[receptor_pdb_file, ligand_pdb_file],
+                  outputs=[receptor_pdb, ligand_pdb, working_file('.ini')] + molecules,
+                  error='Setup process, pyDock setup files not found')
+    scheduler.add('sampling', lambda: sampling(working_path, receptor_pdb, ligand_pdb, project_name, num_cores, cache),
+                  inputs=[receptor_pdb, ligand_pdb, working_file('.ini')],
+                  outputs=[working_file('.ftdock'), working_file('.rot'), working_file(pose_store.store_suffix)],
+                  requires=['setup'],
+                  error='Sampling process, FTDock output file not found', cores=num_cores,
+                  poses=lambda: count_poses(working_file('.rot')))
+    scoring_poses = [working_file('.rot'), working_file(pose_store.store_suffix)]
+    scoring_requires = ['sampling']
+    # Poses that satisfy too few restraints never reach the clustering and the scoring
+    filtered = restraints_arguments is not None and is_native_scoring(scoring_function)
+    if restraints_arguments is not None and not filtered:
+        logger.info('Restraints are only applied with the native scoring, %s scores every pose' % scoring_function)
+    if filtered:
+        scheduler.add('filter', lambda: filtering(working_path, project_name, restraints_arguments),
+                      inputs=molecules[:2] + [working_file(pose_store.store_suffix)],
+                      outputs=[working_file(restraints.filtered_suffix)], requires=['sampling'],
+                      poses=lambda: len(open_pose_store(working_file(''), restraints.filtered_suffix)))
+        scoring_poses.append(working_file(restraints.filtered_suffix))
+        scoring_requires = ['filter']
+    scoring_inputs = molecules + scoring_poses
+    # Near-duplicate poses collapsed before scoring, their members get the energies of the representative
+    if is_clustered(scoring_function):
+        scheduler.add('clustering', lambda: clustering(working_path, project_name, filtered),
+                      inputs=molecules[1:2] + scoring_poses,
+                      outputs=[working_file(pose_clustering.clusters_suffix)], requires=scoring_requires)
+        scoring_inputs.append(working_file(pose_clustering.clusters_suffix))
+        scoring_requires = ['clustering']
+    scheduler.add('scoring', lambda: scoring(working_path, project_name, num_cores, scoring_function, cache,
+                                             filtered),
+                  inputs=scoring_inputs,
+                  outputs=[working_file('.ene'), energy_table.sidecar_file(working_file('.ene'))],
+                  requires=scoring_requires,
+                  error='Scoring process, energy table file not found', cores=num_cores,
+                  poses=lambda: count_poses(working_file('.ene'), header_lines=2))
+    # The neighbourhood of the best poses scored again, the models and the CSV export ranked with those poses
+    refined = is_refined(scoring_function)
+    if refine_top is not None and not refined:
+        logger.info('Refinement is only run with the native scoring, %s poses are kept as scored' % scoring_function)
+    ranking_ene, ranking_suffix = ranking_files(project_name, refined, filtered)
+    ranking_ene, ranking_store = os.path.join(working_path, ranking_ene), working_file(ranking_suffix)
+    ranking_requires = ['scoring']
+    if refined:
+        scheduler.add('refinement', lambda: refining(working_path, project_name, num_cores, weights, filtered),
+                      inputs=molecules + scoring_poses[-1:] + [working_file('.ene'),
+                                          energy_table.sidecar_file(working_file('.ene'))],
+                      outputs=[ranking_ene, energy_table.sidecar_file(ranking_ene), ranking_store],
+                      requires=['scoring'], error='Refinement process, refined energy table not found',
+                      cores=num_cores,
+                      poses=lambda: count_poses(ranking_ene, header_lines=2) -
+                      count_poses(working_file('.ene'), header_lines=2))
+        ranking_requires = ['refinement']
+    # Models as one PDB file each, archived on the way, or as a single trajectory file
+    trajectory_file = models_trajectory(project_name)
+    if trajectory_file:
+        models_outputs = [os.path.join(working_path, trajectory_file)]
+        count_models = lambda: len(trajectory.Trajectory(models_outputs[0]))
+    else:
+        models_outputs = [os.path.join(working_path, file_name) for file_name in
+                          [models_segment_file, models_dest_folder, models_segment_file + packaging.index_suffix]]
+        count_models = lambda: len(os.listdir(models_outputs[1]))
+    scheduler.add('models', lambda: generate_models(working_path, project_name, num_models, num_cores, refined,
+                                                    filtered),
+                  inputs=molecules[:2] + [ranking_store, ranking_ene],
+                  outputs=models_outputs + [os.path.join(working_path, file_name) for file_name in top_files],
+                  requires=ranking_requires, poses=count_models)
+    # The CSV export only needs the energy table, so it runs next to the models generation
+    scheduler.add('csv', lambda: export_csv(working_path, staged_results_path, project_name, num_models, refined),
+                  inputs=[ranking_ene, energy_table.sidecar_file(ranking_ene)],
+                  outputs=[os.path.join(staged_results_path, results_csv_file)], requires=ranking_requires)
+    scheduler.add('package', lambda: prepare_results(working_path, staged_results_path, project_name, num_models,
+                                                     num_cores),
+                  inputs=[os.path.join(working_path, file_name) for file_name in top_files] + models_outputs[:1],
+                  outputs=[os.path.join(staged_results_path, archive_name(project_name)),
+                           os.path.join(staged_results_path, archive_name(project_name) + packaging.index_suffix)] +
+                          [os.path.join(staged_results_path, file_name)
+                           for file_name in top_files + ([trajectory_file] if trajectory_file else [])],
+                  requires=['models'])
 
-    # Energetic scoring step
-    scoring_output_file = scoring(working_path, project_name, num_cores, scoring_function, mocking, mock_folder)
-    if not check_output(scoring_output_file):
-        logger.error('Scoring process, energy table file not found')
+    def complete():
+        if area:
+            area.flush(result_files(project_name, archive_name(project_name), trajectory_file, top_count(num_models)),
+                       results_path)
+        return mark_as_complete(results_path, project_name, archive_name(project_name), trajectory_file,
+                                top_count(num_models))
+    scheduler.add('complete', complete, outputs=[os.path.join(results_path, json_results_file_name)],
+                  requires=['package', 'csv'])
+    # Sampled poses streamed to the scoring, and the models built, while the sampling goes on
+    streamed = set()
+    if stream_stages and native_sampling and is_native_scoring(scoring_function) and not filtered \
+            and not is_clustered(scoring_function) and not shard_folder:
+        build_models = not refined and not trajectory_file
+        scheduler.stage('sampling').function = lambda: streamed.update(
+            streamed_docking(working_path, receptor_pdb, ligand_pdb, project_name, num_cores, num_models, build_models,
+                             scoring_function, cache))
+        for name in ['scoring'] + (['models'] if build_models else []):
+            scheduler.stage(name).function = unless_streamed(name, scheduler.stage(name).function, streamed)
+    elif stream_stages:
+        logger.info('Streaming needs the native sampling and scoring, without restraints, clustering nor shards')
+    if area:
+        # Room for the models before they are written, the models folder goes to the project storage otherwise
+        expected = {'models': lambda: 2 * models_size(working_path, project_name, num_models),
+                    'package': lambda: models_size(working_path, project_name, num_models)}
+        folders = {'models': [] if trajectory_file else [models_outputs[1]]}
+        for stage in scheduler.stages:
+            stage.function = area.staged(stage.function, stage.inputs + stage.outputs, expected.get(stage.name),
+                                         folders.get(stage.name, []))
+
+    # Re-ranking keeps the scoring checkpoint, the stages after it see the new energy table and run again
+    if weights:
+        if not scheduler.is_current(scheduler.stage('scoring')):
+            logger.error('Re-ranking needs the energies of a finished scoring stage')
+            raise SystemExit
+        recorder.measure('rerank', lambda: rerank(working_path, project_name, weights))
+        scheduler.checkpoint(scheduler.stage('scoring'))
+
+    try:
+        skipped = scheduler.run()
+    except stages.StageFailed, e:
+        logger.error(str(e))
+        write_metrics(recorder, results_path, project_name)
+        if area:
+            logger.info('Staged working files kept for resuming in %s' % area.path)
         raise SystemExit
+    write_metrics(recorder, results_path, project_name)
+    if area:
+        area.remove()
+    if skipped:
+        logger.info('Resumed, skipped up to date stages: %s' % ', '.join(skipped))
 
-    # Generating models step 
-    generate_models(working_path, project_name, num_models)
 
-    # Prepare results and cleaning step
-    prepare_results(working_path, results_path, project_name, num_models)
+def read_batch(batch_json_file):
+    """Jobs of a batch JSON file, a list of config, in_metadata, out_metadata and log_file entries"""
+    jobs = []
+    base_path = os.path.dirname(os.path.abspath(batch_json_file))
+    try:
+        with open(batch_json_file) as data_file:
+            for entry in json.load(data_file):
+                job = argparse.Namespace(config=None, in_metadata=None, out_metadata=None, log_file=None)
+                for field in ['config', 'in_metadata', 'out_metadata', 'log_file']:
+                    if entry.get(field):
+                        setattr(job, field, os.path.join(base_path, entry[field]))
+                jobs.append(job)
+    except Exception, e:
+        logger.error('Error reading batch JSON: %s' % str(e))
+    return jobs
+
+
+def _run_job(job, job_cores, budget):
+    run_pipeline(job, job_cores, budget)
 
-    # Finishing the pipeline
-    json_file_name = mark_as_complete(results_path, project_name)
+
+def run_batch(jobs, num_cores, jobs_in_flight=batch_jobs_in_flight, job_cores=batch_job_cores, resume=False,
+              report_path=None):
+    """Runs several docking jobs sharing a budget of cores.
+
+    Every job runs in its own process and gets job_cores for sampling and
+    scoring. More jobs than compute slots are kept in flight so that the I/O
+    bound stages of a job overlap with the compute stages of the others.
+    The stage metrics of the jobs are aggregated in report_path if given.
+    """
+    job_cores = job_cores or max(1, num_cores // max(1, jobs_in_flight - 1))
+    budget = stages.CoreBudget(num_cores)
+    pending = list(jobs)
+    running = []
+    failed = []
+    start = time.time()
+    while pending or running:
+        while pending and len(running) < jobs_in_flight:
+            job = pending.pop(0)
+            job.resume = resume
+            process = multiprocessing.Process(target=_run_job, args=(job, job_cores, budget))
+            process.start()
+            running.append((job, process))
+        time.sleep(1.0)
+        for job, process in running[:]:
+            if not process.is_alive():
+                process.join()
+                running.remove((job, process))
+                if process.exitcode != 0:
+                    failed.append(job.config)
+                    logger.error('Batch job %s failed' % job.config)
+    elapsed = time.time() - start
+    completed = len(jobs) - len(failed)
+    throughput = completed * 3600.0 / elapsed if elapsed > 0 else 0.0
+    logger.info('Batch finished: %d of %d jobs in %.1f s, %.2f jobs/hour with %d cores' %
+                (completed, len(jobs), elapsed, throughput, num_cores))
+    if report_path:
+        write_batch_metrics(jobs, report_path, completed, failed, elapsed, throughput)
+    return completed, failed, throughput
+
+
+def write_batch_metrics(jobs, report_path, completed, failed, elapsed, throughput):
+    """Aggregates the metrics files of the jobs in a batch report, JSON and Prometheus textfile"""
+    reports = []
+    for job in jobs:
+        try:
+            project_path = read_config(job.config)[2]
+            with open(os.path.join(project_path, json_metrics_file_name)) as input_file:
+                reports.append(json.load(input_file))
+        except Exception:
+            logger.info('No metrics for batch job %s' % job.config)
+    report = metrics.aggregate(reports)
+    report.update({'completed': completed, 'failed': failed, 'elapsed_seconds': elapsed,
+                   'jobs_per_hour': throughput})
+    try:
+        metrics.write_report(report, os.path.join(report_path, batch_metrics_file_name),
+                             os.path.join(report_path, os.path.splitext(batch_metrics_file_name)[0] + '.prom'),
+                             reports + [report])
+    except (IOError, OSError), e:
+        logger.error('Error writing batch metrics: %s' % str(e))
 
 
 if __name__ == "__main__":
@@ -531,20 +1129,54 @@ if __name__ == "__main__":
         
     # Config file
     parser.add_argument("--config", help="Configuration JSON file", 
-                        type=CommandLineParser.valid_file, metavar="config", required=True)
+                        type=CommandLineParser.valid_file, metavar="config")
     # Metadata
-    parser.add_argument("--in_metadata", help="Project metadata", metavar="in_metadata", required=True)
+    parser.add_argument("--in_metadata", help="Project metadata", metavar="in_metadata")
     # Output metadata
-    parser.add_argument("--out_metadata", help="Output metadata", metavar="output_metadata", required=True)
+    parser.add_argument("--out_metadata", help="Output metadata", metavar="output_metadata")
 
     # Log file
-    parser.add_argument("--log_file", help="Log file", metavar="log_file", required=True)
+    parser.add_argument("--log_file", help="Log file", metavar="log_file")
+
+    # Resume a previous run, skipping the stages whose outputs are up to date
+    parser.add_argument("--resume", help="Skip the stages with up to date checkpoints", action="store_true")
+
+    # Rank the energies of a finished run again with new weights, then renew the models and the results
+    parser.add_argument("--rerank", help="New weights of the energy terms, as ele=W,desolv=W,vdw=W",
+                        type=CommandLineParser.valid_weights, metavar="weights")
+
+    # Batch of jobs sharing the cores of the node
+    parser.add_argument("--batch", help="Batch JSON file listing config, in_metadata, out_metadata and log_file",
+                        type=CommandLineParser.valid_file, metavar="batch")
+    parser.add_argument("--cores", help="Cores available to the pipeline",
+                        type=CommandLineParser.valid_integer_number, metavar="cores")
+    parser.add_argument("--jobs", help="Batch jobs running at the same time",
+                        type=CommandLineParser.valid_integer_number, metavar="jobs", default=batch_jobs_in_flight)
+    parser.add_argument("--job_cores", help="Cores for the sampling and scoring of a batch job",
+                        type=CommandLineParser.valid_integer_number, metavar="job_cores", default=batch_job_cores)
+    parser.add_argument("--grid_cache", help="Folder of the receptor grids cached for later jobs",
+                        metavar="grid_cache", default=grid_cache_folder)
 
     args = parser.parse_args()
+    if not args.batch and not (args.config and args.in_metadata and args.out_metadata and args.log_file):
+        parser.error("--config, --in_metadata, --out_metadata and --log_file are required without --batch")
 
+    grid_cache_folder = args.grid_cache
     # Number of cores available
-    num_cores = multiprocessing.cpu_count()
+    num_cores = args.cores or multiprocessing.cpu_count()
+    # External tools found without the shell wrappers
+    tool_environment()
 
-    # Protein-DNA docking pipeline
-    run_pipeline(args, num_cores)
+    if args.batch:
+        # Protein-DNA docking pipeline for every job of the batch
+        jobs = read_batch(args.batch)
+        for job in jobs:
+            job.rerank = args.rerank
+        completed, failed, throughput = run_batch(jobs, num_cores, args.jobs, args.job_cores, args.resume,
+                                                  os.path.dirname(os.path.abspath(args.batch)))
+        if failed:
+            raise SystemExit(1)
+    else:
+        # Protein-DNA docking pipeline
+        run_pipeline(args, num_cores)
 
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+"""Binary energy table sidecar of pyDock .ene files"""
+
+import os
+import json
+import struct
+import hashlib
+import numpy as np
+
+
+""" Energy table configuration """
+sidecar_suffix = '.table'
+header_lines = 2
+magic = 'PYDKENER'
+version = 1
+alignment = 64
+racy_time = 2.0
+""" End of configuration """
+
+columns = ['Conf', 'Ele', 'Desolv', 'VDW', 'Total', 'RANK']
+ene_dtype = np.dtype([('Conf', '<i8'), ('Ele', '<f8'), ('Desolv', '<f8'), ('VDW', '<f8'), ('Total', '<f8'),
+                      ('RANK', '<i8')])
+preamble = struct.Struct('<8sIQI')
+
+
+def sidecar_file(ene_file):
+    return ene_file + sidecar_suffix
+
+
+def parse_ene(ene_file):
+    """Energy table of a text .ene file"""
+    with open(ene_file) as input_file:
+        for _ in range(header_lines):
+            input_file.readline()
+        values = np.fromstring(input_file.read(), sep=' ')
+    if values.size % len(columns):
+        raise ValueError("%s is not a valid energy table" % ene_file)
+    values = values.reshape(-1, len(columns))
+    table = np.zeros(len(values), dtype=ene_dtype)
+    for index, column in enumerate(columns):
+        table[column] = values[:, index]
+    return table
+
+
+def build_table(confs, ele, desolv, vdw, total, ranks):
+    table = np.zeros(len(confs), dtype=ene_dtype)
+    for column, values in zip(columns, [confs, ele, desolv, vdw, total, ranks]):
+        table[column] = values
+    return table
+
+
+def file_digest(file_name):
+    digest = hashlib.sha1()
+    with open(file_name, 'rb') as input_file:
+        for block in iter(lambda: input_file.read(1024 * 1024), ''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def stamp(ene_file):
+    """Size, modification time and SHA-1 of ene_file, recorded in the header of its sidecar"""
+    stat = os.stat(ene_file)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime, 'digest': file_digest(ene_file)}
+
+
+def write_table(ene_file, table):
+    """Writes the sidecar of ene_file, the energies rounded as in the text table, after a JSON header"""
+    table = table.copy()
+    for column in ['Ele', 'Desolv', 'VDW', 'Total']:
+        table[column] = np.round(table[column], 3)
+    text = json.dumps(stamp(ene_file), sort_keys=True)
+    padding = -(preamble.size + len(text)) % alignment
+    partial = sidecar_file(ene_file) + '.partial'
+    with open(partial, 'wb') as output:
+        output.write(preamble.pack(magic, version, len(table), len(text) + padding))
+        output.write(text + ' ' * padding)
+        table.tofile(output)
+    os.rename(partial, sidecar_file(ene_file))
+    return sidecar_file(ene_file)
+
+
+def read_header(table_file):
+    """Header, offset of the rows and number of rows of a sidecar"""
+    with open(table_file, 'rb') as input_file:
+        file_magic, file_version, count, header_length = preamble.unpack(input_file.read(preamble.size))
+        if file_magic != magic or file_version != version:
+            raise ValueError("%s is not a version %d energy table" % (table_file, version))
+        return json.loads(input_file.read(header_length)), preamble.size + header_length, count
+
+
+def load_table(table_file):
+    """Memory map of the rows of a sidecar"""
+    _, offset, count = read_header(table_file)
+    if not count:
+        return np.zeros(0, dtype=ene_dtype)
+    return np.memmap(table_file, dtype=ene_dtype, mode='r', offset=offset, shape=(count,))
+
+
+def is_current(ene_file):
+    """Whether the sidecar holds the table of ene_file as it is now.
+
+    The size and modification time recorded in the sidecar tell most changes
+    apart. A file modified less than racy_time before its sidecar was written
+    may be rewritten within the same timestamp, so its SHA-1 is compared too.
+    """
+    try:
+        header = read_header(sidecar_file(ene_file))[0]
+        stat = os.stat(ene_file)
+        written = os.path.getmtime(sidecar_file(ene_file))
+    except (IOError, OSError, ValueError, struct.error):
+        return False
+    if header['size'] != stat.st_size or header['mtime'] != stat.st_mtime:
+        return False
+    return written - stat.st_mtime > racy_time or header['digest'] == file_digest(ene_file)
+
+
+def open_table(ene_file):
+    """Memory-mapped energy table of ene_file, writing its sidecar first if missing or out of date.
+
+    The parsed table is returned as it is when the sidecar cannot be written.
+    """
+    if not is_current(ene_file):
+        table = parse_ene(ene_file)
+        try:
+            write_table(ene_file, table)
+        except (IOError, OSError):
+            return table
+    return load_table(sidecar_file(ene_file))
+
+
+def by_conf(table):
+    """Copy of the table in Conf order, independent of the ranking"""
+    return np.sort(np.array(table), order='Conf')
+
+
+def top(table, k, column='RANK', descending=False):
+    """k best rows by column, lowest first unless descending, ties kept in RANK order"""
+    k = min(k, len(table))
+    if k <= 0:
+        return table[:0]
+    values = np.asarray(table[column])
+    if descending:
+        values = -values
+    if k < len(table):
+        best = np.argpartition(values, k - 1)[:k]
+    else:
+        best = np.arange(len(table))
+    best = best[np.lexsort((np.asarray(table['RANK'])[best], values[best]))]
+    return table[best]
+
+
+def select(table, column, low=None, high=None):
+    """Rows with low <= column <= high, in table order"""
+    values = np.asarray(table[column])
+    mask = np.ones(len(table), dtype=bool)
+    if low is not None:
+        mask &= values >= low
+    if high is not None:
+        mask &= values <= high
+    return table[mask]
+
+
+def format_row(row):
+    return [str(int(row['Conf']))] + ['%.3f' % row[column] for column in columns[1:5]] + [str(int(row['RANK']))]
+
+
+def to_csv(rows, csv_file, header=True):
+    with open(csv_file, 'w') as output:
+        if header:
+            output.write(','.join(columns) + os.linesep)
+        for row in rows:
+            output.write(','.join(format_row(row)) + os.linesep)
+    return csv_file
+
+
+def to_json(rows, json_file):
+    with open(json_file, 'w') as output:
+        json.dump([dict(zip(columns, [int(row['Conf'])] + [float(row[column]) for column in columns[1:5]] +
+                            [int(row['RANK'])])) for row in rows], output)
+    return json_file
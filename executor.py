@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+"""Runs the external tools of the pipeline with their output drained to a log file"""
+
+import os
+import re
+import time
+import errno
+import pipes
+import signal
+import threading
+import subprocess
+from utils import logger
+
+
+""" Executor configuration """
+poll_interval = 0.5
+kill_grace_period = 10
+progress_step = 5
+taskset_bin = 'taskset'
+progress_pattern = re.compile(r'^\s*(?:[A-Za-z][A-Za-z ]*:?\s+)?(?:(\d+(?:\.\d+)?)\s*%|(\d+)\s*(?:/|of)\s*(\d+))'
+                              r'(?:\s+(?:done|completed?))?\s*$', re.IGNORECASE)
+""" End of configuration """
+
+
+class ExecutionError(Exception):
+    """An external tool failed, timed out or could not be started"""
+    pass
+
+
+def parse_progress(line):
+    """Percentage of a progress line, None for other lines.
+
+    A progress line holds only the figure, as '45%', '9 of 20' or '9/20',
+    after an optional label such as 'Scoring' and before an optional 'done',
+    so dates, paths and counts within other messages are not taken for it.
+    """
+    match = progress_pattern.search(line)
+    if not match:
+        return None
+    if match.group(1) is not None:
+        return min(100.0, float(match.group(1)))
+    done, total = float(match.group(2)), float(match.group(3))
+    if total <= 0 or done > total:
+        return None
+    return 100.0 * done / total
+
+
+def affinity_command(command, cpus):
+    """Shell command pinned to a CPU list such as '0-3,8'"""
+    if not cpus:
+        return command
+    return '%s -c %s /bin/sh -c %s' % (taskset_bin, cpus, pipes.quote(command))
+
+
+def kill_group(process, grace_period=None):
+    """Terminates the process group of process, killing it if it survives the grace period"""
+    grace_period = kill_grace_period if grace_period is None else grace_period
+    for sig, wait in [(signal.SIGTERM, grace_period), (signal.SIGKILL, 0)]:
+        try:
+            os.killpg(process.pid, sig)
+        except OSError, e:
+            if e.errno == errno.ESRCH:
+                return
+            raise
+        deadline = time.time() + wait
+        while process.poll() is None and time.time() < deadline:
+            time.sleep(poll_interval)
+    process.wait()
+
+
+class Execution(object):
+    """An external command running in its own process group.
+
+    stdout and stderr are read continuously by two threads, so a chatty tool
+    never blocks on a full pipe, and every line goes to the log file. Lines
+    reporting a percentage are forwarded to logger.progress under name.
+    """
+    def __init__(self, command, log_file, name=None, timeout=None, cpus=None, cwd=None):
+        self.command = affinity_command(command, cpus)
+        self.log_file = log_file
+        self.name = name
+        self.timeout = timeout
+        self.cwd = cwd
+        self.lock = threading.Lock()
+        self.reported = None
+
+    def report(self, line):
+        percentage = parse_progress(line)
+        if self.name is None or percentage is None:
+            return
+        with self.lock:
+            if self.reported is not None and (percentage == self.reported or
+                                              (percentage - self.reported < progress_step and percentage < 100)):
+                return
+            self.reported = percentage
+        logger.progress("%s (%d%%)" % (self.name, percentage), status="RUNNING")
+
+    def drain(self, stream, log, prefix):
+        for line in iter(stream.readline, b''):
+            with self.lock:
+                log.write(prefix + line)
+                log.flush()
+            self.report(line)
+        stream.close()
+
+    def run(self):
+        """Runs the command to completion, raises ExecutionError unless it exits with 0"""
+        with open(self.log_file, 'a') as log:
+            try:
+                process = subprocess.Popen(self.command, shell=True, cwd=self.cwd, stdout=subprocess.PIPE,
+                                           stderr=subprocess.PIPE, preexec_fn=os.setsid, close_fds=True)
+            except OSError, e:
+                raise ExecutionError("'%s' could not be started: %s" % (self.command, str(e)))
+            readers = [threading.Thread(target=self.drain, args=(process.stdout, log, '')),
+                       threading.Thread(target=self.drain, args=(process.stderr, log, '[stderr] '))]
+            for reader in readers:
+                reader.daemon = True
+                reader.start()
+            start = time.time()
+            try:
+                while process.poll() is None:
+                    if self.timeout and time.time() - start > self.timeout:
+                        kill_group(process)
+                        raise ExecutionError("'%s' timed out after %d s" % (self.command, self.timeout))
+                    time.sleep(poll_interval)
+                # Children left behind by a failed tool are not waited for
+                if process.returncode != 0:
+                    kill_group(process, 0)
+            except BaseException:
+                if process.poll() is None:
+                    kill_group(process)
+                raise
+            finally:
+                for reader in readers:
+                    reader.join(poll_interval * 10)
+            if process.returncode != 0:
+                raise ExecutionError("'%s' exited with code %d, see %s" % (self.command, process.returncode,
+                                                                            self.log_file))
+        return process.returncode
+
+
+def run(command, log_file, name=None, timeout=None, cpus=None, cwd=None):
+    """Runs a shell command, see Execution"""
+    return Execution(command, log_file, name, timeout, cpus, cwd).run()
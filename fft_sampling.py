@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+
+"""FFT rigid-body sampling engine compatible with FTDock output"""
+
+import ctypes
+import os
+import multiprocessing
+import numpy as np
+import grid_cache
+import molecule
+
+
+""" Sampling configuration """
+ftdock_suffix = '.ftdock'
+rot_suffix = '.rot'
+grid_size = 208
+angle_step = 12
+surface_thickness = 1.3
+internal_deterrent = -15.0
+keep_per_rotation = 3
+keep_total = 10000
+atom_radius = 1.8
+rotations_per_chunk = 8
+single_precision = False
+memory_limit = None
+span_step = None
+""" End of configuration """
+
+ftdock_header = """FTDOCK data file
+
+Global Scan
+
+Command line controllable values
+Static molecule                    :: %s
+Mobile molecule                    :: %s
+
+Global grid size                   :: %6d      (user defined calculated)
+Global search angle step           :: %6d      (user defined)
+Global surface thickness           :: %9.2f   (user defined)
+Global internal deterrent value    :: %9.2f   (user defined)
+Electrostatics                     ::    off      (user defined)
+Global keep per rotation           :: %6d      (user defined)
+
+Calculated values
+Global rotations                   :: %6d
+Global total span (angstroms)      :: %10.3f
+Global grid cell span (angstroms)  :: %10.3f
+
+Data
+Type       ID    prvID    SCscore        ESratio         Coordinates            Angles
+
+"""
+ftdock_line = 'G_DATA%7d%9d%11d%15.3f%10d%5d%5d%10d%4d%4d\n'
+
+
+def parameters():
+    """Parameters that define the sampling results"""
+    return (grid_size, angle_step, surface_thickness, internal_deterrent, keep_per_rotation, keep_total, atom_radius,
+            span_step)
+
+
+def write_rot_line(output, rotation, translation, pose_id):
+    """Writes a pose in the pyDock .rot format"""
+    values = tuple(rotation.ravel()) + tuple(translation)
+    output.write(' '.join(['%8.3f' % value for value in values]) + ' %6d\n' % pose_id)
+
+
+def rotation_matrix(z_twist, theta, phi):
+    """Rotation for FTDock angles: z twist, then theta around y, then phi around z"""
+    def around(axis, angle):
+        angle = np.radians(angle)
+        c, s = np.cos(angle), np.sin(angle)
+        if axis == 'z':
+            return np.array([[c, -s, 0.0], [s, c, 0.0], [0.0, 0.0, 1.0]])
+        return np.array([[c, 0.0, s], [0.0, 1.0, 0.0], [-s, 0.0, c]])
+    return np.dot(around('z', phi), np.dot(around('y', theta), around('z', z_twist)))
+
+
+def rotation_angles(step):
+    """FTDock sampling of the rotational space as (z twist, theta, phi) angles.
+
+    On every theta ring phi advances by the largest divisor of 360 that keeps
+    neighbouring orientations no more than one angle step apart.
+    """
+    divisors = [d for d in range(1, 181) if 360 % d == 0]
+    orientations = []
+    for theta in range(0, 181, step):
+        if theta in (0, 180):
+            phi_step = 360
+        else:
+            spacing = lambda d: 2.0 * np.degrees(np.arcsin(np.sin(np.radians(theta)) * np.sin(np.radians(d / 2.0))))
+            phi_step = max([d for d in divisors if spacing(d) <= step + 1e-6])
+        for phi in range(0, 360, phi_step):
+            orientations.append((theta, phi))
+    return [(z_twist, theta, phi) for z_twist in range(0, 360, step) for theta, phi in orientations]
+
+
+def discretise(coordinates, cell_span, size, radius):
+    """Flat indexes of the grid cells whose centre lies within radius of any atom.
+
+    Cell i is centred at (i - size / 2) * cell_span.
+    """
+    reach = int(np.ceil(radius / cell_span))
+    position = coordinates / cell_span + size // 2
+    base = np.rint(position).astype(np.int64)
+    steps = np.arange(-reach, reach + 1)
+    offsets = np.array(np.meshgrid(steps, steps, steps, indexing='ij')).reshape(3, -1).T
+    cells = base[:, np.newaxis, :] + offsets[np.newaxis, :, :]
+    distances = (((cells - position[:, np.newaxis, :]) * cell_span) ** 2).sum(axis=2)
+    cells = cells[distances < radius * radius]
+    cells = cells[np.all((cells >= 0) & (cells < size), axis=1)]
+    return np.unique(np.ravel_multi_index(cells.T, (size, size, size)))
+
+
+def forward(grid):
+    if single_precision:
+        return np.fft.rfftn(grid).astype(np.complex64)
+    return np.fft.rfftn(grid)
+
+
+def inverse(transform, size):
+    return np.fft.irfftn(transform, (size, size, size))
+
+
+class FFTSampler(object):
+    """Shape complementarity search by FFT correlation, as FTDock does"""
+    def __init__(self, receptor_coordinates, ligand_coordinates, size=None, span=None):
+        self.size = size or grid_size
+        self.receptor_center = receptor_coordinates.mean(axis=0)
+        self.ligand_center = ligand_coordinates.mean(axis=0)
+        self.receptor = receptor_coordinates - self.receptor_center
+        self.ligand = ligand_coordinates - self.ligand_center
+        if span is None:
+            receptor_radius = np.sqrt((self.receptor ** 2).sum(axis=1)).max()
+            ligand_radius = np.sqrt((self.ligand ** 2).sum(axis=1)).max()
+            span = 2.0 * (receptor_radius + ligand_radius + atom_radius + surface_thickness)
+            if span_step:
+                # Rounded up, so that ligands of similar size share the cached receptor grid
+                span = np.ceil(span / span_step) * span_step
+        self.span = span
+        self.cell_span = span / self.size
+
+    def receptor_grid(self):
+        """Static grid: the outer surface layer of the molecule scores 1, its core the deterrent value"""
+        inside = np.zeros(self.size ** 3, dtype=bool)
+        inside[discretise(self.receptor, self.cell_span, self.size, atom_radius)] = True
+        inside = inside.reshape((self.size,) * 3)
+        outside = ~inside
+        surface = np.zeros_like(inside)
+        reach = int(np.ceil(surface_thickness / self.cell_span))
+        steps = range(-reach, reach + 1)
+        for offset in [(x, y, z) for x in steps for y in steps for z in steps]:
+            if np.dot(offset, offset) * self.cell_span ** 2 <= surface_thickness ** 2:
+                surface |= np.roll(outside, offset, axis=(0, 1, 2))
+        grid = np.where(inside & surface, 1.0, np.where(inside, internal_deterrent, 0.0))
+        return grid.astype(np.float32 if single_precision else np.float64)
+
+    def receptor_transform(self):
+        """FFT of the receptor grid, memory-mapped from the grid cache when there is one"""
+        parts = (grid_cache.array_digest(self.receptor), self.size, repr(self.span), surface_thickness,
+                 internal_deterrent, atom_radius, single_precision)
+        return grid_cache.cached('receptor_transform', parts,
+                                 lambda: {'transform': forward(self.receptor_grid())})['transform']
+
+    def ligand_grid(self, rotation):
+        grid = np.zeros(self.size ** 3, dtype=np.float32 if single_precision else np.float64)
+        grid[discretise(np.dot(self.ligand, rotation.T), self.cell_span, self.size, atom_radius)] = 1.0
+        return grid.reshape((self.size,) * 3)
+
+    def correlate(self, receptor_transform, rotation, keep):
+        """Best (score, shift) pairs for a rotation, shifts in grid cells"""
+        correlation = inverse(receptor_transform * np.conj(forward(self.ligand_grid(rotation))), self.size)
+        flat = correlation.ravel()
+        best = np.argpartition(-flat, keep)[:keep]
+        best = best[np.argsort(-flat[best], kind='mergesort')]
+        shifts = np.array(np.unravel_index(best, correlation.shape)).T
+        shifts = np.where(shifts >= self.size // 2, shifts - self.size, shifts)
+        return [(int(np.rint(flat[index])), tuple(shift)) for index, shift in zip(best, shifts)]
+
+    def memory_per_worker(self):
+        """Approximate bytes used by one worker correlating a rotation"""
+        cells = self.size ** 3
+        return cells * 8 * 4 if not single_precision else cells * 4 * 6
+
+
+_sampler = None
+_receptor_transform = None
+
+
+def _init_worker(sampler, shared, shape):
+    global _sampler, _receptor_transform
+    _sampler = sampler
+    if isinstance(shared, np.memmap):
+        # Cached transform, its pages shared by the forked workers
+        _receptor_transform = shared
+        return
+    dtype = np.complex64 if single_precision else np.complex128
+    _receptor_transform = np.frombuffer(shared, dtype=dtype).reshape(shape)
+
+
+def _correlate_chunk(chunk):
+    results = []
+    for angles in chunk:
+        rotation = rotation_matrix(*angles)
+        for score, shift in _sampler.correlate(_receptor_transform, rotation, keep_per_rotation):
+            results.append((score, angles, shift))
+    return results
+
+
+def share(array):
+    """Copies an array into shared memory readable by forked workers"""
+    shared = multiprocessing.RawArray(ctypes.c_char, array.nbytes)
+    np.frombuffer(shared, dtype=array.dtype).reshape(array.shape)[...] = array
+    return shared
+
+
+def write_results(project_name, receptor_pdb, ligand_pdb, sampler, num_rotations, results):
+    """Writes the kept poses as .ftdock and .rot files ranked by score"""
+    results.sort(key=lambda result: (-result[0], result[1], result[2]))
+    results = results[:keep_total]
+    ftdock_file = "%s%s" % (project_name, ftdock_suffix)
+    with open(ftdock_file, 'w') as output:
+        output.write(ftdock_header % (os.path.basename(receptor_pdb), os.path.basename(ligand_pdb), sampler.size,
+                                      angle_step, surface_thickness, internal_deterrent, keep_per_rotation,
+                                      num_rotations, sampler.span, sampler.cell_span))
+        for pose_id, (score, angles, shift) in enumerate(results):
+            output.write(ftdock_line % ((pose_id + 1, 0, score, 0.0) + tuple(shift) + tuple(angles)))
+    with open("%s%s" % (project_name, rot_suffix), 'w') as output:
+        for pose_id, (score, angles, shift) in enumerate(results):
+            translation = sampler.receptor_center + np.array(shift) * sampler.cell_span
+            write_rot_line(output, rotation_matrix(*angles), translation, pose_id + 1)
+    return ftdock_file
+
+
+def worker_arguments(sampler, num_cores):
+    """Arguments of _init_worker for the sampler, and the number of workers of num_cores the memory limit allows"""
+    receptor_transform = sampler.receptor_transform()
+    shared = receptor_transform if isinstance(receptor_transform, np.memmap) else share(receptor_transform)
+    workers = num_cores
+    if memory_limit:
+        available = memory_limit * 1024 * 1024 - receptor_transform.nbytes
+        workers = max(1, min(num_cores, int(available // sampler.memory_per_worker())))
+    return (sampler, shared, receptor_transform.shape), workers
+
+
+def chunked(angles):
+    """Rotations split in the chunks the workers correlate"""
+    return [angles[start:start + rotations_per_chunk] for start in range(0, len(angles), rotations_per_chunk)]
+
+
+def scan(sampler, angles, num_cores):
+    """Correlates every rotation, yielding the (score, angles, shift) results of each chunk as it finishes"""
+    arguments, workers = worker_arguments(sampler, num_cores)
+    chunks = chunked(angles)
+    if workers > 1 and len(chunks) > 1:
+        pool = multiprocessing.Pool(workers, _init_worker, arguments)
+        try:
+            for chunk_results in pool.imap_unordered(_correlate_chunk, chunks):
+                yield chunk_results
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        _init_worker(*arguments)
+        for chunk in chunks:
+            yield _correlate_chunk(chunk)
+
+
+def sample(project_name, receptor_pdb, ligand_pdb, num_cores, angles=None):
+    """Runs the global scan and writes the project .ftdock and .rot files"""
+    receptor_coordinates = molecule.load(receptor_pdb).coordinates
+    ligand_coordinates = molecule.load(ligand_pdb).coordinates
+    sampler = FFTSampler(receptor_coordinates, ligand_coordinates)
+    angles = angles or rotation_angles(angle_step)
+    results = []
+    for chunk_results in scan(sampler, angles, num_cores):
+        results.extend(chunk_results)
+    return write_results(project_name, receptor_pdb, ligand_pdb, sampler, len(angles), results)
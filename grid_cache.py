@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+"""Memory-mapped cache of receptor grids, reused by the jobs that dock several ligands against one receptor"""
+
+import os
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+import result_cache
+
+
+""" Grid cache configuration """
+cache_folder = None
+cache_max_size = 8 * 1024 ** 3
+""" End of configuration """
+
+
+def array_digest(array):
+    """SHA-1 of the type, shape and content of an array"""
+    array = np.ascontiguousarray(array)
+    digest = hashlib.sha1('%s %s' % (array.dtype.str, array.shape))
+    digest.update(array.data)
+    return digest.hexdigest()
+
+
+class GridCache(result_cache.ResultCache):
+    """ResultCache whose entries hold .npy arrays, memory-mapped in place instead of copied out"""
+    def load(self, key):
+        """Arrays of the entry by name, read-only memory maps, None if there is no such entry"""
+        entry = self.entry_path(key)
+        try:
+            arrays = dict((name[:-len('.npy')], np.load(os.path.join(entry, name), mmap_mode='r'))
+                          for name in os.listdir(entry) if name.endswith('.npy'))
+            os.utime(entry, None)
+        except (IOError, OSError, ValueError):
+            # Missing, or evicted by another job meanwhile
+            return None
+        return arrays
+
+    def save(self, key, arrays, replace=False):
+        """Atomically stores the arrays (name to array) under key, in place of the stored ones if replace"""
+        entry = self.entry_path(key)
+        if os.path.exists(entry) and not replace:
+            return entry
+        staging = tempfile.mkdtemp(prefix=result_cache.tmp_prefix, dir=self.path)
+        try:
+            for name, array in arrays.items():
+                np.save(os.path.join(staging, name + '.npy'), array)
+            if os.path.exists(entry):
+                # Jobs that mapped the old arrays keep reading them until they close them
+                old = tempfile.mkdtemp(prefix=result_cache.tmp_prefix, dir=self.path)
+                os.rename(entry, os.path.join(old, 'entry'))
+                shutil.rmtree(old, ignore_errors=True)
+            os.rename(staging, entry)
+        except OSError:
+            # Another job stored the same entry first
+            shutil.rmtree(staging, ignore_errors=True)
+        self.evict()
+        return entry
+
+
+def open_cache():
+    """GridCache of the configured folder, None without one"""
+    if not cache_folder:
+        return None
+    try:
+        return GridCache(cache_folder, cache_max_size)
+    except OSError:
+        return None
+
+
+def fetch(kind, parts):
+    """Cached arrays of kind for parts, the values that define them, None if they are not cached"""
+    cache = open_cache()
+    if cache is None:
+        return None
+    return cache.load(cache.key(kind, *parts))
+
+
+def keep(kind, parts, arrays, replace=False):
+    """Stores the arrays of kind for parts, if there is a grid cache"""
+    cache = open_cache()
+    if cache is not None:
+        try:
+            cache.save(cache.key(kind, *parts), arrays, replace)
+        except (IOError, OSError):
+            pass
+
+
+def cached(kind, parts, build):
+    """Arrays returned by build(), a dict of names to arrays, from the grid cache when there is one.
+
+    A stored entry is memory-mapped, so the workers forked by a job share its pages.
+    """
+    arrays = fetch(kind, parts)
+    if arrays is None:
+        arrays = build()
+        keep(kind, parts, arrays)
+    return arrays
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+"""Per-stage performance metrics of the docking pipeline"""
+
+import os
+import json
+import time
+import resource
+import threading
+
+
+""" Metrics configuration """
+metric_prefix = 'pydockdna'
+proc_io_file = '/proc/self/io'
+""" End of configuration """
+
+# Metric name, help text and record field of every per-stage value
+stage_metrics = [('stage_wall_seconds', 'Wall time of the stage', 'wall_seconds'),
+                 ('stage_cpu_seconds', 'CPU time of the pipeline process during the stage', 'cpu_seconds'),
+                 ('stage_children_cpu_seconds', 'CPU time of the finished child processes of the stage',
+                  'children_cpu_seconds'),
+                 ('stage_peak_rss_bytes', 'Peak resident memory of the process or its children so far',
+                  'peak_rss_bytes'),
+                 ('stage_read_bytes', 'Bytes read from storage during the stage', 'read_bytes'),
+                 ('stage_written_bytes', 'Bytes written to storage during the stage', 'written_bytes'),
+                 ('stage_files', 'Output files of the stage', 'files'),
+                 ('stage_poses', 'Poses sampled, scored or built by the stage', 'poses'),
+                 ('stage_skipped', '1 if the stage was up to date and skipped', 'skipped')]
+
+
+def io_counters():
+    """Bytes read and written by the process and its finished children, None if unknown"""
+    try:
+        with open(proc_io_file) as input_file:
+            counters = dict(line.split(':') for line in input_file if ':' in line)
+        return int(counters['read_bytes']), int(counters['write_bytes'])
+    except (IOError, KeyError, ValueError):
+        return None, None
+
+
+def snapshot():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    read_bytes, written_bytes = io_counters()
+    return {'time': time.time(), 'cpu': own.ru_utime + own.ru_stime,
+            'children_cpu': children.ru_utime + children.ru_stime,
+            'peak_rss': max(own.ru_maxrss, children.ru_maxrss) * 1024,
+            'read_bytes': read_bytes, 'written_bytes': written_bytes}
+
+
+def difference(after, before, field):
+    if after[field] is None or before[field] is None:
+        return None
+    return after[field] - before[field]
+
+
+class Recorder(object):
+    """Collects the metrics of the stages of one job.
+
+    CPU, memory and I/O counters belong to the whole process, so stages
+    running at the same time share them.
+    """
+    def __init__(self, job):
+        self.job = job
+        self.stages = {}
+        self.order = []
+        self.lock = threading.Lock()
+
+    def record(self, name, **values):
+        with self.lock:
+            if name not in self.stages:
+                self.stages[name] = {'skipped': 0}
+                self.order.append(name)
+            self.stages[name].update(values)
+
+    def measure(self, name, function):
+        """Runs function recording its wall time, CPU time, memory and I/O"""
+        before = snapshot()
+        try:
+            return function()
+        finally:
+            after = snapshot()
+            self.record(name, wall_seconds=after['time'] - before['time'],
+                        cpu_seconds=after['cpu'] - before['cpu'],
+                        children_cpu_seconds=after['children_cpu'] - before['children_cpu'],
+                        peak_rss_bytes=after['peak_rss'],
+                        read_bytes=difference(after, before, 'read_bytes'),
+                        written_bytes=difference(after, before, 'written_bytes'))
+
+    def skip(self, name):
+        self.record(name, skipped=1)
+
+    def report(self):
+        return {'job': self.job, 'stages': [dict(stage=name, **self.stages[name]) for name in self.order]}
+
+    def write(self, json_file, prometheus_file):
+        write_report(self.report(), json_file, prometheus_file)
+
+
+def prometheus(reports):
+    """Prometheus text exposition of the stage metrics of several job reports"""
+    lines = []
+    for metric, help_text, field in stage_metrics:
+        name = '%s_%s' % (metric_prefix, metric)
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s gauge' % name)
+        for report in reports:
+            for stage in report['stages']:
+                if stage.get(field) is not None:
+                    lines.append('%s{job="%s",stage="%s"} %s' % (name, report['job'], stage['stage'],
+                                                                 repr(float(stage[field]))))
+    throughputs = [report for report in reports if report.get('jobs_per_hour') is not None]
+    if throughputs:
+        name = '%s_jobs_per_hour' % metric_prefix
+        lines.append('# HELP %s Throughput of the batch' % name)
+        lines.append('# TYPE %s gauge' % name)
+        for report in throughputs:
+            lines.append('%s{job="%s"} %s' % (name, report['job'], repr(float(report['jobs_per_hour']))))
+    return '\n'.join(lines) + '\n'
+
+
+def aggregate(reports):
+    """Totals per stage over several job reports, wall and CPU times summed, memory maximum"""
+    totals = {}
+    order = []
+    for report in reports:
+        for stage in report['stages']:
+            if stage['stage'] not in totals:
+                totals[stage['stage']] = {'jobs': 0}
+                order.append(stage['stage'])
+            total = totals[stage['stage']]
+            total['jobs'] += 1
+            for _, _, field in stage_metrics:
+                if stage.get(field) is None:
+                    continue
+                if field == 'peak_rss_bytes':
+                    total[field] = max(total.get(field, 0), stage[field])
+                else:
+                    total[field] = total.get(field, 0) + stage[field]
+    return {'job': 'batch', 'stages': [dict(stage=name, **totals[name]) for name in order]}
+
+
+def write_atomically(file_name, content):
+    with open(file_name + '.partial', 'w') as output:
+        output.write(content)
+    os.rename(file_name + '.partial', file_name)
+
+
+def write_report(report, json_file, prometheus_file, reports=None):
+    """Writes a report as JSON and the reports (default, just this one) as a Prometheus textfile"""
+    write_atomically(json_file, json.dumps(report, indent=4, sort_keys=True))
+    if prometheus_file:
+        write_atomically(prometheus_file, prometheus(reports or [report]))
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+"""In-process builder of docking models from pyDock .rot files"""
+
+import os
+import numpy as np
+import molecule
+
+
+""" Builder configuration """
+receptor_suffix = '_rec.pdb.H'
+ligand_suffix = '_lig.pdb.H'
+rot_suffix = '.rot'
+poses_per_chunk = 256
+""" End of configuration """
+
+
+def read_rot(rot_file):
+    """Reads a .rot file as rotation matrices, translations and pose ids"""
+    with open(rot_file) as input_file:
+        data = np.fromstring(input_file.read(), sep=' ')
+    data = data.reshape(-1, 13)
+    rotations = data[:, :9].reshape(-1, 3, 3)
+    translations = data[:, 9:12]
+    ids = data[:, 12].astype(np.int64)
+    return rotations, translations, ids
+
+
+def read_pdb(pdb_file):
+    """Reads a PDB file keeping its lines and the coordinates of its atoms"""
+    lines = []
+    coordinates = []
+    with open(pdb_file) as input_file:
+        for line in input_file:
+            if line.startswith('ATOM') or line.startswith('HETATM'):
+                coordinates.append((float(line[30:38]), float(line[38:46]), float(line[46:54])))
+            lines.append(line)
+    return lines, np.array(coordinates, dtype=np.float64).reshape(-1, 3)
+
+
+def transform(coordinates, center, rotations, translations):
+    """Applies a batch of rigid-body transformations to a set of coordinates.
+
+    Coordinates are centered, rotated and then moved to the new center, which
+    is how pyDock interprets the translation stored in .rot files.
+    Returns an array of shape (poses, atoms, 3).
+    """
+    centered = coordinates - center
+    return np.einsum('nij,aj->nai', rotations, centered) + translations[:, np.newaxis, :]
+
+
+class ModelBuilder(object):
+    """Builds complex models from the receptor, the ligand and a .rot file or a pose store"""
+    def __init__(self, receptor_pdb, ligand_pdb, rot_file, store=None):
+        self.receptor = molecule.load(receptor_pdb)
+        self.receptor_block = self.receptor.text()
+        self.ligand = molecule.load(ligand_pdb)
+        self.ligand_coordinates = self.ligand.coordinates
+        self.ligand_center = self.ligand_coordinates.mean(axis=0)
+        self.store = store
+        if store is None:
+            self.rotations, self.translations, ids = read_rot(rot_file)
+        else:
+            ids = store.records['id']
+        self.pose_index = dict((pose_id, index) for index, pose_id in enumerate(ids))
+
+    def format_model(self, coordinates):
+        """Formats a model as PDB text: receptor as is plus the moved ligand"""
+        return self.receptor_block + self.ligand.text(coordinates)
+
+    def build(self, confs):
+        """Yields (conf, PDB text) for the given pose ids, in order"""
+        for conf, coordinates in self.coordinates(confs):
+            yield conf, self.format_model(coordinates)
+
+    def coordinates(self, confs):
+        """Yields (conf, moved ligand coordinates) for the given pose ids, in order"""
+        confs = [int(conf) for conf in confs]
+        for start in range(0, len(confs), poses_per_chunk):
+            chunk = confs[start:start+poses_per_chunk]
+            indexes = [self.pose_index[conf] for conf in chunk]
+            if self.store is None:
+                rotations, translations = self.rotations[indexes], self.translations[indexes]
+            else:
+                rotations, translations, _ = self.store.select(indexes)
+            moved = transform(self.ligand_coordinates, self.ligand_center, rotations, translations)
+            for conf, coordinates in zip(chunk, moved):
+                yield conf, coordinates
+
+
+def make_pdb(project_name, confs, prefix, output_path, archive=None, archive_path='', store=None):
+    """Writes one PDB model per conformation, named as pyDock makePDB does.
+
+    Models are also added to archive, an ArchiveWriter, under archive_path if given.
+    Poses come from store, a memory-mapped PoseStore, instead of the .rot file if given.
+    """
+    builder = ModelBuilder("%s%s" % (project_name, receptor_suffix),
+                           "%s%s" % (project_name, ligand_suffix),
+                           "%s%s" % (project_name, rot_suffix), store)
+    file_names = []
+    for conf, model in builder.build(confs):
+        file_name = os.path.join(output_path, "%s%s_%d.pdb" % (prefix, project_name, conf))
+        with open(file_name, 'w') as output:
+            output.write(model)
+        if archive:
+            archive.add_bytes(os.path.join(archive_path, os.path.basename(file_name)), model)
+        file_names.append(file_name)
+    return file_names
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+"""Fixed-column PDB and .amber parsers with a cached NumPy representation of the molecules"""
+
+import os
+import numpy as np
+import result_cache
+
+
+""" Molecule configuration """
+cache_folder = None
+cache_folder_name = '.molecules'
+cache_suffix = '.npz'
+""" End of configuration """
+
+# Atom record columns kept as text, the PDB name of the field and its slice
+text_columns = [('record', 0, 6), ('serial', 6, 11), ('name', 12, 16), ('alt_loc', 16, 17), ('res_name', 17, 20),
+                ('chain', 21, 22), ('res_seq', 22, 26), ('i_code', 26, 27)]
+head_length = 30
+tail_start = 54
+
+# Loaded molecules and parameter tables by file, size and modification time
+_loaded = {}
+
+
+def column(rows, start, end):
+    """Stripped text of a column of a fixed-width text array"""
+    width = rows.dtype.itemsize
+    if not len(rows) or start >= width:
+        return np.zeros(len(rows), dtype='S1')
+    end = min(end, width)
+    matrix = rows.view('S1').reshape(len(rows), width)
+    return np.char.strip(np.ascontiguousarray(matrix[:, start:end]).view('S%d' % (end - start)).ravel())
+
+
+def numbers(strings):
+    """Floats of a text column, blank fields as 0"""
+    strings = np.char.strip(strings)
+    return np.where(strings == '', '0', strings).astype(np.float64)
+
+
+def parse_pdb(pdb_file):
+    """Atom records of a PDB file as a structured array, and the other lines with their positions.
+
+    Every atom keeps its text before and after the coordinates, so it is
+    written back exactly as it was read.
+    """
+    with open(pdb_file) as input_file:
+        lines = input_file.readlines()
+    is_atom = np.array([line.startswith('ATOM') or line.startswith('HETATM') for line in lines], dtype=bool)
+    atom_lines = [line for line, atom in zip(lines, is_atom) if atom]
+    heads = np.array([line[:head_length] for line in atom_lines], dtype='S%d' % head_length)
+    tails = np.array([line[tail_start:] for line in atom_lines] or [''])[:len(atom_lines)]
+    coordinates = np.array([line[head_length:tail_start] for line in atom_lines], dtype='S24')
+    dtype = [(name, 'S%d' % (end - start)) for name, start, end in text_columns]
+    dtype += [('coordinates', '<f8', (3,)), ('occupancy', '<f4'), ('b_factor', '<f4'), ('element', 'S2'),
+              ('head', heads.dtype), ('tail', tails.dtype)]
+    atoms = np.zeros(len(atom_lines), dtype=dtype)
+    for name, start, end in text_columns:
+        atoms[name] = column(heads, start, end)
+    if len(atom_lines):
+        atoms['coordinates'] = coordinates.view('S1').reshape(-1, 24).copy().view('S8').astype(np.float64)
+        atoms['occupancy'] = numbers(column(tails, 0, 6))
+        atoms['b_factor'] = numbers(column(tails, 6, 12))
+        atoms['element'] = column(tails, 22, 24)
+    atoms['head'] = heads
+    atoms['tail'] = tails
+    other_lines = [line for line, atom in zip(lines, is_atom) if not atom]
+    others = np.zeros(len(other_lines), dtype=[('position', '<i8'),
+                                               ('line', 'S%d' % max([1] + [len(line) for line in other_lines]))])
+    others['position'] = np.cumsum(is_atom)[~is_atom] if len(lines) else []
+    others['line'] = other_lines
+    return atoms, others
+
+
+def parse_amber(amber_file):
+    """Rows of a .amber file (chain.resname.resnum.atom, type, charge, mass, radius) as a structured array"""
+    rows = []
+    with open(amber_file) as input_file:
+        for line in input_file:
+            fields = line.split()
+            if len(fields) >= 5:
+                rows.append((fields[0], fields[1], float(fields[2]), float(fields[3]), float(fields[4])))
+    names = max([1] + [len(row[0]) for row in rows])
+    types = max([1] + [len(row[1]) for row in rows])
+    return np.array(rows, dtype=[('name', 'S%d' % names), ('type', 'S%d' % types), ('charge', '<f8'),
+                                 ('mass', '<f8'), ('radius', '<f8')])
+
+
+def cache_file(digest):
+    return os.path.join(cache_folder, digest + cache_suffix)
+
+
+def cached(file_name, parser, names):
+    """Arrays parsed from file_name, read from the .npz cache of its content if there is one.
+
+    The cache goes into the configured cache folder, usually in the working
+    path of the job, keyed by the SHA-1 of the file. Without a cache folder,
+    or when the cache cannot be written, the arrays are parsed again.
+    """
+    stat = os.stat(file_name)
+    key = (os.path.realpath(file_name), stat.st_size, stat.st_mtime, parser.__name__)
+    if key in _loaded:
+        return _loaded[key]
+    npz_file = cache_file(result_cache.file_digest(file_name)) if cache_folder else None
+    arrays = None
+    if npz_file:
+        try:
+            with np.load(npz_file) as data:
+                arrays = tuple(data[name] for name in names)
+        except (IOError, KeyError, ValueError):
+            pass
+    if arrays is None:
+        arrays = parser(file_name)
+        if not isinstance(arrays, tuple):
+            arrays = (arrays,)
+        if npz_file:
+            try:
+                if not os.path.exists(os.path.dirname(npz_file)):
+                    os.makedirs(os.path.dirname(npz_file))
+                with open(npz_file + '.partial', 'wb') as output:
+                    np.savez(output, **dict(zip(names, arrays)))
+                os.rename(npz_file + '.partial', npz_file)
+            except (IOError, OSError):
+                pass
+    _loaded[key] = arrays
+    return arrays
+
+
+class Molecule(object):
+    """Atoms of a PDB file, written back as PDB text with the same or new coordinates"""
+    def __init__(self, atoms, others):
+        self.atoms = atoms
+        self.others = others
+
+    def __len__(self):
+        return len(self.atoms)
+
+    @property
+    def coordinates(self):
+        return self.atoms['coordinates']
+
+    def keys(self):
+        """chain.resname.resnum.atom keys, as in .amber files"""
+        return ['%s.%s.%s.%s' % key for key in zip(self.atoms['chain'], self.atoms['res_name'],
+                                                   self.atoms['res_seq'], self.atoms['name'])]
+
+    def lines(self, coordinates=None):
+        """PDB lines of the molecule, with its atoms at coordinates if given"""
+        if coordinates is None:
+            coordinates = self.coordinates
+        atoms = ['%s%8.3f%8.3f%8.3f%s' % (head, x, y, z, tail) for head, (x, y, z), tail
+                 in zip(self.atoms['head'], coordinates.tolist(), self.atoms['tail'])]
+        if not len(self.others):
+            return atoms
+        lines = []
+        start = 0
+        for position, line in zip(self.others['position'].tolist(), self.others['line']):
+            lines.extend(atoms[start:position])
+            lines.append(line)
+            start = position
+        lines.extend(atoms[start:])
+        return lines
+
+    def text(self, coordinates=None):
+        return ''.join(self.lines(coordinates))
+
+    def write(self, pdb_file, coordinates=None):
+        with open(pdb_file, 'w') as output:
+            output.write(self.text(coordinates))
+        return pdb_file
+
+
+def load(pdb_file):
+    """Molecule of a PDB file, parsed once per process and cached on disk by content"""
+    return Molecule(*cached(pdb_file, parse_pdb, ['atoms', 'others']))
+
+
+def load_amber(amber_file):
+    """Parameter table of a .amber file, parsed once per process and cached on disk by content"""
+    return cached(amber_file, parse_amber, ['amber'])[0]
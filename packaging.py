@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+
+"""Parallel block-compressed tar archives with an index of member offsets"""
+
+import os
+import json
+import zlib
+import time
+import struct
+import tarfile
+import collections
+from multiprocessing.pool import ThreadPool
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+""" Packaging configuration """
+block_size = 4 * 1024 * 1024
+gzip_level = 6
+zstd_level = 3
+index_suffix = '.index.json'
+""" End of configuration """
+
+archive_suffixes = {'gzip': '.tgz', 'zstd': '.tar.zst'}
+
+
+def available_format(compression):
+    """The compression itself, or gzip when zstd is asked for without the zstandard module"""
+    if compression == 'zstd' and zstandard is None:
+        return 'gzip'
+    return compression
+
+
+def gzip_member(data):
+    """data as a standalone gzip member, members can be concatenated into one file"""
+    compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    body = compressor.compress(data) + compressor.flush()
+    header = '\x1f\x8b\x08\x00' + struct.pack('<I', int(time.time())) + '\x00\xff'
+    return header + body + struct.pack('<II', zlib.crc32(data) & 0xffffffff, len(data) & 0xffffffff)
+
+
+def compress_block(data, compression):
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor(level=zstd_level).compress(data)
+    return gzip_member(data)
+
+
+def decompress_block(data, compression):
+    if compression == 'zstd':
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(data)
+
+
+class ArchiveWriter(object):
+    """Tar stream cut in blocks that a pool of threads compresses independently.
+
+    Concatenated gzip members (or zstd frames) make a regular .tgz (.tar.zst).
+    The index lists the uncompressed and compressed offsets of every block and
+    the data offset of every member, so single members can be read back by
+    decompressing only the blocks that hold them. An archive closed without
+    finishing is a segment that a later archive can start from as it is.
+    """
+    def __init__(self, archive_file, compression='gzip', threads=1, segment=None):
+        self.archive_file = archive_file
+        self.compression = compression
+        self.output = open(archive_file + '.partial', 'wb')
+        self.pool = ThreadPool(max(1, threads))
+        self.window = 2 * max(1, threads)
+        self.pending = collections.deque()
+        self.buffer = []
+        self.buffered = 0
+        self.position = 0
+        self.compressed_position = 0
+        self.blocks = []
+        self.members = []
+        if segment:
+            self.append_segment(segment)
+
+    def append_segment(self, segment_file):
+        """Starts the archive with the blocks and members of an unfinished archive"""
+        with open(segment_file + index_suffix) as input_file:
+            index = json.load(input_file)
+        with open(segment_file, 'rb') as input_file:
+            for chunk in iter(lambda: input_file.read(1 << 20), b''):
+                self.output.write(chunk)
+        self.blocks = index['blocks']
+        self.members = index['members']
+        self.position = index['size']
+        self.compressed_position = index['compressed_size']
+
+    def write(self, data):
+        self.buffer.append(data)
+        self.buffered += len(data)
+        self.position += len(data)
+        if self.buffered >= block_size:
+            self.flush_block()
+
+    def flush_block(self):
+        if not self.buffered:
+            return
+        data = ''.join(self.buffer)
+        start = self.position - len(data)
+        self.buffer = []
+        self.buffered = 0
+        self.pending.append((start, len(data), self.pool.apply_async(compress_block, (data, self.compression))))
+        while len(self.pending) > self.window:
+            self.write_next()
+
+    def write_next(self):
+        start, size, result = self.pending.popleft()
+        compressed = result.get()
+        self.output.write(compressed)
+        self.blocks.append([start, size, self.compressed_position, len(compressed)])
+        self.compressed_position += len(compressed)
+
+    def add_header(self, info):
+        self.write(info.tobuf(tarfile.GNU_FORMAT))
+
+    def add_bytes(self, arcname, data, mtime=None, mode=0644):
+        """Adds a member with data as its content"""
+        info = tarfile.TarInfo(arcname)
+        info.size = len(data)
+        info.mtime = int(time.time() if mtime is None else mtime)
+        info.mode = mode
+        self.add_header(info)
+        self.members.append([arcname, self.position, len(data)])
+        self.write(data)
+        self.pad(len(data))
+
+    def add_file(self, file_name, arcname):
+        """Adds a regular file, read in blocks"""
+        stat = os.stat(file_name)
+        info = tarfile.TarInfo(arcname)
+        info.size = stat.st_size
+        info.mtime = int(stat.st_mtime)
+        info.mode = stat.st_mode & 07777
+        self.add_header(info)
+        self.members.append([arcname, self.position, stat.st_size])
+        written = 0
+        with open(file_name, 'rb') as input_file:
+            for chunk in iter(lambda: input_file.read(block_size), b''):
+                chunk = chunk[:stat.st_size - written]
+                self.write(chunk)
+                written += len(chunk)
+        if written != stat.st_size:
+            raise IOError("%s changed size while archiving" % file_name)
+        self.pad(written)
+
+    def add_directory(self, arcname):
+        info = tarfile.TarInfo(arcname)
+        info.type = tarfile.DIRTYPE
+        info.mode = 0755
+        info.mtime = int(time.time())
+        self.add_header(info)
+
+    def add_tree(self, path, arcname, skip=()):
+        """Adds a file or a folder with everything below it"""
+        if not os.path.isdir(path):
+            self.add_file(path, arcname)
+            return
+        self.add_directory(arcname)
+        for name in sorted(os.listdir(path)):
+            if name not in skip:
+                self.add_tree(os.path.join(path, name), os.path.join(arcname, name))
+
+    def pad(self, size):
+        if size % tarfile.BLOCKSIZE:
+            self.write(tarfile.NUL * (tarfile.BLOCKSIZE - size % tarfile.BLOCKSIZE))
+
+    def close(self, finish=True):
+        """Writes the pending blocks, the tar end if finish, and the index"""
+        if finish:
+            self.write(tarfile.NUL * (2 * tarfile.BLOCKSIZE))
+            if self.position % tarfile.RECORDSIZE:
+                self.write(tarfile.NUL * (tarfile.RECORDSIZE - self.position % tarfile.RECORDSIZE))
+        self.flush_block()
+        while self.pending:
+            self.write_next()
+        self.pool.close()
+        self.pool.join()
+        self.output.close()
+        os.rename(self.archive_file + '.partial', self.archive_file)
+        with open(self.archive_file + index_suffix, 'w') as output:
+            json.dump({'format': self.compression, 'size': self.position,
+                       'compressed_size': self.compressed_position,
+                       'blocks': self.blocks, 'members': self.members}, output)
+        return self.archive_file
+
+
+def read_member(archive_file, name):
+    """Content of a member, decompressing only the blocks that hold it"""
+    with open(archive_file + index_suffix) as input_file:
+        index = json.load(input_file)
+    members = [member for member in index['members'] if member[0] == name]
+    if not members:
+        raise KeyError("%s is not in %s" % (name, archive_file))
+    _, offset, size = members[0]
+    end = offset + size
+    data = []
+    with open(archive_file, 'rb') as input_file:
+        for start, length, compressed_offset, compressed_length in index['blocks']:
+            if start + length <= offset or start >= end:
+                continue
+            input_file.seek(compressed_offset)
+            block = decompress_block(input_file.read(compressed_length), index['format'])
+            data.append(block[max(0, offset - start):end - start])
+    return ''.join(data)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+"""Clustering of redundant docking poses by ligand RMSD, so that only one pose per cluster is scored"""
+
+import os
+import numpy as np
+import model_builder
+import molecule
+import scoring_engine
+
+
+""" Clustering configuration """
+clusters_suffix = '.clusters.npy'
+""" End of configuration """
+
+
+def gyration_tensor(coordinates):
+    """Second moment of the centered coordinates, all a rigid ligand RMSD depends on"""
+    centered = coordinates - coordinates.mean(axis=0)
+    return centered.T.dot(centered) / len(centered)
+
+
+def ligand_rmsd(tensor, rotations_a, translations_a, rotations_b, translations_b):
+    """Ligand RMSD between pairs of poses of the same rigid ligand, without moving its atoms.
+
+    With poses R(x - c) + t, the mean squared deviation is |ta - tb|^2 plus
+    2 tr(S) - 2 tr(Ra S Rb^T), S being the gyration tensor of the ligand.
+    """
+    cross = np.einsum('nij,jk,nik->n', rotations_a, tensor, rotations_b)
+    squared = ((translations_a - translations_b) ** 2).sum(axis=1) + 2.0 * np.trace(tensor) - 2.0 * cross
+    return np.sqrt(np.maximum(squared, 0.0))
+
+
+def cluster(rotations, translations, ligand_coordinates, cutoff, order=None):
+    """Representative pose index of every pose, poses closer than cutoff (ligand RMSD) collapsed greedily.
+
+    Poses are visited in order (default, as given). An unassigned pose becomes
+    a representative and takes the unassigned poses within cutoff of it.
+    Candidate pairs come from a cell list of the translations, since the
+    ligand RMSD is never below the distance between the ligand centres.
+    """
+    num_poses = len(translations)
+    representatives = -np.ones(num_poses, dtype=np.int64)
+    if not num_poses:
+        return representatives
+    grid = scoring_engine.NeighbourGrid(translations, cutoff)
+    first, second, _ = grid.pairs(translations, cutoff)
+    distinct = first != second
+    first, second = first[distinct], second[distinct]
+    close = ligand_rmsd(gyration_tensor(ligand_coordinates), rotations[first], translations[first],
+                        rotations[second], translations[second]) < cutoff
+    first, second = first[close], second[close]
+    sort = np.argsort(first, kind='mergesort')
+    first, second = first[sort], second[sort]
+    starts = np.searchsorted(first, np.arange(num_poses + 1))
+    for pose in (np.arange(num_poses) if order is None else order):
+        if representatives[pose] < 0:
+            representatives[pose] = pose
+            neighbours = second[starts[pose]:starts[pose + 1]]
+            representatives[neighbours[representatives[neighbours] < 0]] = pose
+    return representatives
+
+
+def clusters_file(project_name):
+    return "%s%s" % (project_name, clusters_suffix)
+
+
+def write_clusters(project_name, confs, representatives):
+    """Saves the representative conformation of every conformation, in pose order"""
+    partial = clusters_file(project_name) + '.partial'
+    with open(partial, 'wb') as output:
+        np.save(output, np.asarray(confs)[representatives])
+    os.rename(partial, clusters_file(project_name))
+    return clusters_file(project_name)
+
+
+def read_clusters(project_name):
+    return np.load(clusters_file(project_name))
+
+
+def cluster_poses(project_name, cutoff, store=None):
+    """Clusters the poses of the project .rot file, or of a PoseStore, and writes the clusters file.
+
+    Poses with a better FTDock score are visited first when the store has them.
+    """
+    ligand = molecule.load("%s%s" % (project_name, scoring_engine.ligand_suffix))
+    if store is None:
+        rotations, translations, confs = model_builder.read_rot("%s%s" % (project_name, scoring_engine.rot_suffix))
+        order = None
+    else:
+        rotations, translations, confs = store.poses()
+        order = np.argsort(-store.records['score'], kind='mergesort')
+    representatives = cluster(rotations, translations, ligand.coordinates, cutoff, order)
+    return write_clusters(project_name, confs, representatives)
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+
+"""Binary memory-mapped store of docking poses, convertible to and from .rot and .ftdock"""
+
+import os
+import json
+import struct
+import numpy as np
+import model_builder
+import molecule
+import fft_sampling
+
+
+""" Pose store configuration """
+store_suffix = '.poses'
+magic = 'PYDKPOSE'
+version = 3
+alignment = 64
+""" End of configuration """
+
+# Rotations and translations in thousandths, the 3 decimals of the .rot file, read back as the same floats
+pose_dtype = np.dtype([('id', '<i4'), ('score', '<f4'), ('rotation', '<i4', (3, 3)), ('translation', '<i4', (3,))])
+fixed_point = 1000.0
+preamble = struct.Struct('<8sIQI')
+
+# FTDock header fields kept in the store header
+ftdock_fields = [('Static molecule', 'static', str), ('Mobile molecule', 'mobile', str),
+                 ('Global grid size', 'grid_size', int), ('Global search angle step', 'angle_step', int),
+                 ('Global surface thickness', 'surface_thickness', float),
+                 ('Global internal deterrent value', 'internal_deterrent', float),
+                 ('Global keep per rotation', 'keep_per_rotation', int), ('Global rotations', 'rotations', int),
+                 ('Global total span (angstroms)', 'span', float),
+                 ('Global grid cell span (angstroms)', 'cell_span', float)]
+
+
+def ftdock_angles(rotation):
+    """FTDock (z twist, theta, phi) integer angles of a rotation, the inverse of fft_sampling.rotation_matrix"""
+    theta = np.degrees(np.arccos(np.clip(rotation[2, 2], -1.0, 1.0)))
+    if np.sin(np.radians(theta)) > 1e-6:
+        phi = np.degrees(np.arctan2(rotation[1, 2], rotation[0, 2]))
+        z_twist = np.degrees(np.arctan2(rotation[2, 1], -rotation[2, 0]))
+    elif rotation[2, 2] > 0:
+        phi, z_twist = 0.0, np.degrees(np.arctan2(rotation[1, 0], rotation[0, 0]))
+    else:
+        phi, z_twist = 0.0, np.degrees(np.arctan2(rotation[1, 0], rotation[1, 1]))
+    return tuple(int(np.rint(angle)) % 360 for angle in (z_twist, theta, phi))
+
+
+def pose_records(ids, rotations, translations, scores=None):
+    """Records of id, score, rotation matrix and translation of the poses, rounded as in the .rot file"""
+    records = np.zeros(len(ids), dtype=pose_dtype)
+    records['id'] = ids
+    records['score'] = 0.0 if scores is None else scores
+    records['rotation'] = np.rint(np.asarray(rotations, dtype=np.float64).reshape(-1, 3, 3) * fixed_point)
+    records['translation'] = np.rint(np.asarray(translations, dtype=np.float64).reshape(-1, 3) * fixed_point)
+    return records
+
+
+def write_store(store_file, ids, rotations, translations, scores=None, header=None):
+    """Writes poses as records of id, score, rotation matrix and translation after a JSON header"""
+    return write_records(store_file, pose_records(ids, rotations, translations, scores), header)
+
+
+def write_records(store_file, records, header=None):
+    """Writes pose records after a JSON header, atomically"""
+    text = json.dumps(header or {}, sort_keys=True)
+    padding = -(preamble.size + len(text)) % alignment
+    partial = store_file + '.partial'
+    with open(partial, 'wb') as output:
+        output.write(preamble.pack(magic, version, len(records), len(text) + padding))
+        output.write(text + ' ' * padding)
+        records.tofile(output)
+    os.rename(partial, store_file)
+    return store_file
+
+
+def is_store(file_name):
+    with open(file_name, 'rb') as input_file:
+        return input_file.read(len(magic)) == magic
+
+
+class PoseStore(object):
+    """Read-only memory map of a pose store, pose ranges are sliced without copies"""
+    def __init__(self, store_file):
+        with open(store_file, 'rb') as input_file:
+            file_magic, file_version, count, header_length = preamble.unpack(input_file.read(preamble.size))
+            if file_magic != magic or file_version != version:
+                raise ValueError("%s is not a version %d pose store" % (store_file, version))
+            self.header = json.loads(input_file.read(header_length))
+        offset = preamble.size + header_length
+        if count:
+            self.records = np.memmap(store_file, dtype=pose_dtype, mode='r', offset=offset, shape=(count,))
+        else:
+            self.records = np.zeros(0, dtype=pose_dtype)
+
+    def __len__(self):
+        return len(self.records)
+
+    def poses(self, start=0, end=None):
+        """Rotations, translations and ids of a range of poses, as model_builder.read_rot returns them"""
+        return self.unpack(self.records[start:end])
+
+    def select(self, indexes):
+        """Rotations, translations and ids of the poses at indexes, only those are read"""
+        return self.unpack(self.records[np.asarray(indexes, dtype=np.int64)])
+
+    def subset(self, indexes, store_file):
+        """Writes the poses at indexes, records copied as they are, as a new store"""
+        return write_records(store_file, self.records[np.asarray(indexes, dtype=np.int64)], self.header)
+
+    @staticmethod
+    def unpack(records):
+        return (records['rotation'] / fixed_point, records['translation'] / fixed_point, np.asarray(records['id']))
+
+
+def read_ftdock(ftdock_file):
+    """Header fields and (id, score, shift, angles) poses of a .ftdock file"""
+    header = {}
+    poses = []
+    with open(ftdock_file) as input_file:
+        for line in input_file:
+            if line.startswith('G_DATA'):
+                fields = line.split()
+                poses.append((int(fields[1]), float(fields[3]), tuple(int(field) for field in fields[5:8]),
+                              tuple(int(field) for field in fields[8:11])))
+            elif '::' in line:
+                name, value = [part.strip() for part in line.split('::', 1)]
+                for field, key, cast in ftdock_fields:
+                    if name == field:
+                        header[key] = cast(value.split()[0])
+    return header, poses
+
+
+def rot_to_store(rot_file, store_file, ftdock_file=None, receptor_pdb=None, extra_header=None):
+    """Store of the poses of a .rot file, with the scores and parameters of its .ftdock file if given.
+
+    The receptor centre, needed to write the .ftdock back, comes from receptor_pdb.
+    The fields of extra_header are added to the header.
+    """
+    rotations, translations, ids = model_builder.read_rot(rot_file)
+    header = {}
+    scores = None
+    if ftdock_file:
+        header, poses = read_ftdock(ftdock_file)
+        score_of = dict((pose_id, score) for pose_id, score, _, _ in poses)
+        scores = np.array([score_of.get(pose_id, 0.0) for pose_id in ids])
+    if receptor_pdb:
+        header['receptor_center'] = list(molecule.load(receptor_pdb).coordinates.mean(axis=0))
+    header.update(extra_header or {})
+    return write_store(store_file, ids, rotations, translations, scores, header)
+
+
+def ftdock_to_store(ftdock_file, receptor_pdb, store_file):
+    """Store of the poses of a .ftdock file, placed as pyDock rotftdock does"""
+    header, poses = read_ftdock(ftdock_file)
+    center = molecule.load(receptor_pdb).coordinates.mean(axis=0)
+    header['receptor_center'] = list(center)
+    rotations = np.array([fft_sampling.rotation_matrix(*angles) for _, _, _, angles in poses]).reshape(-1, 3, 3)
+    translations = np.array([center + np.array(shift) * header['cell_span'] for _, _, shift, _ in poses]).reshape(-1, 3)
+    return write_store(store_file, [pose[0] for pose in poses], rotations, translations,
+                       [pose[1] for pose in poses], header)
+
+
+def store_to_rot(store_file, rot_file):
+    rotations, translations, ids = PoseStore(store_file).poses()
+    with open(rot_file, 'w') as output:
+        for rotation, translation, pose_id in zip(rotations, translations, ids):
+            fft_sampling.write_rot_line(output, rotation, translation, pose_id)
+    return rot_file
+
+
+def store_to_ftdock(store_file, ftdock_file):
+    """Writes the .ftdock of a store that has the FTDock parameters and the receptor centre"""
+    store = PoseStore(store_file)
+    header = store.header
+    if 'cell_span' not in header or 'receptor_center' not in header:
+        raise ValueError("%s has no FTDock parameters" % store_file)
+    rotations, translations, ids = store.poses()
+    shifts = np.rint((translations - np.array(header['receptor_center'])) / header['cell_span']).astype(int)
+    with open(ftdock_file, 'w') as output:
+        output.write(fft_sampling.ftdock_header % (header['static'], header['mobile'], header['grid_size'],
+                                                   header['angle_step'], header['surface_thickness'],
+                                                   header['internal_deterrent'], header['keep_per_rotation'],
+                                                   header['rotations'], header['span'], header['cell_span']))
+        for rotation, shift, pose_id, score in zip(rotations, shifts, ids, store.records['score']):
+            output.write(fft_sampling.ftdock_line % ((pose_id, 0, int(np.rint(score)), 0.0) + tuple(shift) +
+                                                     ftdock_angles(rotation)))
+    return ftdock_file
+
+
+def load(file_name):
+    """Rotations, translations and ids of a pose store or a .rot file"""
+    if is_store(file_name):
+        return PoseStore(file_name).poses()
+    return model_builder.read_rot(file_name)
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+
+"""Precomputation of the receptor grids of a prepared project, before docking many ligands against its receptor"""
+
+import argparse
+import os
+import fft_sampling
+import grid_cache
+import model_builder
+import molecule
+import scoring_engine
+
+
+def precompute(project_name):
+    """Builds the cached FFT receptor transform, receptor surface and potential grids of a project.
+
+    The project folder holds the files of a job after its setup, and its
+    .rot file for the potential grids. Jobs that dock ligands against the
+    same receptor, with the same parameters, then read the grids from the
+    cache, the FFT transform if their ligand gives the same grid span.
+    """
+    if not grid_cache.cache_folder:
+        raise ValueError("No grid cache folder configured")
+    receptor_pdb, ligand_pdb = "%s_rec.pdb" % project_name, "%s_lig.pdb" % project_name
+    sampler = fft_sampling.FFTSampler(molecule.load(receptor_pdb).coordinates, molecule.load(ligand_pdb).coordinates)
+    sampler.receptor_transform()
+    receptor, ligand = scoring_engine.load_molecules(project_name)
+    rot_file = "%s%s" % (project_name, scoring_engine.rot_suffix)
+    if os.path.exists(rot_file):
+        # The potential grids span the sampled poses, the jobs whose poses go further widen them
+        _, translations, _ = model_builder.read_rot(rot_file)
+        scoring_engine.ScoringEngine(receptor, ligand, None, translations)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="receptor_grids")
+    parser.add_argument("project", help="Project name of the prepared files in the current folder")
+    parser.add_argument("--cache", help="Grid cache folder", default=grid_cache.cache_folder)
+    args = parser.parse_args()
+
+    grid_cache.cache_folder = args.cache
+    precompute(args.project)
+    print "Receptor grids of %s cached in %s" % (args.project, args.cache)
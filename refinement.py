@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+"""Coarse-to-fine refinement of the best scored poses, run after the scoring"""
+
+import numpy as np
+import energy_table
+import pose_store
+import scoring_engine
+
+
+""" Refinement configuration """
+refine_angle = 6.0
+refine_shift = 0.6
+refine_rounds = 2
+refined_ene_suffix = '.refined' + scoring_engine.ene_suffix
+refined_store_suffix = '.refined' + pose_store.store_suffix
+""" End of configuration """
+
+
+def rotation_matrices(quaternions):
+    """3x3 rotation matrices of a stack of (w, x, y, z) quaternions"""
+    q = np.asarray(quaternions, dtype=np.float64)
+    q = q / np.sqrt((q ** 2).sum(axis=1))[:, np.newaxis]
+    w, x, y, z = q[:, 0], q[:, 1], q[:, 2], q[:, 3]
+    return np.array([[1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)],
+                     [2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)],
+                     [2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)]]).transpose(2, 0, 1)
+
+
+def neighbourhood(angle, shift):
+    """Rotations and translations of the local moves around a pose, the identity left out.
+
+    Every rotation of angle degrees around the x, y and z axes, or none, is
+    combined with every shift along the x, y and z axes, or none.
+    """
+    half = np.radians(angle) / 2.0
+    quaternions = [[1.0, 0.0, 0.0, 0.0]]
+    shifts = [np.zeros(3)]
+    for axis in range(3):
+        for sign in [1.0, -1.0]:
+            quaternion = [np.cos(half), 0.0, 0.0, 0.0]
+            quaternion[axis + 1] = sign * np.sin(half)
+            quaternions.append(quaternion)
+            shifts.append(sign * shift * np.eye(3)[axis])
+    rotations = rotation_matrices(quaternions)
+    moves = [(rotation, move) for i, rotation in enumerate(rotations) for j, move in enumerate(shifts) if i or j]
+    return np.array([rotation for rotation, _ in moves]), np.array([move for _, move in moves])
+
+
+def perturb(rotations, translations, moves):
+    """Poses of every local move applied to every pose, around the ligand centre, grouped by pose"""
+    move_rotations, move_translations = moves
+    new_rotations = np.einsum('mij,njk->nmik', move_rotations, rotations).reshape(-1, 3, 3)
+    new_translations = (translations[:, np.newaxis, :] + move_translations[np.newaxis, :, :]).reshape(-1, 3)
+    return new_rotations, new_translations
+
+
+def refine(project_name, top, num_cores, store, ene_file, refined_ene, refined_store, weights=None):
+    """Scores the local neighbourhood of the top poses of ene_file, halving the moves every round.
+
+    Every round starts from the top poses found so far. The new poses get
+    Conf IDs after the last one and are written with the poses of store to
+    refined_store, their energies merged with ene_file into refined_ene.
+    The poses of ene_file keep their total energy. Returns the number of
+    poses added.
+    """
+    records = np.array(store.records)
+    receptor, ligand = scoring_engine.load_molecules(project_name)
+    table = np.array(energy_table.open_table(ene_file))
+    next_conf = max(records['id'].max() if len(records) else 0, table['Conf'].max() if len(table) else 0) + 1
+    num_records = len(records)
+    for level in range(refine_rounds):
+        index_of = dict((pose_id, index) for index, pose_id in enumerate(records['id']))
+        best = [index_of[conf] for conf in energy_table.top(table, top)['Conf']]
+        rotations, translations, _ = pose_store.PoseStore.unpack(records[best])
+        scale = 0.5 ** level
+        rotations, translations = perturb(rotations, translations, neighbourhood(refine_angle * scale,
+                                                                                 refine_shift * scale))
+        confs = np.arange(next_conf, next_conf + len(rotations))
+        next_conf += len(rotations)
+        new_records = pose_store.pose_records(confs, rotations, translations)
+        records = np.concatenate([records, new_records])
+        # Scored as stored, so the models built from refined_store have these energies
+        rotations, translations, _ = pose_store.PoseStore.unpack(new_records)
+        ele, desolv, vdw = scoring_engine.score_transforms(receptor, ligand, rotations, translations, num_cores)
+        total = np.round(scoring_engine.total_energy(ele, desolv, vdw, weights), 3)
+        new_rows = energy_table.build_table(confs, ele, desolv, vdw, total, np.zeros(len(confs)))
+        table = np.concatenate([table, new_rows])
+        table = table[np.argsort(table['Total'], kind='mergesort')]
+        table['RANK'] = np.arange(1, len(table) + 1)
+    pose_store.write_records(refined_store, records, store.header)
+    scoring_engine.write_ene(refined_ene, table['Conf'], table['Ele'], table['Desolv'], table['VDW'],
+                             total=table['Total'])
+    return len(records) - num_records
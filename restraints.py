@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+"""Residue restraints filter of docking poses, run between sampling and scoring"""
+
+import numpy as np
+import model_builder
+import molecule
+import pose_store
+import scoring_engine
+
+
+""" Restraints configuration """
+distance_cutoff = 6.0
+poses_per_chunk = 1024
+filtered_suffix = '.filtered' + pose_store.store_suffix
+""" End of configuration """
+
+
+def residue_key(atom_key):
+    """chain.resname.resnum of a chain.resname.resnum.atom key"""
+    return atom_key.rsplit('.', 1)[0]
+
+
+def restraint_atoms(atom_keys, residues):
+    """Atom indexes and their restraint number for the restrained residues of a molecule"""
+    residue_of = [residue_key(key) for key in atom_keys]
+    atoms = []
+    numbers = []
+    for number, residue in enumerate(residues):
+        found = [index for index, key in enumerate(residue_of) if key == residue]
+        if not found:
+            raise ValueError("Restrained residue %s not found" % residue)
+        atoms.extend(found)
+        numbers.extend([number] * len(found))
+    return np.array(atoms, dtype=np.int64), np.array(numbers, dtype=np.int64)
+
+
+class RestraintFilter(object):
+    """Counts the restraints every pose satisfies.
+
+    A receptor (ligand) restraint is satisfied when an atom of its residue is
+    closer than cutoff to any ligand (receptor) atom. Only the restraint atoms
+    are moved: the ligand ones into the receptor frame and the receptor ones
+    into the ligand frame, where they are looked up in the cell list of the
+    other molecule.
+    """
+    def __init__(self, receptor, ligand, receptor_residues, ligand_residues, cutoff=None):
+        self.cutoff = cutoff or distance_cutoff
+        self.ligand_center = ligand.coordinates.mean(axis=0)
+        self.receptor_grid = scoring_engine.NeighbourGrid(receptor.coordinates, self.cutoff)
+        self.ligand_grid = scoring_engine.NeighbourGrid(ligand.coordinates - self.ligand_center, self.cutoff)
+        atoms, self.receptor_numbers = restraint_atoms(receptor.keys(), receptor_residues)
+        self.receptor_restraints = receptor.coordinates[atoms]
+        atoms, self.ligand_numbers = restraint_atoms(ligand.keys(), ligand_residues)
+        self.ligand_restraints = ligand.coordinates[atoms]
+        self.num_receptor = len(receptor_residues)
+        self.num_restraints = len(receptor_residues) + len(ligand_residues)
+
+    def satisfied(self, rotations, translations):
+        """Number of restraints satisfied by each pose"""
+        num_poses = len(rotations)
+        found = [np.zeros(0, dtype=np.int64)]
+        if len(self.ligand_restraints):
+            moved = model_builder.transform(self.ligand_restraints, self.ligand_center, rotations, translations)
+            points, _, _ = self.receptor_grid.pairs(moved.reshape(-1, 3), self.cutoff)
+            atoms = len(self.ligand_restraints)
+            found.append(points // atoms * self.num_restraints + self.num_receptor +
+                         self.ligand_numbers[points % atoms])
+        if len(self.receptor_restraints):
+            # Ligand frame: R^T (x - t), the ligand centered at the origin
+            moved = np.einsum('nji,naj->nai', rotations,
+                              self.receptor_restraints[np.newaxis, :, :] - translations[:, np.newaxis, :])
+            points, _, _ = self.ligand_grid.pairs(moved.reshape(-1, 3), self.cutoff)
+            atoms = len(self.receptor_restraints)
+            found.append(points // atoms * self.num_restraints + self.receptor_numbers[points % atoms])
+        pairs = np.unique(np.concatenate(found))
+        return np.bincount(pairs // self.num_restraints, minlength=num_poses)
+
+
+def filter_poses(project_name, receptor_residues, ligand_residues, minimum, store, filtered_file, cutoff=None):
+    """Writes the poses of store that satisfy at least minimum restraints as a new store, returns their number"""
+    receptor = molecule.load("%s%s" % (project_name, scoring_engine.receptor_suffix))
+    ligand = molecule.load("%s%s" % (project_name, scoring_engine.ligand_suffix))
+    restraints = RestraintFilter(receptor, ligand, receptor_residues, ligand_residues, cutoff)
+    accepted = []
+    for start in range(0, len(store), poses_per_chunk):
+        rotations, translations, _ = store.poses(start, start + poses_per_chunk)
+        accepted.append(start + np.nonzero(restraints.satisfied(rotations, translations) >= minimum)[0])
+    accepted = np.concatenate(accepted) if accepted else np.zeros(0, dtype=np.int64)
+    store.subset(accepted, filtered_file)
+    return len(accepted)
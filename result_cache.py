@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+"""Content-addressed on-disk cache of sampling and scoring artifacts"""
+
+import os
+import shutil
+import hashlib
+import tempfile
+
+
+""" Cache configuration """
+key_version = '1'
+entry_prefix = 'entry_'
+tmp_prefix = '.tmp_'
+""" End of configuration """
+
+
+def normalized_structure(pdb_file):
+    """Atom records reduced to the fields that define the structure.
+
+    Serial numbers, occupancies, B-factors and non-atom records are left out so
+    that the same complex uploaded twice gets the same key.
+    """
+    records = []
+    with open(pdb_file) as input_file:
+        for line in input_file:
+            if line.startswith('ATOM') or line.startswith('HETATM'):
+                records.append('%s|%s|%s|%s|%.3f|%.3f|%.3f' % (line[12:16].strip(), line[17:20].strip(), line[21],
+                                                              line[22:27].strip(), float(line[30:38]),
+                                                              float(line[38:46]), float(line[46:54])))
+    return '\n'.join(records)
+
+
+def chain_selection(ini_file):
+    """Molecule and chain selection lines of a pyDock .ini file"""
+    selection = []
+    try:
+        with open(ini_file) as input_file:
+            for line in input_file:
+                line = line.strip()
+                if line.startswith('[') or line.startswith('mol=') or line.startswith('newmol='):
+                    selection.append(line)
+    except IOError:
+        pass
+    return '\n'.join(selection)
+
+
+def file_digest(file_name):
+    """SHA-1 of a file content"""
+    digest = hashlib.sha1()
+    with open(file_name, 'rb') as input_file:
+        for block in iter(lambda: input_file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ResultCache(object):
+    """Size-bounded LRU cache of pipeline artifacts keyed by a hash of their inputs.
+
+    Every entry is a folder holding one file per artifact suffix (.ftdock, .rot,
+    .ene...). Entries are written to a temporary folder and renamed into place,
+    and the entry modification time records its last use.
+    """
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+    @staticmethod
+    def key(*parts):
+        digest = hashlib.sha1(key_version)
+        for part in parts:
+            digest.update(str(part))
+            digest.update('\0')
+        return digest.hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.path, entry_prefix + key)
+
+    def fetch(self, key, destinations):
+        """Copies the cached artifacts of key to their destinations.
+
+        destinations maps artifact suffixes to file names. Returns False, and
+        copies nothing, if any of them is missing, or is evicted by another
+        job while they are copied.
+        """
+        entry = self.entry_path(key)
+        sources = dict((suffix, os.path.join(entry, 'artifact' + suffix)) for suffix in destinations)
+        if not all(os.path.exists(source) for source in sources.values()):
+            return False
+        try:
+            for suffix, destination in destinations.items():
+                shutil.copyfile(sources[suffix], destination + '.partial')
+        except (IOError, OSError):
+            for destination in destinations.values():
+                if os.path.exists(destination + '.partial'):
+                    os.remove(destination + '.partial')
+            return False
+        for destination in destinations.values():
+            os.rename(destination + '.partial', destination)
+        try:
+            os.utime(entry, None)
+        except OSError:
+            pass
+        return True
+
+    def store(self, key, sources):
+        """Atomically stores the artifacts (suffix to file name) under key"""
+        entry = self.entry_path(key)
+        if os.path.exists(entry):
+            return entry
+        staging = tempfile.mkdtemp(prefix=tmp_prefix, dir=self.path)
+        try:
+            for suffix, source in sources.items():
+                shutil.copyfile(source, os.path.join(staging, 'artifact' + suffix))
+            os.rename(staging, entry)
+        except (IOError, OSError):
+            # Another job stored the same entry first, or the disk is full
+            shutil.rmtree(staging, ignore_errors=True)
+        self.evict()
+        return entry
+
+    def entries(self):
+        """(last use, size, path) of every complete entry"""
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.startswith(entry_prefix):
+                continue
+            entry = os.path.join(self.path, name)
+            try:
+                size = sum(os.path.getsize(os.path.join(entry, file_name)) for file_name in os.listdir(entry))
+                entries.append((os.path.getmtime(entry), size, entry))
+            except OSError:
+                pass
+        return entries
+
+    def evict(self):
+        """Removes the least recently used entries until the cache fits its size"""
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in entries:
+            if total <= self.max_size:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
@@ -0,0 +1,463 @@
+#!/usr/bin/env python
+
+"""In-process pyDock scoring engine (electrostatics, desolvation and van der Waals)"""
+
+import multiprocessing
+import numpy as np
+import grid_cache
+import model_builder
+import molecule
+import energy_table
+
+
+""" Scoring configuration """
+receptor_suffix = '_rec.pdb.H'
+ligand_suffix = '_lig.pdb.H'
+receptor_amber_suffix = '_rec.pdb.amber'
+ligand_amber_suffix = '_lig.pdb.amber'
+rot_suffix = '.rot'
+ene_suffix = '.ene'
+scoring_modules = ['dockser']
+near_cutoff = 10.0
+far_grid_spacing = 1.0
+elec_factor = 332.0
+elec_max = 1.0
+vdw_max = 1.0
+probe_radius = 1.4
+sphere_points = 100
+ele_weight = 1.0
+desolv_weight = 1.0
+vdw_weight = 0.1
+poses_per_batch = 32
+""" End of configuration """
+
+# AMBER parm94 well depths (kcal/mol) for the types found in .amber files
+vdw_epsilon = {
+    'C': 0.0860, 'CA': 0.0860, 'CB': 0.0860, 'CC': 0.0860, 'CK': 0.0860, 'CM': 0.0860,
+    'CN': 0.0860, 'CQ': 0.0860, 'CR': 0.0860, 'CV': 0.0860, 'CW': 0.0860, 'C*': 0.0860,
+    'CT': 0.1094,
+    'N': 0.1700, 'NA': 0.1700, 'NB': 0.1700, 'NC': 0.1700, 'N*': 0.1700, 'N2': 0.1700, 'N3': 0.1700,
+    'O': 0.2100, 'O2': 0.2100, 'OH': 0.2104, 'OS': 0.1700, 'OW': 0.1520,
+    'S': 0.2500, 'SH': 0.2500, 'P': 0.2000,
+    'H': 0.0157, 'HC': 0.0157, 'H1': 0.0157, 'H2': 0.0157, 'H3': 0.0157, 'HP': 0.0157, 'HS': 0.0157,
+    'HA': 0.0150, 'H4': 0.0150, 'H5': 0.0150, 'HO': 0.0, 'HW': 0.0,
+}
+default_epsilon = 0.1
+
+# Atomic solvation parameters (kcal/mol/A^2) by element, with the charged oxygen and nitrogen types,
+# as published by Eisenberg and McLachlan (Nature 319, 1986)
+solvation_parameters = {'C': 0.016, 'N': -0.006, 'O': -0.006, 'S': 0.021}
+charged_solvation_parameters = {'O2': -0.024, 'N3': -0.050}
+
+binomial_6 = np.array([1.0, 6.0, 15.0, 20.0, 15.0, 6.0, 1.0])
+
+ene_header = '%12s%12s%12s%12s%12s%12s\n' % ('Conf', 'Ele', 'Desolv', 'VDW', 'Total', 'RANK')
+ene_separator = '-' * 72 + '\n'
+ene_line = '%12d%12.3f%12.3f%12.3f%12.3f%12d\n'
+
+
+def parameters():
+    """Parameters that define the scoring results"""
+    return (near_cutoff, far_grid_spacing, elec_factor, elec_max, vdw_max, probe_radius, sphere_points,
+            ele_weight, desolv_weight, vdw_weight, sorted(solvation_parameters.items()),
+            sorted(charged_solvation_parameters.items()))
+
+
+def read_amber(amber_file):
+    """Reads atom names, AMBER types, charges and radii from a .amber file"""
+    table = molecule.load_amber(amber_file)
+    return list(table['name']), list(table['type']), table['charge'], table['radius']
+
+
+def sphere(num_points):
+    """Unit sphere points distributed with the golden section spiral"""
+    index = np.arange(num_points) + 0.5
+    z = 1.0 - 2.0 * index / num_points
+    radius = np.sqrt(1.0 - z * z)
+    phi = np.pi * (3.0 - np.sqrt(5.0)) * index
+    return np.column_stack((radius * np.cos(phi), radius * np.sin(phi), z))
+
+
+def elec_kernel(distances):
+    """1/r^2 beyond the near cutoff, smoothly flattened inside it (squared distances as input)"""
+    cutoff2 = near_cutoff * near_cutoff
+    return np.where(distances < cutoff2, (2.0 - distances / cutoff2) / cutoff2, 1.0 / np.maximum(distances, cutoff2))
+
+
+def dispersion_kernel(distances):
+    """1/r^6 beyond the near cutoff, smoothly flattened inside it (squared distances as input)"""
+    cutoff2 = near_cutoff * near_cutoff
+    return np.where(distances < cutoff2, (4.0 - 3.0 * distances / cutoff2) / cutoff2 ** 3,
+                    1.0 / np.maximum(distances, cutoff2) ** 3)
+
+
+def corners(coordinates, origin, spacing, shape):
+    """Yields the flat index and trilinear weight of the 8 grid corners around each point"""
+    position = (coordinates - origin) / spacing
+    base = np.clip(np.floor(position).astype(np.int64), 0, np.asarray(shape) - 2)
+    fraction = np.clip(position - base, 0.0, 1.0)
+    for corner in np.ndindex(2, 2, 2):
+        corner = np.array(corner)
+        weight = np.prod(np.where(corner, fraction, 1.0 - fraction), axis=1)
+        yield np.ravel_multi_index((base + corner).T, shape), weight
+
+
+class PotentialGrid(object):
+    """Far-field receptor potentials sampled on a regular grid.
+
+    Every channel is the convolution of a set of receptor atom weights with a
+    smooth kernel, computed with FFTs and read back by trilinear interpolation.
+    With cached, the grid of the same atoms and weights is kept in the grid
+    cache and reused while it covers the box, or rebuilt over both boxes. The
+    grid points lie on multiples of the spacing, so their values do not
+    depend on the box.
+    """
+    def __init__(self, coordinates, weights, kernels, lower, upper, spacing, cached=False):
+        self.spacing = float(spacing)
+        self.origin = np.floor(np.minimum(lower, coordinates.min(axis=0)) / self.spacing) * self.spacing - self.spacing
+        self.shape = tuple(np.ceil((np.maximum(upper, coordinates.max(axis=0)) - self.origin)
+                                   / self.spacing).astype(np.int64) + 2)
+        if not cached:
+            self.values = self.convolve(coordinates, weights, kernels)
+            return
+        parts = ([grid_cache.array_digest(coordinates)] + [grid_cache.array_digest(weight) for weight in weights] +
+                 [kernel.__name__ for kernel in kernels] + [near_cutoff, self.spacing])
+        found = grid_cache.fetch('potential_grid', parts)
+        end = self.origin + np.array(self.shape) * self.spacing
+        if found is not None:
+            found_end = found['origin'] + found['shape'] * self.spacing
+            if np.all(found['origin'] <= self.origin + 1e-6) and np.all(found_end >= end - 1e-6):
+                self.origin, self.values = np.array(found['origin']), found['values']
+                self.shape = tuple(int(n) for n in found['shape'])
+                return
+            self.origin = np.minimum(self.origin, found['origin'])
+            self.shape = tuple(np.rint((np.maximum(end, found_end) - self.origin) / self.spacing).astype(np.int64))
+        self.values = self.convolve(coordinates, weights, kernels)
+        grid_cache.keep('potential_grid', parts, {'values': self.values, 'origin': self.origin,
+                                                  'shape': np.array(self.shape)}, replace=True)
+
+    def convolve(self, coordinates, weights, kernels):
+        """Channel values at the grid points, shape (points, channels)"""
+        source_origin = np.floor(coordinates.min(axis=0) / self.spacing) * self.spacing - self.spacing
+        source_shape = tuple(np.ceil((coordinates.max(axis=0) - source_origin) / self.spacing).astype(np.int64) + 2)
+        pad = np.rint((source_origin - self.origin) / self.spacing).astype(np.int64)
+        size = tuple(int(2 ** np.ceil(np.log2(a + b))) for a, b in zip(self.shape, source_shape))
+        # Kernel offsets wrapped around the FFT box
+        axes = []
+        for n, m, p in zip(self.shape, size, pad):
+            offsets = np.arange(m)
+            axes.append((np.where(offsets < n - p, offsets, offsets - m) * self.spacing) ** 2)
+        distances = axes[0][:, None, None] + axes[1][None, :, None] + axes[2][None, None, :]
+        window = np.ix_(*[(np.arange(n) - p) % m for n, m, p in zip(self.shape, size, pad)])
+        transforms = {}
+        channels = []
+        for kernel, weight in zip(kernels, weights):
+            if kernel not in transforms:
+                transforms[kernel] = np.fft.rfftn(kernel(distances))
+            density = np.zeros(int(np.prod(source_shape)))
+            for index, corner_weight in corners(coordinates, source_origin, self.spacing, source_shape):
+                density += np.bincount(index, corner_weight * weight, minlength=len(density))
+            density = density.reshape(source_shape)
+            convolved = np.fft.irfftn(np.fft.rfftn(density, size) * transforms[kernel], size)
+            channels.append(convolved[window].astype(np.float32))
+        return np.stack(channels, axis=-1).reshape(-1, len(channels))
+
+    def interpolate(self, points):
+        """Channel values at the given points, shape (points, channels)"""
+        points = np.asarray(points).reshape(-1, 3)
+        result = np.zeros((len(points), self.values.shape[1]))
+        for index, weight in corners(points, self.origin, self.spacing, self.shape):
+            result += weight[:, np.newaxis] * self.values[index]
+        return result
+
+
+class NeighbourGrid(object):
+    """Cell list over a fixed set of coordinates for fixed-radius neighbour queries"""
+    def __init__(self, coordinates, cell_size):
+        self.coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 3)
+        self.cell_size = float(cell_size)
+        if len(self.coordinates):
+            self.origin = self.coordinates.min(axis=0)
+        else:
+            self.origin = np.zeros(3)
+        cells = np.floor((self.coordinates - self.origin) / self.cell_size).astype(np.int64)
+        self.shape = cells.max(axis=0) + 1 if len(cells) else np.ones(3, dtype=np.int64)
+        keys = np.ravel_multi_index(cells.T, self.shape) if len(cells) else np.zeros(0, dtype=np.int64)
+        self.order = np.argsort(keys, kind='mergesort')
+        sorted_keys = keys[self.order]
+        all_cells = np.arange(int(np.prod(self.shape)))
+        self.cell_start = np.searchsorted(sorted_keys, all_cells)
+        self.cell_count = np.searchsorted(sorted_keys, all_cells, side='right') - self.cell_start
+
+    def pairs(self, points, cutoff):
+        """Finds all (point, atom) pairs closer than cutoff.
+
+        Returns the point indexes, the atom indexes and the squared distances.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        reach = int(np.ceil(cutoff / self.cell_size))
+        cells = np.floor((points - self.origin) / self.cell_size).astype(np.int64)
+        near = np.all((cells >= -reach) & (cells < self.shape + reach), axis=1)
+        point_ids = np.nonzero(near)[0]
+        cells = cells[near]
+        cutoff2 = cutoff * cutoff
+        found_points = [np.zeros(0, dtype=np.int64)]
+        found_atoms = [np.zeros(0, dtype=np.int64)]
+        found_distances = [np.zeros(0)]
+        steps = range(-reach, reach + 1)
+        for dx in steps:
+            for dy in steps:
+                for dz in steps:
+                    offset = np.array((dx, dy, dz))
+                    gap = np.maximum(np.abs(offset) - 1, 0) * self.cell_size
+                    if np.dot(gap, gap) > cutoff2:
+                        continue
+                    neighbour = cells + offset
+                    inside = np.all((neighbour >= 0) & (neighbour < self.shape), axis=1)
+                    keys = np.ravel_multi_index(neighbour[inside].T, self.shape)
+                    counts = self.cell_count[keys]
+                    occupied = counts > 0
+                    if not occupied.any():
+                        continue
+                    counts = counts[occupied]
+                    starts = self.cell_start[keys][occupied]
+                    query = np.repeat(point_ids[inside][occupied], counts)
+                    total = counts.sum()
+                    positions = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(total)
+                    atoms = self.order[positions]
+                    delta = points[query] - self.coordinates[atoms]
+                    distances = np.einsum('ij,ij->i', delta, delta)
+                    close = distances < cutoff2
+                    found_points.append(query[close])
+                    found_atoms.append(atoms[close])
+                    found_distances.append(distances[close])
+        return np.concatenate(found_points), np.concatenate(found_atoms), np.concatenate(found_distances)
+
+
+class ScoringMolecule(object):
+    """Coordinates and force field parameters of a molecule.
+
+    With cached, the accessible surface is kept in the grid cache.
+    """
+    def __init__(self, pdb_file, amber_file, cached=False):
+        structure = molecule.load(pdb_file)
+        self.coordinates = structure.coordinates
+        names, types, self.charges, self.radii = read_amber(amber_file)
+        if structure.keys() != names:
+            raise ValueError("Atoms in %s do not match %s" % (pdb_file, amber_file))
+        self.epsilons = np.array([vdw_epsilon.get(atom_type, default_epsilon) for atom_type in types])
+        self.heavy = np.array([not atom_type.startswith('H') for atom_type in types])
+        self.solvation = np.array([charged_solvation_parameters.get(atom_type,
+                                   solvation_parameters.get(atom_type[0], 0.0)) for atom_type in types])
+        self.heavy_coordinates = self.coordinates[self.heavy]
+        self.heavy_radii = self.radii[self.heavy] + probe_radius
+        if cached:
+            parts = [grid_cache.array_digest(self.heavy_coordinates), grid_cache.array_digest(self.heavy_radii),
+                     grid_cache.array_digest(self.solvation[self.heavy]), sphere_points]
+            surface = grid_cache.cached('accessible_surface', parts,
+                                        lambda: dict(zip(['points', 'weights'], self.accessible_surface())))
+            self.surface_points, self.surface_weights = surface['points'], surface['weights']
+        else:
+            self.surface_points, self.surface_weights = self.accessible_surface()
+
+    def accessible_surface(self):
+        """Surface points accessible in the free molecule and their desolvation weights"""
+        unit = sphere(sphere_points)
+        radii = self.heavy_radii
+        points = (self.heavy_coordinates[:, np.newaxis, :] + radii[:, np.newaxis, np.newaxis] * unit).reshape(-1, 3)
+        owner = np.repeat(np.arange(len(radii)), sphere_points)
+        grid = NeighbourGrid(self.heavy_coordinates, radii.max())
+        point_ids, atoms, distances = grid.pairs(points, radii.max())
+        buried = (distances < radii[atoms] ** 2 - 1e-6) & (atoms != owner[point_ids])
+        accessible = np.ones(len(points), dtype=bool)
+        accessible[point_ids[buried]] = False
+        areas = 4.0 * np.pi * radii ** 2 / sphere_points
+        weights = (self.solvation[self.heavy] * areas)[owner]
+        return points[accessible], weights[accessible]
+
+
+class ScoringEngine(object):
+    """Scores rigid-body poses of a ligand against a fixed receptor.
+
+    Atom pairs closer than near_cutoff are evaluated exactly from a cell list,
+    the rest of the electrostatics and dispersion comes from receptor
+    potential grids, over the translations or the (lower, upper) bounds of
+    the translations to score.
+    """
+    def __init__(self, receptor, ligand, rotations, translations, bounds=None):
+        self.receptor = receptor
+        self.ligand = ligand
+        self.rotations = rotations
+        self.translations = translations
+        self.bounds = bounds
+        self.ligand_center = ligand.coordinates.mean(axis=0)
+        self.receptor_grid = NeighbourGrid(receptor.coordinates, near_cutoff / 2.0)
+        self.receptor_heavy_grid = NeighbourGrid(receptor.heavy_coordinates, receptor.heavy_radii.max())
+        self.far_field = self.potential_grid()
+        # Ligand side of the far-field terms
+        self.ligand_far = np.column_stack([elec_factor / 4.0 * ligand.charges] +
+                                          [-2.0 * np.sqrt(ligand.epsilons) * binomial_6[k] * ligand.radii ** k
+                                           for k in range(7)])
+
+    def potential_grid(self):
+        """Receptor electrostatic and dispersion far fields over the space visited by the poses"""
+        ligand_radius = np.sqrt(((self.ligand.coordinates - self.ligand_center) ** 2).sum(axis=1)).max()
+        lower, upper = self.bounds or (self.translations.min(axis=0), self.translations.max(axis=0))
+        lower, upper = np.asarray(lower) - ligand_radius, np.asarray(upper) + ligand_radius
+        weights = [self.receptor.charges] + [np.sqrt(self.receptor.epsilons) * self.receptor.radii ** (6 - k)
+                                             for k in range(7)]
+        kernels = [elec_kernel] + [dispersion_kernel] * 7
+        return PotentialGrid(self.receptor.coordinates, weights, kernels, lower, upper, far_grid_spacing,
+                             bool(grid_cache.cache_folder))
+
+    def move(self, coordinates, indexes):
+        return model_builder.transform(coordinates, self.ligand_center,
+                                       self.rotations[indexes], self.translations[indexes])
+
+    def pair_terms(self, moved):
+        """Electrostatics and van der Waals energies for a batch of moved ligands"""
+        num_poses, num_atoms = moved.shape[:2]
+        # Far field from the potential grids
+        far = (self.far_field.interpolate(moved).reshape(num_poses, num_atoms, -1) * self.ligand_far).sum(axis=1)
+        ele = far[:, 0]
+        vdw = far[:, 1:].sum(axis=1)
+        # Near field replaced by the exact pyDock terms
+        point_ids, atoms, distances = self.receptor_grid.pairs(moved, near_cutoff)
+        poses = point_ids // num_atoms
+        ligand_atoms = point_ids % num_atoms
+        distances = np.maximum(distances, 1e-6)
+        charges = self.ligand.charges[ligand_atoms] * self.receptor.charges[atoms]
+        # Coulomb with a distance dependent dielectric of 4r, capped per atom pair
+        near = np.clip(elec_factor * charges / (4.0 * distances), -elec_max, elec_max)
+        near -= elec_factor / 4.0 * charges * elec_kernel(distances)
+        ele += np.bincount(poses, near, minlength=num_poses)
+        # Lennard-Jones 6-12, capped per atom pair to soften clashes
+        rmin6 = (self.ligand.radii[ligand_atoms] + self.receptor.radii[atoms]) ** 6
+        epsilon = np.sqrt(self.ligand.epsilons[ligand_atoms] * self.receptor.epsilons[atoms])
+        ratio6 = rmin6 / distances ** 3
+        near = np.minimum(epsilon * (ratio6 * ratio6 - 2.0 * ratio6), vdw_max)
+        near += 2.0 * epsilon * rmin6 * dispersion_kernel(distances)
+        vdw += np.bincount(poses, near, minlength=num_poses)
+        return ele, vdw
+
+    def desolvation(self, indexes):
+        """Desolvation energy from the surface buried by each partner"""
+        num_poses = len(indexes)
+        # Ligand surface buried by the receptor
+        ligand_points = self.move(self.ligand.surface_points, indexes)
+        num_points = ligand_points.shape[1]
+        point_ids, atoms, distances = self.receptor_heavy_grid.pairs(ligand_points, self.receptor.heavy_radii.max())
+        buried = distances < self.receptor.heavy_radii[atoms] ** 2
+        buried_points = np.unique(point_ids[buried])
+        energy = -np.bincount(buried_points // num_points, self.ligand.surface_weights[buried_points % num_points],
+                              minlength=num_poses)
+        # Receptor surface buried by the ligand
+        ligand_atoms = self.move(self.ligand.heavy_coordinates, indexes)
+        num_atoms = ligand_atoms.shape[1]
+        ligand_grid = NeighbourGrid(ligand_atoms, self.ligand.heavy_radii.max())
+        point_ids, atoms, distances = ligand_grid.pairs(self.receptor.surface_points, self.ligand.heavy_radii.max())
+        buried = distances < self.ligand.heavy_radii[atoms % num_atoms] ** 2
+        pose_points = np.unique((atoms[buried] // num_atoms) * len(self.receptor.surface_points) + point_ids[buried])
+        energy -= np.bincount(pose_points // len(self.receptor.surface_points),
+                              self.receptor.surface_weights[pose_points % len(self.receptor.surface_points)],
+                              minlength=num_poses)
+        # Unburied poses get 0.0 whatever the other poses of the batch, never an integer or -0.0
+        return energy + 0.0
+
+    def score_poses(self, indexes):
+        """Returns the Ele, Desolv and VDW terms for the given pose indexes"""
+        indexes = np.asarray(indexes)
+        ele, vdw = self.pair_terms(self.move(self.ligand.coordinates, indexes))
+        desolv = self.desolvation(indexes)
+        return ele, desolv, vdw
+
+
+def total_energy(ele, desolv, vdw, weights=None):
+    """Combines the energetic terms as pyDock does, or with other (ele, desolv, vdw) weights"""
+    ele_factor, desolv_factor, vdw_factor = weights or (ele_weight, desolv_weight, vdw_weight)
+    return ele_factor * ele + desolv_factor * desolv + vdw_factor * vdw
+
+
+def write_ene(ene_file, confs, ele, desolv, vdw, weights=None, total=None):
+    """Writes a pyDock energy table sorted by total energy, computed from the terms unless given"""
+    if total is None:
+        total = total_energy(ele, desolv, vdw, weights)
+    order = np.argsort(total, kind='mergesort')
+    with open(ene_file, 'w') as output:
+        output.write(ene_header)
+        output.write(ene_separator)
+        for rank, index in enumerate(order):
+            output.write(ene_line % (confs[index], ele[index], desolv[index], vdw[index], total[index], rank + 1))
+    # The text table is parsed back for exactly the printed values
+    energy_table.write_table(ene_file, energy_table.parse_ene(ene_file))
+    return ene_file
+
+
+_engine = None
+
+
+def _score_batch(bounds):
+    start, end = bounds
+    return start, _engine.score_poses(np.arange(start, end))
+
+
+def load_molecules(project_name):
+    """Scoring receptor and ligand of a project in the current folder"""
+    receptor = ScoringMolecule("%s%s" % (project_name, receptor_suffix),
+                               "%s%s" % (project_name, receptor_amber_suffix), cached=True)
+    ligand = ScoringMolecule("%s%s" % (project_name, ligand_suffix),
+                             "%s%s" % (project_name, ligand_amber_suffix))
+    return receptor, ligand
+
+
+def score_transforms(receptor, ligand, rotations, translations, num_cores, translation_bounds=None):
+    """Electrostatics, desolvation and van der Waals energies of every pose, in batches over num_cores"""
+    global _engine
+    _engine = ScoringEngine(receptor, ligand, rotations, translations, translation_bounds)
+    num_poses = len(rotations)
+    ele = np.zeros(num_poses)
+    desolv = np.zeros(num_poses)
+    vdw = np.zeros(num_poses)
+    batches = [(start, min(start + poses_per_batch, num_poses)) for start in range(0, num_poses, poses_per_batch)]
+    if num_cores > 1 and len(batches) > 1:
+        pool = multiprocessing.Pool(num_cores)
+        try:
+            results = list(pool.imap_unordered(_score_batch, batches))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_score_batch(bounds) for bounds in batches]
+    for start, terms in results:
+        end = start + len(terms[0])
+        ele[start:end], desolv[start:end], vdw[start:end] = terms
+    _engine = None
+    return ele, desolv, vdw
+
+
+def poses_to_score(project_name, store=None, clusters=None):
+    """Rotations and translations of the poses to score, the conformations of the table and their pose indexes"""
+    if store is None:
+        rotations, translations, confs = model_builder.read_rot("%s%s" % (project_name, rot_suffix))
+    else:
+        rotations, translations, confs = store.poses()
+    members = np.arange(len(confs))
+    if clusters is not None:
+        index_of = dict((conf, index) for index, conf in enumerate(confs))
+        representatives, members = np.unique([index_of[conf] for conf in clusters], return_inverse=True)
+        rotations, translations = rotations[representatives], translations[representatives]
+    return rotations, translations, confs, members
+
+
+def score(project_name, num_cores, scoring_module='dockser', store=None, clusters=None):
+    """Scores every pose of the project .rot file, or of a PoseStore, and writes its .ene file.
+
+    With clusters, the representative conformation of every pose, only the
+    representatives are scored and the other poses get their energies.
+    """
+    if scoring_module not in scoring_modules:
+        raise ValueError("Scoring module %s not supported by the native engine" % scoring_module)
+    receptor, ligand = load_molecules(project_name)
+    rotations, translations, confs, members = poses_to_score(project_name, store, clusters)
+    ele, desolv, vdw = score_transforms(receptor, ligand, rotations, translations, num_cores)
+    return write_ene("%s%s" % (project_name, ene_suffix), confs, ele[members], desolv[members], vdw[members])
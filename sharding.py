@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+
+"""Sampling and scoring split in shards run by workers on several hosts, through a shared folder.
+
+The coordinator writes a task folder with a copy of its inputs and the
+ranges of its shards. Workers, on any host that sees the shared folder,
+claim a shard by creating its claim file, touch it while they run it and
+write its result. Shards whose worker failed or stopped touching the claim
+are given back, up to max_attempts times, and the coordinator merges the
+results into the same files a single host writes.
+"""
+
+import os
+import json
+import time
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import multiprocessing
+import numpy as np
+import fft_sampling
+import molecule
+import scoring_engine
+
+
+""" Sharding configuration """
+task_file_name = 'task.json'
+clock_file_name = 'clock'
+rotations_per_shard = 256
+poses_per_shard = 4096
+lease_time = 120.0
+max_attempts = 3
+poll_interval = 1.0
+""" End of configuration """
+
+# Module settings a worker takes from the coordinator, so every shard is computed the same way
+shared_settings = {
+    'fft_sampling': ['grid_size', 'angle_step', 'surface_thickness', 'internal_deterrent', 'keep_per_rotation',
+                     'atom_radius', 'rotations_per_chunk', 'single_precision', 'memory_limit', 'span_step'],
+    'scoring_engine': ['near_cutoff', 'far_grid_spacing', 'elec_factor', 'elec_max', 'vdw_max', 'probe_radius',
+                       'sphere_points', 'poses_per_batch'],
+}
+modules = {'fft_sampling': fft_sampling, 'scoring_engine': scoring_engine}
+
+
+class ShardFailed(Exception):
+    """A shard failed max_attempts times"""
+    pass
+
+
+def write_atomic(file_name, write):
+    with open(file_name + '.partial', 'wb') as output:
+        write(output)
+    os.rename(file_name + '.partial', file_name)
+    return file_name
+
+
+class ShardTask(object):
+    """Task folder: task.json, the input files and, for every shard, its claim, result and failure files"""
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, task_file_name)) as input_file:
+            task = json.load(input_file)
+        self.kind = task['kind']
+        self.shards = task['shards']
+        self.settings = task['settings']
+        self.data = task['data']
+
+    @staticmethod
+    def create(root, kind, files, shards, data, arrays=None):
+        """Task of the given kind over the shard ranges, inputs copied or saved in, task.json written last"""
+        if not os.path.exists(root):
+            os.makedirs(root)
+        path = tempfile.mkdtemp(prefix='%s_' % kind, dir=root)
+        for name, file_name in files.items():
+            shutil.copyfile(file_name, os.path.join(path, name))
+        for name, array in (arrays or {}).items():
+            np.save(os.path.join(path, name), array)
+        settings = dict((module, dict((name, getattr(modules[module], name)) for name in names))
+                        for module, names in shared_settings.items())
+        write_atomic(os.path.join(path, task_file_name),
+                     lambda output: json.dump({'kind': kind, 'shards': shards, 'settings': settings, 'data': data},
+                                              output))
+        return ShardTask(path)
+
+    def file(self, name):
+        return os.path.join(self.path, name)
+
+    def shard_file(self, shard, suffix):
+        return self.file('shard_%05d%s' % (shard, suffix))
+
+    def apply_settings(self):
+        for module, values in self.settings.items():
+            for name, value in values.items():
+                setattr(modules[module], name, value)
+
+    def claim(self, shard):
+        """Takes the shard if nobody has it and it has no result, returns whether it was taken"""
+        if os.path.exists(self.shard_file(shard, '.npy')) or os.path.exists(self.shard_file(shard, '.failed')):
+            return False
+        try:
+            descriptor = os.open(self.shard_file(shard, '.claim'), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError:
+            return False
+        os.write(descriptor, '%s %d\n' % (socket.gethostname(), os.getpid()))
+        os.close(descriptor)
+        return True
+
+    def now(self):
+        """Time of the shared filesystem, which also sets the times of the claims touched on other hosts"""
+        clock = self.file(clock_file_name)
+        with open(clock, 'a'):
+            pass
+        os.utime(clock, None)
+        return os.path.getmtime(clock)
+
+    def state(self, shard, now=None):
+        """'done', 'failed', 'stale' when its claim was not touched for lease_time, 'running' or 'pending'"""
+        if os.path.exists(self.shard_file(shard, '.npy')):
+            return 'done'
+        if os.path.exists(self.shard_file(shard, '.failed')):
+            return 'failed'
+        try:
+            touched = os.path.getmtime(self.shard_file(shard, '.claim'))
+        except OSError:
+            return 'pending'
+        return 'stale' if (now or self.now()) - touched > lease_time else 'running'
+
+    def release(self, shard):
+        """Gives the shard back to the workers"""
+        for suffix in ['.failed', '.claim']:
+            try:
+                os.remove(self.shard_file(shard, suffix))
+            except OSError:
+                pass
+
+    def run(self, shard, cores):
+        """Runs a claimed shard, touching its claim meanwhile, and writes its result or its failure"""
+        stop = threading.Event()
+
+        def heartbeat():
+            while not stop.wait(lease_time / 4.0):
+                try:
+                    os.utime(self.shard_file(shard, '.claim'), None)
+                except OSError:
+                    return
+        thread = threading.Thread(target=heartbeat)
+        thread.daemon = True
+        thread.start()
+        try:
+            self.apply_settings()
+            start, end = self.shards[shard]
+            result = runners[self.kind](self, start, end, cores)
+            write_atomic(self.shard_file(shard, '.npy'), lambda output: np.save(output, result))
+            return True
+        except Exception, e:
+            write_atomic(self.shard_file(shard, '.failed'), lambda output: output.write('%s\n' % str(e)))
+            return False
+        finally:
+            stop.set()
+
+    def result(self, shard):
+        return np.load(self.shard_file(shard, '.npy'))
+
+
+def sample_shard(task, start, end, cores):
+    """FTDock results of a range of rotations, as (score, angles, shift) rows"""
+    sampler = fft_sampling.FFTSampler(molecule.load(task.file('receptor.pdb')).coordinates,
+                                      molecule.load(task.file('ligand.pdb')).coordinates)
+    angles = [tuple(angle) for angle in task.data['angles'][start:end]]
+    rows = []
+    for results in fft_sampling.scan(sampler, angles, cores):
+        rows.extend([score] + list(pose_angles) + list(shift) for score, pose_angles, shift in results)
+    return np.array(rows, dtype=np.int64).reshape(-1, 7)
+
+
+def score_shard(task, start, end, cores):
+    """Ele, Desolv and VDW rows of a range of poses"""
+    receptor = scoring_engine.ScoringMolecule(task.file('receptor.pdb'), task.file('receptor.amber'), cached=True)
+    ligand = scoring_engine.ScoringMolecule(task.file('ligand.pdb'), task.file('ligand.amber'))
+    poses = np.load(task.file('poses.npy'), mmap_mode='r')[start:end]
+    lower, upper = task.data['bounds']
+    terms = scoring_engine.score_transforms(receptor, ligand, poses[:, :9].reshape(-1, 3, 3), poses[:, 9:], cores,
+                                            (np.array(lower), np.array(upper)))
+    return np.column_stack(terms)
+
+
+runners = {'sampling': sample_shard, 'scoring': score_shard}
+
+
+def work_on(task, cores):
+    """Runs the shards of a task that nobody has, returns the number run"""
+    count = 0
+    for shard in range(len(task.shards)):
+        if task.claim(shard):
+            task.run(shard, cores)
+            count += 1
+    return count
+
+
+def open_tasks(root):
+    tasks = []
+    for name in sorted(os.listdir(root)) if os.path.isdir(root) else []:
+        try:
+            tasks.append(ShardTask(os.path.join(root, name)))
+        except (IOError, OSError, ValueError):
+            pass
+    return tasks
+
+
+def serve(root, cores, once=False):
+    """Worker loop: runs the shards of every task in root, waiting for new ones unless once"""
+    while True:
+        count = 0
+        for task in open_tasks(root):
+            try:
+                count += work_on(task, cores)
+            except (IOError, OSError):
+                # The coordinator removed the task meanwhile
+                pass
+        if once and not count:
+            return
+        if not count:
+            time.sleep(poll_interval)
+
+
+def coordinate(task, local_cores=1):
+    """Waits for the results of every shard, retrying the failed and stale ones, and returns them in order.
+
+    A local worker with local_cores runs whenever shards are left, so the task
+    ends without other workers too. The task folder is removed at the end.
+    """
+    attempts = [0] * len(task.shards)
+    local = None
+    try:
+        while True:
+            now = task.now()
+            states = [task.state(shard, now) for shard in range(len(task.shards))]
+            for shard, state in enumerate(states):
+                if state in ('failed', 'stale'):
+                    attempts[shard] += 1
+                    if attempts[shard] >= max_attempts:
+                        try:
+                            with open(task.shard_file(shard, '.failed')) as input_file:
+                                reason = input_file.read().strip()
+                        except IOError:
+                            reason = 'worker stopped'
+                        raise ShardFailed('Shard %d of %s failed %d times: %s' % (shard, task.path, attempts[shard],
+                                                                                 reason))
+                    task.release(shard)
+                    states[shard] = 'pending'
+            if all(state == 'done' for state in states):
+                return [task.result(shard) for shard in range(len(task.shards))]
+            if local_cores and 'pending' in states and (local is None or not local.is_alive()):
+                if local is not None:
+                    local.join()
+                local = multiprocessing.Process(target=work_on, args=(task, local_cores))
+                local.start()
+            time.sleep(poll_interval)
+    finally:
+        if local is not None:
+            local.terminate()
+            local.join()
+        shutil.rmtree(task.path, ignore_errors=True)
+
+
+def ranges(count, size):
+    return [[start, min(start + size, count)] for start in range(0, count, size)]
+
+
+def sample(project_name, receptor_pdb, ligand_pdb, num_cores, root, angles=None):
+    """Sharded fft_sampling.sample: writes the project .ftdock and .rot files"""
+    sampler = fft_sampling.FFTSampler(molecule.load(receptor_pdb).coordinates, molecule.load(ligand_pdb).coordinates)
+    angles = angles or fft_sampling.rotation_angles(fft_sampling.angle_step)
+    task = ShardTask.create(root, 'sampling', {'receptor.pdb': receptor_pdb, 'ligand.pdb': ligand_pdb},
+                            ranges(len(angles), rotations_per_shard), {'angles': [list(angle) for angle in angles]})
+    results = []
+    for rows in coordinate(task, num_cores):
+        results.extend((int(row[0]), tuple(int(value) for value in row[1:4]), tuple(int(value) for value in row[4:7]))
+                       for row in rows)
+    return fft_sampling.write_results(project_name, receptor_pdb, ligand_pdb, sampler, len(angles), results)
+
+
+def score(project_name, num_cores, root, scoring_module='dockser', store=None, clusters=None):
+    """Sharded scoring_engine.score: writes the project .ene file.
+
+    The potential grids of every shard span the translations of all the
+    poses, so the energies are the ones of a single host.
+    """
+    if scoring_module not in scoring_engine.scoring_modules:
+        raise ValueError("Scoring module %s not supported by the native engine" % scoring_module)
+    rotations, translations, confs, members = scoring_engine.poses_to_score(project_name, store, clusters)
+    files = {}
+    for name, suffix in [('receptor.pdb', scoring_engine.receptor_suffix),
+                         ('ligand.pdb', scoring_engine.ligand_suffix),
+                         ('receptor.amber', scoring_engine.receptor_amber_suffix),
+                         ('ligand.amber', scoring_engine.ligand_amber_suffix)]:
+        files[name] = "%s%s" % (project_name, suffix)
+    bounds = [list(translations.min(axis=0)), list(translations.max(axis=0))] if len(translations) else [[0.0] * 3] * 2
+    task = ShardTask.create(root, 'scoring', files, ranges(len(rotations), poses_per_shard), {'bounds': bounds},
+                            {'poses.npy': np.hstack([rotations.reshape(-1, 9), translations])})
+    terms = coordinate(task, num_cores)
+    terms = np.concatenate(terms) if terms else np.zeros((0, 3))
+    return scoring_engine.write_ene("%s%s" % (project_name, scoring_engine.ene_suffix), confs,
+                                    terms[members, 0], terms[members, 1], terms[members, 2])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="sharding")
+    parser.add_argument("folder", help="Shared folder of the sharded tasks")
+    parser.add_argument("--cores", help="Cores of this worker", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--once", help="Stop when no shard is left instead of waiting for new tasks",
+                        action="store_true")
+    args = parser.parse_args()
+
+    serve(args.folder, args.cores, args.once)
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+
+"""Checkpointed stage scheduler for the docking pipeline"""
+
+import os
+import json
+import threading
+import multiprocessing
+import Queue
+import result_cache
+
+
+""" Scheduler configuration """
+checkpoint_prefix = '.checkpoint_'
+max_parallel_stages = 2
+""" End of configuration """
+
+
+class StageFailed(Exception):
+    """A stage raised an error or did not produce its outputs"""
+    pass
+
+
+def expand(paths):
+    """Files behind a list of paths, walking into folders"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, file_names in os.walk(path):
+                files.extend(os.path.join(root, file_name) for file_name in sorted(file_names))
+        else:
+            files.append(path)
+    return files
+
+
+def fingerprint(paths):
+    """Size and SHA-1 of every file behind paths, None for missing files"""
+    prints = {}
+    for file_name in expand(paths):
+        try:
+            prints[file_name] = [os.path.getsize(file_name), result_cache.file_digest(file_name)]
+        except (IOError, OSError):
+            prints[file_name] = None
+    return prints
+
+
+def wait(finished):
+    """Next finished stage, polling so that the main thread still gets signals"""
+    while True:
+        try:
+            return finished.get(True, 1.0)
+        except Queue.Empty:
+            pass
+
+
+class CoreBudget(object):
+    """Cores shared by the compute-bound stages of several jobs, also across forked processes"""
+    def __init__(self, total):
+        self.total = total
+        self.free = multiprocessing.RawValue('i', total)
+        self.condition = multiprocessing.Condition()
+
+    def acquire(self, cores):
+        """Blocks until the cores are free and takes them, returns the number taken"""
+        cores = max(1, min(cores, self.total))
+        with self.condition:
+            while self.free.value < cores:
+                self.condition.wait(1.0)
+            self.free.value -= cores
+        return cores
+
+    def release(self, cores):
+        with self.condition:
+            self.free.value += cores
+            self.condition.notify_all()
+
+
+class Stage(object):
+    """A pipeline step with the files it reads and the files it writes.
+
+    cores is the number of cores the step keeps busy, 0 for I/O-bound steps.
+    poses, if given, counts the poses the step sampled, scored or built.
+    """
+    def __init__(self, name, function, inputs=(), outputs=(), requires=(), error=None, cores=0, poses=None):
+        self.name = name
+        self.function = function
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.requires = list(requires)
+        self.error = error or '%s stage did not produce its outputs' % name
+        self.cores = cores
+        self.poses = poses
+
+
+class Scheduler(object):
+    """Runs stages once their requirements are done, skipping up to date ones on resume.
+
+    A checkpoint marker is written next to the working files after each stage,
+    recording the fingerprints of its inputs and outputs. Stages without
+    dependencies between them run in parallel threads, so they must not rely
+    on the current working directory. Compute-bound stages wait for their
+    cores in the budget, when one is shared with other jobs, and the recorder
+    if given measures every stage.
+    """
+    def __init__(self, checkpoint_path, validate, resume=False, budget=None, recorder=None):
+        self.checkpoint_path = checkpoint_path
+        self.validate = validate
+        self.resume = resume
+        self.budget = budget
+        self.recorder = recorder
+        self.stages = []
+
+    def add(self, name, function, inputs=(), outputs=(), requires=(), error=None, cores=0, poses=None):
+        self.stages.append(Stage(name, function, inputs, outputs, requires, error, cores, poses))
+
+    def stage(self, name):
+        return [stage for stage in self.stages if stage.name == name][0]
+
+    def marker(self, stage):
+        return os.path.join(self.checkpoint_path, '%s%s.json' % (checkpoint_prefix, stage.name))
+
+    def is_current(self, stage):
+        """Checks the stage marker against the files currently on disk"""
+        try:
+            with open(self.marker(stage)) as input_file:
+                checkpoint = json.load(input_file)
+        except (IOError, ValueError):
+            return False
+        if not checkpoint['outputs']:
+            return False
+        for file_name, recorded in checkpoint['outputs'].items():
+            if recorded is None or not self.validate(file_name, recorded[0], recorded[1]):
+                return False
+        for file_name, recorded in checkpoint['inputs'].items():
+            if os.path.exists(file_name) and fingerprint([file_name])[file_name] != recorded:
+                return False
+        return True
+
+    def checkpoint(self, stage):
+        with open(self.marker(stage) + '.partial', 'w') as output:
+            json.dump({'stage': stage.name, 'inputs': fingerprint(stage.inputs),
+                       'outputs': fingerprint(stage.outputs)}, output)
+        os.rename(self.marker(stage) + '.partial', self.marker(stage))
+
+    def plan(self):
+        """Names of the stages to run: all of them, or on resume the ones needed to renew the outputs"""
+        if not self.resume:
+            return [stage.name for stage in self.stages]
+        to_run = set()
+        visited = set()
+
+        def visit(stage):
+            if stage.name in visited:
+                return
+            visited.add(stage.name)
+            if not self.is_current(stage):
+                to_run.add(stage.name)
+                for name in stage.requires:
+                    visit(self.stage(name))
+        for stage in self.stages:
+            if not any(stage.name in other.requires for other in self.stages):
+                visit(stage)
+        # Stages reading the outputs of a stage that runs again have to run as well
+        for stage in self.stages:
+            if any(name in to_run for name in stage.requires):
+                to_run.add(stage.name)
+        return [stage.name for stage in self.stages if stage.name in to_run]
+
+    def execute(self, stage, finished):
+        try:
+            granted = self.budget.acquire(stage.cores) if self.budget and stage.cores else 0
+            try:
+                if self.recorder:
+                    self.recorder.measure(stage.name, stage.function)
+                else:
+                    stage.function()
+            finally:
+                if granted:
+                    self.budget.release(granted)
+            outputs = expand(stage.outputs)
+            if not all(self.validate(file_name) for file_name in outputs) or not stage.outputs:
+                raise StageFailed(stage.error)
+            if self.recorder:
+                self.recorder.record(stage.name, files=len(outputs), poses=stage.poses() if stage.poses else None)
+            self.checkpoint(stage)
+            finished.put((stage.name, None))
+        except Exception, e:
+            finished.put((stage.name, e))
+
+    def run(self):
+        """Runs the planned stages, returns the names of the skipped ones"""
+        to_run = self.plan()
+        done = set(stage.name for stage in self.stages if stage.name not in to_run)
+        if self.recorder:
+            for name in [stage.name for stage in self.stages if stage.name in done]:
+                self.recorder.skip(name)
+        pending = [self.stage(name) for name in to_run]
+        finished = Queue.Queue()
+        running = 0
+        error = None
+        while pending or running:
+            ready = [stage for stage in pending if all(name in done for name in stage.requires)]
+            while ready and running < max_parallel_stages and error is None:
+                stage = ready.pop(0)
+                pending.remove(stage)
+                thread = threading.Thread(target=self.execute, args=(stage, finished))
+                thread.daemon = True
+                thread.start()
+                running += 1
+            if not running:
+                break
+            name, failure = wait(finished)
+            running -= 1
+            if failure is not None and error is None:
+                error = failure
+            else:
+                done.add(name)
+        if error is not None:
+            if isinstance(error, StageFailed):
+                raise error
+            raise StageFailed(str(error))
+        return [stage.name for stage in self.stages if stage.name not in to_run]
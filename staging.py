@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+
+"""Local staging workspace with a size budget, spilling to the project storage when it is exceeded"""
+
+import os
+import shutil
+import hashlib
+import threading
+
+
+""" Staging configuration """
+staging_prefix = 'pydockdna_'
+working_folder_name = 'work'
+results_folder_name = 'results'
+copy_buffer_size = 16 * 1024 * 1024
+""" End of configuration """
+
+
+def disk_usage(path):
+    """Bytes of the files below path, without following links"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def free_space(path):
+    stat = os.statvfs(path)
+    return stat.f_bavail * stat.f_frsize
+
+
+def copy_sequential(source, destination):
+    """Copies a file in large blocks to a partial file renamed at the end, keeping its times"""
+    with open(source, 'rb') as input_file:
+        with open(destination + '.partial', 'wb') as output:
+            shutil.copyfileobj(input_file, output, copy_buffer_size)
+    shutil.copystat(source, destination + '.partial')
+    os.rename(destination + '.partial', destination)
+    return destination
+
+
+class StagingArea(object):
+    """Working and results folders of a job on local storage, usually a tmpfs.
+
+    The folder name depends on the project path, so a resumed job finds it
+    again. When the files staged take more than budget bytes, or than the
+    free space left, the largest entries of the working folder are moved to
+    spill_path and replaced by links, so the stages keep finding them. The
+    entries the running stages read or write are left in place, and room is
+    made before a stage writes large outputs.
+    """
+    def __init__(self, root, project_path, budget, spill_path):
+        name = hashlib.sha1(os.path.abspath(project_path)).hexdigest()[:16]
+        self.path = os.path.join(root, staging_prefix + name)
+        self.working_path = os.path.join(self.path, working_folder_name)
+        self.results_path = os.path.join(self.path, results_folder_name)
+        self.budget = budget
+        self.spill_path = spill_path
+        self.lock = threading.Lock()
+        self.busy = []
+        for path in [self.working_path, self.results_path, self.spill_path]:
+            if not os.path.exists(path):
+                os.makedirs(path)
+
+    def usage(self):
+        return disk_usage(self.path)
+
+    def is_busy(self, path):
+        """Whether a running stage reads or writes path, or files below it"""
+        return any(busy == path or busy.startswith(path + os.sep) for busy in self.busy)
+
+    def spill(self, room=0):
+        """Spills the largest entries not in use until the staged files fit with room bytes to spare.
+
+        Called with the lock held, returns the names spilled and whether the files fit.
+        """
+        used = self.usage()
+        limit = min(self.budget, used + free_space(self.path))
+        entries = []
+        for name in os.listdir(self.working_path):
+            path = os.path.join(self.working_path, name)
+            if not os.path.islink(path) and not self.is_busy(os.path.abspath(path)):
+                entries.append((disk_usage(path) if os.path.isdir(path) else os.lstat(path).st_size, name))
+        spilled = []
+        for size, name in sorted(entries, reverse=True):
+            if used + room <= limit:
+                break
+            source = os.path.join(self.working_path, name)
+            destination = os.path.join(self.spill_path, name)
+            if os.path.isdir(destination):
+                shutil.rmtree(destination)
+            shutil.move(source, destination)
+            os.symlink(destination, source)
+            used -= size
+            spilled.append(name)
+        return spilled, used + room <= limit
+
+    def enforce(self):
+        """Spills the largest working entries until the staged files fit, returns the names spilled"""
+        with self.lock:
+            return self.spill()[0]
+
+    def place(self, folders):
+        """Makes the working folders links to empty folders of spill_path, so they are written there"""
+        for folder in folders:
+            destination = os.path.join(self.spill_path, os.path.basename(folder))
+            if os.path.islink(folder):
+                os.remove(folder)
+            elif os.path.isdir(folder):
+                shutil.rmtree(folder)
+            if os.path.isdir(destination):
+                shutil.rmtree(destination)
+            os.makedirs(destination)
+            os.symlink(destination, folder)
+
+    def staged(self, function, paths=(), expected=None, folders=()):
+        """function followed by the enforcement of the budget, paths kept in place while it runs.
+
+        expected, if given, returns the bytes the function is about to write.
+        Room is made for them before it starts, and when they cannot fit its
+        output folders, working folders it writes from scratch, are placed on
+        spill_path instead.
+        """
+        paths = [os.path.abspath(path) for path in paths]
+
+        def run():
+            with self.lock:
+                if expected and not self.spill(expected())[1]:
+                    self.place(folders)
+                self.busy.extend(paths)
+            try:
+                result = function()
+            finally:
+                with self.lock:
+                    for path in paths:
+                        self.busy.remove(path)
+            self.enforce()
+            return result
+        return run
+
+    def flush(self, file_names, results_path):
+        """Copies the named staged results to results_path, returns the paths written"""
+        written = []
+        for file_name in file_names:
+            source = os.path.join(self.results_path, file_name)
+            if os.path.exists(source):
+                written.append(copy_sequential(source, os.path.join(results_path, file_name)))
+        return written
+
+    def remove(self):
+        """Removes the staged folder and the files spilled from it"""
+        for name in os.listdir(self.working_path):
+            path = os.path.join(self.working_path, name)
+            if os.path.islink(path) and os.path.realpath(path).startswith(os.path.abspath(self.spill_path)):
+                target = os.path.realpath(path)
+                if os.path.isdir(target):
+                    shutil.rmtree(target, ignore_errors=True)
+                elif os.path.exists(target):
+                    os.remove(target)
+        shutil.rmtree(self.path, ignore_errors=True)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+
+"""Streaming of the sampled poses to the scoring workers, overlapping sampling, scoring and models"""
+
+import bisect
+import heapq
+import multiprocessing
+import numpy as np
+import fft_sampling
+import molecule
+import scoring_engine
+
+
+""" Streaming configuration """
+batches_per_worker = 2
+""" End of configuration """
+
+_engine = None
+
+
+def _score_batch(batch):
+    rotations, translations = batch
+    _engine.rotations, _engine.translations = rotations, translations
+    return _engine.score_poses(np.arange(len(rotations)))
+
+
+def stored_poses(sampler, keys):
+    """Rotations and translations of sampled poses as the scoring reads them back from the pose store"""
+    values = [list(fft_sampling.rotation_matrix(*angles).ravel()) +
+              list(sampler.receptor_center + np.array(shift) * sampler.cell_span) for _, angles, shift in keys]
+    # Rounded as in the .rot file
+    values = np.array([[float('%8.3f' % value) for value in row] for row in values]).reshape(-1, 12)
+    return values[:, :9].reshape(-1, 3, 3), values[:, 9:]
+
+
+def contact_bounds(sampler, receptor, ligand):
+    """Bounds of the translations of the poses in contact with the receptor"""
+    ligand_radius = np.sqrt(((ligand.coordinates - ligand.coordinates.mean(axis=0)) ** 2).sum(axis=1)).max()
+    margin = ligand_radius + 2.0 * fft_sampling.atom_radius + fft_sampling.surface_thickness + sampler.cell_span
+    return receptor.coordinates.min(axis=0) - margin, receptor.coordinates.max(axis=0) + margin
+
+
+def stream(project_name, receptor_pdb, ligand_pdb, num_cores, num_models, angles=None, sampled=None,
+           confirmed=None):
+    """Samples and scores the project poses in one pass, writing its .ftdock, .rot and .ene files.
+
+    One pool of num_cores workers correlates the rotation chunks and scores
+    the poses. The poses of every finished chunk enter the best keep_total
+    kept so far, exactly as the batch sampling keeps them, and wait there for
+    the scoring, best FTDock score first. At most batches_per_worker batches
+    per worker are scored at a time, poses that fall out of the kept ones are
+    dropped. Once the sampling ends, sampled() is called after the
+    .rot file is written, then confirmed(confs) every time poses are certain
+    to be among the num_models best by energy. Returns the number of poses
+    scored, the dropped ones included.
+    """
+    global _engine
+    sampler = fft_sampling.FFTSampler(molecule.load(receptor_pdb).coordinates,
+                                      molecule.load(ligand_pdb).coordinates)
+    angles = angles or fft_sampling.rotation_angles(fft_sampling.angle_step)
+    receptor, ligand = scoring_engine.load_molecules(project_name)
+    lower, upper = contact_bounds(sampler, receptor, ligand)
+    kept = []
+    waiting = []
+    energies = {}
+    in_flight = []
+    outside = []
+    scored = [0]
+
+    def is_kept(key):
+        position = bisect.bisect_left(kept, key)
+        return position < len(kept) and kept[position] == key
+
+    def admit(results):
+        for score, pose_angles, shift in results:
+            key = (-score, pose_angles, shift)
+            if len(kept) < fft_sampling.keep_total or key < kept[-1]:
+                bisect.insort(kept, key)
+                heapq.heappush(waiting, key)
+                if len(kept) > fft_sampling.keep_total:
+                    energies.pop(kept.pop(), None)
+
+    def dispatch():
+        while waiting and len(in_flight) < batches_per_worker * workers:
+            keys = []
+            while waiting and len(keys) < scoring_engine.poses_per_batch:
+                key = heapq.heappop(waiting)
+                if is_kept(key):
+                    keys.append(key)
+            if not keys:
+                break
+            rotations, translations = stored_poses(sampler, keys)
+            inside = np.all((translations >= lower) & (translations <= upper), axis=1)
+            outside.extend((key, rotation, translation) for key, rotation, translation, fits in
+                           zip(keys, rotations, translations, inside) if not fits)
+            keys = [key for key, fits in zip(keys, inside) if fits]
+            if keys:
+                in_flight.append((keys, pool.apply_async(_score_batch, ((rotations[inside], translations[inside]),))))
+
+    def collect(block):
+        while in_flight and (block or in_flight[0][1].ready()):
+            keys, result = in_flight.pop(0)
+            store(keys, result.get())
+            block = False
+
+    def store(keys, terms):
+        scored[0] += len(keys)
+        for key, ele, desolv, vdw in zip(keys, *terms):
+            if is_kept(key):
+                energies[key] = (ele, desolv, vdw, scoring_engine.total_energy(ele, desolv, vdw))
+
+    def sample():
+        # No more chunks queued than the memory limit allows to correlate at once, the scoring batches go between
+        while chunks and len(sampling) < sampling_workers:
+            sampling.append(pool.apply_async(fft_sampling._correlate_chunk, (chunks.pop(0),)))
+
+    workers = max(1, num_cores)
+    arguments, sampling_workers = fft_sampling.worker_arguments(sampler, workers)
+    chunks = fft_sampling.chunked(angles)
+    sampling = []
+    # The workers are forked once the potential grids are computed, and inherit them
+    _engine = scoring_engine.ScoringEngine(receptor, ligand, None, None, (lower, upper))
+    pool = multiprocessing.Pool(workers, fft_sampling._init_worker, arguments)
+    try:
+        sample()
+        while sampling:
+            admit(sampling.pop(0).get())
+            sample()
+            collect(False)
+            dispatch()
+        fft_sampling.write_results(project_name, receptor_pdb, ligand_pdb, sampler, len(angles),
+                                   [(-key[0], key[1], key[2]) for key in kept])
+        conf_of = dict((key, index + 1) for index, key in enumerate(kept))
+        if sampled:
+            sampled()
+        built = set()
+
+        def confirm():
+            # Even if every pose left were better, these stay among the best
+            slots = num_models - (len(kept) - len(energies))
+            if not confirmed or slots <= 0:
+                return
+            best = heapq.nsmallest(slots, [(terms[3], conf_of[key]) for key, terms in energies.items()])
+            new = [conf for _, conf in best if conf not in built]
+            if new:
+                built.update(new)
+                confirmed(new)
+        while waiting or in_flight:
+            dispatch()
+            collect(True)
+            confirm()
+    finally:
+        pool.terminate()
+        pool.join()
+        _engine = None
+    # Scored by their own workers, once the pool is gone
+    if outside:
+        keys = [key for key, _, _ in outside if is_kept(key)]
+        rotations = np.array([rotation for key, rotation, _ in outside if is_kept(key)]).reshape(-1, 3, 3)
+        translations = np.array([translation for key, _, translation in outside if is_kept(key)]).reshape(-1, 3)
+        if keys:
+            store(keys, scoring_engine.score_transforms(receptor, ligand, rotations, translations, num_cores))
+        confirm()
+    terms = np.array([energies[key][:3] for key in kept]).reshape(-1, 3)
+    scoring_engine.write_ene("%s%s" % (project_name, scoring_engine.ene_suffix), np.arange(1, len(kept) + 1),
+                             terms[:, 0], terms[:, 1], terms[:, 2])
+    return scored[0]
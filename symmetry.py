@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+"""Two-fold (C2) symmetry of homodimeric receptors, to sample only the asymmetric unit of the rotations"""
+
+import numpy as np
+import fft_sampling
+import pose_store
+
+
+""" Symmetry configuration """
+fit_atom = 'CA'
+rmsd_cutoff = 3.0
+min_coverage = 0.9
+mates_suffix = '.mates' + pose_store.store_suffix
+""" End of configuration """
+
+
+def superpose(mobile, target):
+    """Rotation and translation that best fit mobile onto target (Kabsch), and the RMSD of the fit"""
+    mobile_center = mobile.mean(axis=0)
+    target_center = target.mean(axis=0)
+    u, _, vt = np.linalg.svd(np.dot((mobile - mobile_center).T, target - target_center))
+    correction = np.diag([1.0, 1.0, np.sign(np.linalg.det(np.dot(vt.T, u.T)))])
+    rotation = np.dot(vt.T, np.dot(correction, u.T))
+    translation = target_center - np.dot(rotation, mobile_center)
+    moved = np.dot(mobile, rotation.T) + translation
+    return rotation, translation, np.sqrt(((moved - target) ** 2).sum(axis=1).mean())
+
+
+class C2Symmetry(object):
+    """Rotation of 180 degrees around the axis through point, that leaves the receptor unchanged.
+
+    A pose (R, t) of the ligand and its mate (S R, S (t - p) + p) are the same
+    complex, so only the rotations of one half of the space are sampled. The
+    half kept is the one where the ligand x axis points to the positive side
+    of a fixed direction normal to the symmetry axis.
+    """
+    def __init__(self, axis, point):
+        self.axis = np.asarray(axis, dtype=np.float64) / np.sqrt(np.dot(axis, axis))
+        self.point = np.asarray(point, dtype=np.float64)
+        self.matrix = 2.0 * np.outer(self.axis, self.axis) - np.eye(3)
+        normal = np.cross(self.axis, np.eye(3)[np.argmin(np.abs(self.axis))])
+        self.normal = normal / np.sqrt(np.dot(normal, normal))
+
+    def mates(self, rotations, translations):
+        """Rotations and translations of the symmetry mates of the poses"""
+        return (np.einsum('ij,njk->nik', self.matrix, rotations),
+                np.dot(translations - self.point, self.matrix.T) + self.point)
+
+    def asymmetric_unit(self, rotations):
+        """Whether each rotation is in the sampled half, both halves keep the rotations on their border"""
+        return np.dot(np.asarray(rotations)[:, :, 0], self.normal) >= -1e-6
+
+    def header(self):
+        return {'axis': list(self.axis), 'point': list(self.point)}
+
+    @staticmethod
+    def from_header(header):
+        """Symmetry recorded in a pose store header, None if there is none"""
+        if 'symmetry' not in header:
+            return None
+        return C2Symmetry(header['symmetry']['axis'], header['symmetry']['point'])
+
+
+def detect(receptor):
+    """C2 symmetry that swaps two chains of the receptor, None if no pair of chains is related by one.
+
+    The chains are matched on the residue name and number of their alpha
+    carbons, the side chains of crystal homodimers often differ.
+    """
+    alpha = np.nonzero(receptor.atoms['name'] == fit_atom)[0]
+    chains = receptor.atoms['chain'][alpha]
+    residues = ['%s.%s' % key for key in zip(receptor.atoms['res_name'][alpha], receptor.atoms['res_seq'][alpha])]
+    names = sorted(set(chains))
+    for first in range(len(names)):
+        for second in range(first + 1, len(names)):
+            first_atoms = dict((residues[index], alpha[index]) for index in np.nonzero(chains == names[first])[0])
+            second_atoms = dict((residues[index], alpha[index]) for index in np.nonzero(chains == names[second])[0])
+            common = sorted(set(first_atoms) & set(second_atoms))
+            if not common or len(common) < min_coverage * max(len(first_atoms), len(second_atoms)):
+                continue
+            a = receptor.coordinates[[first_atoms[key] for key in common]]
+            b = receptor.coordinates[[second_atoms[key] for key in common]]
+            # The same operation maps each chain onto the other one
+            both = np.concatenate([a, b])
+            rotation, _, rmsd = superpose(both, np.concatenate([b, a]))
+            if rmsd > rmsd_cutoff:
+                continue
+            values, vectors = np.linalg.eigh((rotation + rotation.T) / 2.0)
+            return C2Symmetry(vectors[:, np.argmax(values)], both.mean(axis=0))
+    return None
+
+
+def asymmetric_angles(angles, symmetry):
+    """FTDock angles of the rotations in the asymmetric unit"""
+    rotations = np.array([fft_sampling.rotation_matrix(*angle) for angle in angles]).reshape(-1, 3, 3)
+    return [angle for angle, kept in zip(angles, symmetry.asymmetric_unit(rotations)) if kept]
+
+
+def with_mates(store, store_file):
+    """Writes the poses of store and their symmetry mates as a new store, returns their number.
+
+    The mate of pose i gets the ID i plus the largest ID of store.
+    """
+    symmetry = C2Symmetry.from_header(store.header)
+    records = np.array(store.records)
+    if symmetry is not None and len(records):
+        rotations, translations, ids = store.poses()
+        rotations, translations = symmetry.mates(rotations, translations)
+        mates = pose_store.pose_records(ids + ids.max(), rotations, translations, records['score'])
+        records = np.concatenate([records, mates])
+    pose_store.write_records(store_file, records, store.header)
+    return len(records)
@@ -0,0 +1,53 @@
+"""
+Testing module for benchmark
+"""
+import os
+import signal
+from .test_docking_dna import RegressionTest
+from ..benchmark import scale_poses, run_benchmarks, compare, bench_name, measure
+from ..model_builder import read_rot
+from ..docking_dna import get_top_from_ene
+
+
+def killed():
+    os.kill(os.getpid(), signal.SIGKILL)
+
+
+test_scratch_folder = 'scratch'
+
+
+class TestBenchmark(RegressionTest):
+
+    def setup(self):
+        self.path = os.path.dirname(os.path.realpath(__file__))
+        self.test_path = os.path.join(self.path, test_scratch_folder)
+        self.ini_test_path()
+
+    def teardown(self):
+        self.clean_test_path()
+
+    def test_measure_killed(self):
+        # A child killed by the system is reported instead of waited for
+        result = measure(killed, ())
+
+        assert result == (None, None, None, 'no result, exit code -9')
+
+    def test_scale_poses(self):
+        scale_poses(self.test_path, 12000)
+
+        rotations, translations, confs = read_rot(os.path.join(self.test_path, bench_name + '.rot'))
+        assert len(confs) == 12000 and confs[-1] == 12000
+        # Pose 10001 is the first mock pose again
+        assert (rotations[10000] == rotations[0]).all() and abs(translations[10000] - translations[0]).max() < 5
+        assert len(get_top_from_ene(os.path.join(self.test_path, bench_name + '.ene'), top=20000)) == 12000
+        ftdock = open(os.path.join(self.test_path, bench_name + '.ftdock')).readlines()
+        assert ftdock[-1].startswith('G_DATA  12000')
+
+    def test_run_and_compare(self):
+        results = run_benchmarks(self.test_path, [500], 5, 1, only=['get_top_from_ene', 'ene_to_csv'])
+
+        assert sorted(results) == ['ene_to_csv@500', 'get_top_from_ene@500']
+        assert results['get_top_from_ene@500']['items'] == 500
+        assert compare(results, results) == []
+        slower = dict((key, dict(result, seconds=result['seconds'] / 2.0 - 1.0)) for key, result in results.items())
+        assert len(compare(results, slower)) == 2
@@ -2,10 +2,15 @@
 Testing module for docking_dna
 """
 import os
+import json
 import shutil
 import filecmp
 from nose import with_setup
-from ..docking_dna import mark_as_complete
+from ..docking_dna import mark_as_complete, read_batch, read_config, run_batch, rerank, results_csv_file, \
+    CommandLineParser
+from ..energy_table import open_table
+from ..result_cache import chain_selection
+from .. import docking_dna
 
 
 test_scratch_folder = 'scratch'
@@ -55,3 +60,117 @@ class TestDockingDNA(RegressionTest):
 
         assert filecmp.cmp(os.path.join(self.golden_data_path, 'results.json'),
                             os.path.join(self.test_path, test_project_folder, '.results.json'))
+        # Only the top models of the run are listed
+        mark_as_complete(test_project_folder, test_project_name, num_top=3)
+        output_files = json.load(open(json_file_name))['output_files']
+        expected = [results_csv_file, 'top_1.pdb', 'top_2.pdb', 'top_3.pdb']
+        assert [entry['file_path'] for entry in output_files][-4:] == \
+            ['%s/%s' % (test_project_folder, name) for name in expected]
+
+    def test_write_ini(self):
+        mock = os.path.join(self.path, '..', 'mock', '3mfk', '3mfk')
+        os.chdir(self.test_path)
+
+        ini_file = docking_dna.write_ini('test', mock + '_rec.pdb', mock + '_lig.pdb')
+
+        assert chain_selection(ini_file) == chain_selection(mock + '.ini')
+
+    def test_write_ini_chains(self):
+        os.chdir(self.test_path)
+        atom = 'ATOM      1  N   GLY %s 302      97.037  77.521  79.330  1.00102.62\n'
+        for file_name, chains in [('rec.pdb', 'AB'), ('lig.pdb', 'AC'), ('blank.pdb', ' ')]:
+            with open(file_name, 'w') as output:
+                output.writelines(atom % chain for chain in chains)
+
+        ini_file = docking_dna.write_ini('test', 'rec.pdb', 'lig.pdb')
+
+        # The ligand chain A is renamed, so pyDock tells it apart from the receptor one
+        assert chain_selection(ini_file) == '[receptor]\nmol=A,B\nnewmol=A,B\n[ligand]\nmol=A,C\nnewmol=D,C'
+        # Chains without ID are left to the pyDock script
+        try:
+            docking_dna.write_ini('test', 'rec.pdb', 'blank.pdb')
+            assert False
+        except ValueError, e:
+            assert 'without chain ID' in str(e)
+
+    def test_finish_models(self):
+        mock = os.path.join(self.path, '..', 'mock', '3mfk', '3mfk')
+        for suffix in ['_rec.pdb.H', '_lig.pdb.H', '.rot']:
+            shutil.copyfile(mock + suffix, os.path.join(self.test_path, '3mfk' + suffix))
+        os.chdir(self.test_path)
+        segment = docking_dna.open_models(self.test_path, '3mfk')
+        docking_dna.add_models(self.test_path, '3mfk', [5, 3, 8], segment)
+
+        docking_dna.finish_models(self.test_path, '3mfk', [5, 3, 8], segment)
+
+        # Every top model is its own model file, linked rather than copied
+        for i, conf in enumerate([5, 3, 8]):
+            model = os.stat(os.path.join('models', 'mug_3mfk_%d.pdb' % conf))
+            top = os.stat('top_%d.pdb' % (i + 1))
+            assert (top.st_dev, top.st_ino) == (model.st_dev, model.st_ino)
+        assert not os.path.exists('top_4.pdb')
+
+    def test_remove_spilled_models(self):
+        spilled = os.path.join(self.test_path, 'spill', 'models')
+        os.makedirs(spilled)
+        os.symlink(spilled, os.path.join(self.test_path, 'models'))
+
+        docking_dna.remove_models(self.test_path)
+
+        assert not os.path.lexists(os.path.join(self.test_path, 'models')) and not os.path.exists(spilled)
+
+    def test_read_config_restraints(self):
+        config_file = os.path.join(self.test_path, 'config.json')
+        with open(config_file, 'w') as output:
+            output.write('{"input_files": [{"name": "receptor", "value": "r"}, {"name": "ligand", "value": "l"}], '
+                         '"arguments": [{"name": "execution", "value": "/tmp/run"}, {"name": "models", "value": 10}, '
+                         '{"name": "receptor_restraints", "value": "A.ARG.45, A.LYS.48"}, '
+                         '{"name": "ligand_restraints", "value": ["C.DG.1"]}]}')
+
+        config = read_config(config_file)
+
+        assert config[:6] == ('r', 'l', '/tmp/run', 'run', 10, None)
+        assert config[6] == {'receptor_restraints': ['A.ARG.45', 'A.LYS.48'], 'ligand_restraints': ['C.DG.1'],
+                             'restraints_minimum': 1}
+
+    def test_rerank(self):
+        mock_path = os.path.join(self.path, '..', 'mock', '3mfk')
+        shutil.copyfile(os.path.join(mock_path, '3mfk.ene'), os.path.join(self.test_path, '3mfk.ene'))
+
+        rerank(self.test_path, '3mfk', CommandLineParser.valid_weights('desolv=0,vdw=0'))
+
+        table = open_table(os.path.join(self.test_path, '3mfk.ene'))
+        assert len(table) == 10000 and list(table['RANK'][:3]) == [1, 2, 3]
+        assert list(table['Total']) == sorted(table['Ele']) and list(table['Total']) == list(table['Ele'])
+        # The terms are kept, so the default weights rank as pyDock did
+        rerank(self.test_path, '3mfk', CommandLineParser.valid_weights('ele=1'))
+        with open(os.path.join(mock_path, '3mfk.ene')) as expected_file:
+            expected = [line.split()[0] for line in expected_file.readlines()[2:12]]
+        assert [str(conf) for conf in open_table(os.path.join(self.test_path, '3mfk.ene'))['Conf'][:10]] == expected
+
+    def test_batch(self):
+        os.chdir(self.test_path)
+        with open('batch.json', 'w') as output:
+            output.write('[{"config": "first/config.json", "in_metadata": "first/in_metadata.json", '
+                         '"out_metadata": "first/out_metadata.json", "log_file": "first/log.txt"}, '
+                         '{"config": "second/config.json", "in_metadata": "second/in_metadata.json"}]')
+        jobs = read_batch('batch.json')
+
+        assert [job.config for job in jobs] == [os.path.join(self.test_path, 'first', 'config.json'),
+                                                os.path.join(self.test_path, 'second', 'config.json')]
+        assert jobs[1].log_file is None
+
+        def run_job(job, job_cores, budget):
+            if 'second' in job.config:
+                raise SystemExit
+            with open(os.path.join(self.test_path, 'cores.txt'), 'w') as output:
+                output.write(str(job_cores))
+        run_job_function = docking_dna._run_job
+        docking_dna._run_job = run_job
+        try:
+            completed, failed, throughput = run_batch(jobs, 4, jobs_in_flight=3)
+        finally:
+            docking_dna._run_job = run_job_function
+
+        assert completed == 1 and failed == [jobs[1].config] and throughput > 0
+        assert open(os.path.join(self.test_path, 'cores.txt')).read() == '2'
@@ -0,0 +1,65 @@
+"""
+Testing module for energy_table
+"""
+import os
+import json
+import shutil
+from .test_docking_dna import RegressionTest
+from .. import energy_table
+
+
+test_scratch_folder = 'scratch'
+
+
+class TestEnergyTable(RegressionTest):
+
+    def setup(self):
+        self.path = os.path.dirname(os.path.realpath(__file__))
+        self.test_path = os.path.join(self.path, test_scratch_folder)
+        self.ini_test_path()
+        self.ene_file = os.path.join(self.test_path, '3mfk.ene')
+        shutil.copyfile(os.path.join(self.path, '..', 'mock', '3mfk', '3mfk.ene'), self.ene_file)
+
+    def teardown(self):
+        self.clean_test_path()
+
+    def test_open_table(self):
+        table = energy_table.open_table(self.ene_file)
+
+        assert len(table) == 10000 and os.path.exists(energy_table.sidecar_file(self.ene_file))
+        assert list(table[0]) == [2, -605.588, 62.464, -35.664, -546.690, 1]
+        # An older sidecar is written again
+        with open(self.ene_file, 'w') as output:
+            output.write(open(os.path.join(self.path, '..', 'mock', '3mfk', '3mfk.ene')).read()[:-73])
+        os.utime(energy_table.sidecar_file(self.ene_file), (0, 0))
+        assert len(energy_table.open_table(self.ene_file)) == 9999
+        # Rewritten within the same timestamp, with the same size
+        modified = os.path.getmtime(self.ene_file)
+        text = open(self.ene_file).read()
+        with open(self.ene_file, 'w') as output:
+            output.write(text.replace('-605.588', '-605.589', 1))
+        os.utime(self.ene_file, (modified, modified))
+        assert energy_table.open_table(self.ene_file)['Ele'][0] == -605.589
+
+    def test_queries(self):
+        table = energy_table.open_table(self.ene_file)
+
+        assert list(energy_table.top(table, 3)['RANK']) == [1, 2, 3]
+        assert list(energy_table.top(table, 3, 'Total')['Conf']) == list(table['Conf'][:3])
+        best_vdw = energy_table.top(table, 5, 'VDW')
+        assert list(best_vdw['VDW']) == sorted(table['VDW'])[:5]
+        assert energy_table.top(table, 1, 'Ele', descending=True)['Ele'][0] == table['Ele'].max()
+        assert len(energy_table.top(table, 20000)) == 10000
+        selected = energy_table.select(table, 'Total', -500.0, -400.0)
+        assert len(selected) and selected['Total'].min() >= -500.0 and selected['Total'].max() <= -400.0
+
+    def test_export(self):
+        rows = energy_table.top(energy_table.open_table(self.ene_file), 2)
+        csv_file = energy_table.to_csv(rows, os.path.join(self.test_path, 'result.csv'))
+        json_file = energy_table.to_json(rows, os.path.join(self.test_path, 'result.json'))
+
+        assert open(csv_file).read().splitlines() == ['Conf,Ele,Desolv,VDW,Total,RANK',
+                                                      '2,-605.588,62.464,-35.664,-546.690,1',
+                                                      '3,-598.788,61.214,-74.765,-545.050,2']
+        assert json.load(open(json_file))[1] == {'Conf': 3, 'Ele': -598.788, 'Desolv': 61.214, 'VDW': -74.765,
+                                                 'Total': -545.05, 'RANK': 2}
@@ -0,0 +1,63 @@
+"""
+Testing module for executor
+"""
+import os
+import time
+from nose.tools import raises
+from .test_docking_dna import RegressionTest
+from .. import executor
+from ..executor import ExecutionError, parse_progress, affinity_command
+
+
+test_scratch_folder = 'scratch'
+
+
+class TestExecutor(RegressionTest):
+
+    def setup(self):
+        self.path = os.path.dirname(os.path.realpath(__file__))
+        self.test_path = os.path.join(self.path, test_scratch_folder)
+        self.ini_test_path()
+        self.log_file = os.path.join(self.test_path, 'tool.log')
+
+    def teardown(self):
+        self.clean_test_path()
+
+    def test_parse_progress(self):
+        assert parse_progress('Scoring 45% done') == 45.0
+        assert parse_progress('rotation 9 of 20') == 45.0
+        assert parse_progress('Chunk 3/4') == 75.0
+        assert parse_progress('Reading receptor') is None
+        # Dates, paths and counts in other messages are not progress
+        assert parse_progress('run 3 of 12 files') is None
+        assert parse_progress('Started 2026/10/17 08:00') is None
+        assert parse_progress('2026/10') is None
+        assert parse_progress('Reading /data/3/4') is None
+        assert affinity_command('ftdock -static a.pdb', '0-3') == "taskset -c 0-3 /bin/sh -c 'ftdock -static a.pdb'"
+
+    def test_run(self):
+        # Far more output than a pipe buffer holds, on both streams
+        executor.run('for i in $(seq 1 20000); do echo "line $i of 20000"; echo "warning $i" >&2; done',
+                     self.log_file, name='Tool', cwd=self.test_path)
+
+        lines = open(self.log_file).read().splitlines()
+        assert len(lines) == 40000
+        assert 'line 20000 of 20000' in lines and '[stderr] warning 20000' in lines
+
+    @raises(ExecutionError)
+    def test_failure(self):
+        executor.run('echo failing; exit 3', self.log_file)
+
+    def test_timeout(self):
+        marker = os.path.join(self.test_path, 'child_alive')
+        start = time.time()
+        try:
+            executor.run('(sleep 3; touch %s) & sleep 30' % marker, self.log_file, timeout=1)
+            assert False
+        except ExecutionError:
+            pass
+
+        # The whole process group is gone, including the background child
+        time.sleep(3)
+        assert time.time() - start < 10
+        assert not os.path.exists(marker)
@@ -0,0 +1,67 @@
+"""
+Testing module for fft_sampling
+"""
+import os
+import numpy as np
+from .test_docking_dna import RegressionTest
+from ..model_builder import read_pdb, read_rot
+from .. import fft_sampling
+
+
+test_scratch_folder = 'scratch'
+
+
+class TestFFTSampling(RegressionTest):
+
+    def setup(self):
+        self.path = os.path.dirname(os.path.realpath(__file__))
+        self.test_path = os.path.join(self.path, test_scratch_folder)
+        self.ini_test_path()
+        self.mock_path = os.path.normpath(os.path.join(self.path, '..', 'mock', '3mfk'))
+
+    def teardown(self):
+        self.clean_test_path()
+
+    def test_rotation_angles(self):
+        angles = fft_sampling.rotation_angles(12)
+
+        assert len(angles) == 9240
+        assert (264, 156, 336) in angles and (84, 132, 75) in angles
+
+    def test_rotation_matrix(self):
+        rotations, _, _ = read_rot(os.path.join(self.mock_path, '3mfk.rot'))
+
+        # Angles of the first pose in 3mfk.ftdock
+        assert np.allclose(fft_sampling.rotation_matrix(264, 156, 336), rotations[0], atol=1e-3)
+
+    def test_correlate(self):
+        _, receptor = read_pdb(os.path.join(self.mock_path, '3mfk_rec.pdb'))
+        _, ligand = read_pdb(os.path.join(self.mock_path, '3mfk_lig.pdb'))
+        sampler = fft_sampling.FFTSampler(receptor, ligand, size=128)
+        receptor_transform = fft_sampling.forward(sampler.receptor_grid())
+
+        best = sampler.correlate(receptor_transform, np.identity(3), 3)
+
+        # FTDock places the unrotated ligand at its crystal position (pose 2 in 3mfk.rot)
+        _, translations, _ = read_rot(os.path.join(self.mock_path, '3mfk.rot'))
+        translation = sampler.receptor_center + np.array(best[0][1]) * sampler.cell_span
+        assert len(best) == 3 and best[0][0] > 0
+        assert np.sqrt(((translation - translations[1]) ** 2).sum()) < 2.0
+
+    def test_sample(self):
+        os.chdir(self.mock_path)
+        grid_size, keep_total = fft_sampling.grid_size, fft_sampling.keep_total
+        fft_sampling.grid_size, fft_sampling.keep_total = 64, 5
+        try:
+            ftdock_file = fft_sampling.sample(os.path.join(self.test_path, 'test'), '3mfk_rec.pdb', '3mfk_lig.pdb', 1,
+                                              angles=[(0, 0, 0), (264, 156, 336)])
+        finally:
+            fft_sampling.grid_size, fft_sampling.keep_total = grid_size, keep_total
+
+        with open(ftdock_file) as ftdock:
+            lines = ftdock.readlines()
+        assert lines[5] == 'Static molecule                    :: 3mfk_rec.pdb\n'
+        assert lines[16] == 'Global rotations                   ::      2\n'
+        assert len([line for line in lines if line.startswith('G_DATA')]) == 5
+        rotations, translations, ids = read_rot(os.path.join(self.test_path, 'test.rot'))
+        assert list(ids) == [1, 2, 3, 4, 5]
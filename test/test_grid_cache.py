@@ -0,0 +1,82 @@
+"""
+Testing module for grid_cache
+"""
+import os
+import numpy as np
+from .test_docking_dna import RegressionTest
+from .. import grid_cache
+from .. import fft_sampling
+from .. import scoring_engine
+from ..molecule import load
+
+
+test_scratch_folder = 'scratch'
+
+
+class TestGridCache(RegressionTest):
+
+    def setup(self):
+        self.path = os.path.dirname(os.path.realpath(__file__))
+        self.test_path = os.path.join(self.path, test_scratch_folder)
+        self.ini_test_path()
+        self.mock = os.path.normpath(os.path.join(self.path, '..', 'mock', '3mfk', '3mfk'))
+        self.configuration = grid_cache.cache_folder, grid_cache.cache_max_size
+        grid_cache.cache_folder = os.path.join(self.test_path, 'grids')
+
+    def teardown(self):
+        grid_cache.cache_folder, grid_cache.cache_max_size = self.configuration
+        self.clean_test_path()
+
+    def test_cached(self):
+        built = []
+
+        def build():
+            built.append(True)
+            return {'values': np.arange(6.0).reshape(2, 3)}
+
+        first = grid_cache.cached('test', ['a', 1], build)
+        second = grid_cache.cached('test', ['a', 1], build)
+
+        assert len(built) == 1 and isinstance(second['values'], np.memmap)
+        assert np.array_equal(first['values'], second['values'])
+        grid_cache.keep('test', ['a', 1], {'values': np.zeros(2)}, replace=True)
+        assert np.array_equal(grid_cache.fetch('test', ['a', 1])['values'], np.zeros(2))
+        assert grid_cache.fetch('test', ['a', 2]) is None
+        # Least recently used grids are evicted first
+        cache = grid_cache.open_cache()
+        os.utime(cache.entry_path(cache.key('test', 'a', 1)), (0, 0))
+        grid_cache.cache_max_size = 300
+        grid_cache.keep('test', ['b'], {'values': np.zeros(20)})
+        assert grid_cache.fetch('test', ['a', 1]) is None and grid_cache.fetch('test', ['b']) is not None
+
+    def test_receptor_transform(self):
+        receptor, ligand = load(self.mock + '_rec.pdb').coordinates, load(self.mock + '_lig.pdb').coordinates
+        sampler = fft_sampling.FFTSampler(receptor, ligand, size=32)
+
+        sampler.receptor_transform()
+        transform = sampler.receptor_transform()
+
+        assert isinstance(transform, np.memmap)
+        assert np.array_equal(transform, fft_sampling.forward(sampler.receptor_grid()))
+        angles = [(0, 0, 0), (264, 156, 336)]
+        cached = list(fft_sampling.scan(sampler, angles, 1))
+        grid_cache.cache_folder = None
+        assert cached == list(fft_sampling.scan(sampler, angles, 1))
+
+    def test_potential_grid(self):
+        receptor = scoring_engine.ScoringMolecule(self.mock + '_rec.pdb.H', self.mock + '_rec.pdb.amber')
+        weights, kernels = [receptor.charges], [scoring_engine.elec_kernel]
+        center = receptor.coordinates.mean(axis=0)
+        points = center + np.array([[0.0, 0.0, 0.0], [30.0, -20.0, 10.0], [-40.0, 35.0, 5.0]])
+        plain = scoring_engine.PotentialGrid(receptor.coordinates, weights, kernels, points.min(axis=0),
+                                             points.max(axis=0), 2.0)
+
+        small = scoring_engine.PotentialGrid(receptor.coordinates, weights, kernels, center, center, 2.0, True)
+        wide = scoring_engine.PotentialGrid(receptor.coordinates, weights, kernels, points.min(axis=0),
+                                            points.max(axis=0), 2.0, True)
+        again = scoring_engine.PotentialGrid(receptor.coordinates, weights, kernels, center, center, 2.0, True)
+
+        # The grid is widened to both boxes, then reused, with the values of a grid built for the box
+        assert not isinstance(wide.values, np.memmap) and isinstance(again.values, np.memmap)
+        assert np.all(wide.origin <= small.origin) and again.shape == wide.shape
+        assert np.allclose(again.interpolate(points), plain.interpolate(points), rtol=1e-5, atol=1e-8)
@@ -0,0 +1,58 @@
+"""
+Testing module for metrics
+"""
+import os
+import json
+from .test_docking_dna import RegressionTest
+from ..docking_dna import check_output
+from ..stages import Scheduler
+from ..metrics import Recorder, prometheus, aggregate
+
+
+test_scratch_folder = 'scratch'
+
+
+class TestMetrics(RegressionTest):
+
+    def setup(self):
+        self.path = os.path.dirname(os.path.realpath(__file__))
+        self.test_path = os.path.join(self.path, test_scratch_folder)
+        self.ini_test_path()
+
+    def teardown(self):
+        self.clean_test_path()
+
+    def test_recorder(self):
+        rot_file = os.path.join(self.test_path, 'test.rot')
+
+        def sampling():
+            with open(rot_file, 'w') as output:
+                output.write('pose\n' * 3)
+        recorder = Recorder('test')
+        scheduler = Scheduler(self.test_path, check_output, recorder=recorder)
+        scheduler.add('sampling', sampling, outputs=[rot_file], poses=lambda: 3)
+        scheduler.run()
+        recorder.write(os.path.join(self.test_path, '.metrics.json'), os.path.join(self.test_path, '.metrics.prom'))
+
+        stage = json.load(open(os.path.join(self.test_path, '.metrics.json')))['stages'][0]
+        assert stage['stage'] == 'sampling' and stage['poses'] == 3 and stage['files'] == 1
+        assert stage['skipped'] == 0 and stage['wall_seconds'] >= 0 and stage['peak_rss_bytes'] > 0
+        assert 'pydockdna_stage_poses{job="test",stage="sampling"} 3.0' in \
+            open(os.path.join(self.test_path, '.metrics.prom')).read().splitlines()
+
+        recorder = Recorder('test')
+        scheduler = Scheduler(self.test_path, check_output, resume=True, recorder=recorder)
+        scheduler.add('sampling', sampling, outputs=[rot_file])
+        scheduler.run()
+        assert recorder.report()['stages'] == [{'stage': 'sampling', 'skipped': 1}]
+
+    def test_aggregate(self):
+        reports = [{'job': 'first', 'stages': [{'stage': 'scoring', 'wall_seconds': 10.0, 'peak_rss_bytes': 100}]},
+                   {'job': 'second', 'stages': [{'stage': 'scoring', 'wall_seconds': 5.0, 'peak_rss_bytes': 300}]}]
+
+        total = aggregate(reports)
+        assert total['stages'] == [{'stage': 'scoring', 'jobs': 2, 'wall_seconds': 15.0, 'peak_rss_bytes': 300}]
+        total['jobs_per_hour'] = 12.0
+        lines = prometheus(reports + [total]).splitlines()
+        assert 'pydockdna_stage_wall_seconds{job="second",stage="scoring"} 5.0' in lines
+        assert 'pydockdna_jobs_per_hour{job="batch"} 12.0' in lines
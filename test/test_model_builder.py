@@ -0,0 +1,47 @@
+"""
+Testing module for model_builder
+"""
+import os
+import numpy as np
+from .test_docking_dna import RegressionTest
+from ..model_builder import read_rot, read_pdb, make_pdb
+
+
+test_scratch_folder = 'scratch'
+test_project_name = '3mfk'
+models_prefix = 'mug_'
+
+
+class TestModelBuilder(RegressionTest):
+
+    def setup(self):
+        self.path = os.path.dirname(os.path.realpath(__file__))
+        self.test_path = os.path.join(self.path, test_scratch_folder)
+        self.ini_test_path()
+        self.mock_path = os.path.normpath(os.path.join(self.path, '..', 'mock', '3mfk'))
+
+    def teardown(self):
+        self.clean_test_path()
+
+    def test_read_rot(self):
+        rotations, translations, ids = read_rot(os.path.join(self.mock_path, '3mfk.rot'))
+
+        assert rotations.shape == (10000, 3, 3)
+        assert ids[0] == 1 and ids[-1] == 10000
+        assert np.allclose(rotations[1], np.identity(3), atol=1e-3)
+        assert np.allclose(translations[1], [57.409, 84.277, 38.215])
+
+    def test_make_pdb(self):
+        os.chdir(self.mock_path)
+        file_names = make_pdb(test_project_name, ['2', '1'], models_prefix, self.test_path)
+
+        assert [os.path.basename(name) for name in file_names] == ['mug_3mfk_2.pdb', 'mug_3mfk_1.pdb']
+        receptor_lines, _ = read_pdb('3mfk_rec.pdb.H')
+        ligand_lines, ligand = read_pdb('3mfk_lig.pdb.H')
+        model_lines, model = read_pdb(file_names[1])
+        assert model_lines[:len(receptor_lines)] == receptor_lines
+        assert len(model_lines) == len(receptor_lines) + len(ligand_lines)
+        assert [line[:30] for line in model_lines[len(receptor_lines):]] == [line[:30] for line in ligand_lines]
+        rotations, translations, _ = read_rot('3mfk.rot')
+        expected = np.dot(ligand - ligand.mean(axis=0), rotations[0].T) + translations[0]
+        assert np.allclose(model[len(receptor_lines):], expected, atol=1e-3)
@@ -0,0 +1,65 @@
+"""
+Testing module for molecule
+"""
+import os
+import shutil
+import numpy as np
+from .test_docking_dna import RegressionTest
+from .. import molecule
+from ..model_builder import read_pdb
+
+
+test_scratch_folder = 'scratch'
+
+
+class TestMolecule(RegressionTest):
+
+    def setup(self):
+        self.path = os.path.dirname(os.path.realpath(__file__))
+        self.test_path = os.path.join(self.path, test_scratch_folder)
+        self.ini_test_path()
+        mock = os.path.join(self.path, '..', 'mock', '3mfk', '3mfk')
+        for suffix in ['_rec.pdb.H', '_rec.pdb.amber']:
+            shutil.copyfile(mock + suffix, os.path.join(self.test_path, '3mfk' + suffix))
+        self.pdb_file = os.path.join(self.test_path, '3mfk_rec.pdb.H')
+        self.amber_file = os.path.join(self.test_path, '3mfk_rec.pdb.amber')
+        self.cache_folder = molecule.cache_folder
+        molecule.cache_folder = os.path.join(self.test_path, 'work', molecule.cache_folder_name)
+
+    def teardown(self):
+        molecule.cache_folder = self.cache_folder
+        self.clean_test_path()
+
+    def test_pdb(self):
+        structure = molecule.load(self.pdb_file)
+        lines, coordinates = read_pdb(self.pdb_file)
+
+        assert len(structure) == 4484 and np.array_equal(structure.coordinates, coordinates)
+        assert list(structure.atoms[0][['name', 'res_name', 'chain', 'res_seq']]) == ['N', 'GLY', 'A', '302']
+        assert structure.atoms['b_factor'][0] == np.float32(102.62)
+        assert structure.lines() == lines
+        moved = os.path.join(self.test_path, 'moved.pdb')
+        structure.write(moved, structure.coordinates + 1.0)
+        assert np.allclose(read_pdb(moved)[1], coordinates + 1.0, atol=1e-3)
+
+    def test_amber(self):
+        table = molecule.load_amber(self.amber_file)
+
+        assert len(table) == 4484
+        assert list(table[0]) == ['A.GLY.302.N', 'N', 0.2943, 14.01, 1.824]
+        assert list(table['name']) == molecule.load(self.pdb_file).keys()
+
+    def test_cache(self):
+        molecule.load(self.pdb_file)
+        cache_folder = molecule.cache_folder
+
+        # The cache stays out of the input folder
+        assert len(os.listdir(cache_folder)) == 1
+        assert molecule.cache_folder_name not in os.listdir(self.test_path)
+        # A new process reads the cache, a changed file is parsed again
+        molecule._loaded.clear()
+        assert np.array_equal(molecule.load(self.pdb_file).coordinates, read_pdb(self.pdb_file)[1])
+        with open(self.pdb_file, 'a') as output:
+            output.write('END\n')
+        assert molecule.load(self.pdb_file).lines()[-1] == 'END\n'
+        assert len(os.listdir(cache_folder)) == 2
@@ -0,0 +1,81 @@
+"""
+Testing module for packaging
+"""
+import os
+import tarfile
+from .test_docking_dna import RegressionTest
+from .. import packaging
+from ..packaging import ArchiveWriter, read_member
+from ..docking_dna import create_compress_results, models_segment_file
+
+
+test_scratch_folder = 'scratch'
+
+
+class TestPackaging(RegressionTest):
+
+    def setup(self):
+        self.path = os.path.dirname(os.path.realpath(__file__))
+        self.test_path = os.path.join(self.path, test_scratch_folder)
+        self.ini_test_path()
+        self.block_size = packaging.block_size
+        packaging.block_size = 1000
+
+    def teardown(self):
+        packaging.block_size = self.block_size
+        self.clean_test_path()
+
+    def write(self, file_name, content):
+        file_name = os.path.join(self.test_path, file_name)
+        if not os.path.exists(os.path.dirname(file_name)):
+            os.makedirs(os.path.dirname(file_name))
+        with open(file_name, 'w') as output:
+            output.write(content)
+        return file_name
+
+    def members(self, archive_file):
+        with tarfile.open(archive_file, 'r:gz') as archive:
+            return dict((info.name, archive.extractfile(info).read() if info.isfile() else None)
+                        for info in archive.getmembers())
+
+    def test_archive(self):
+        energies = ''.join('%12d%12.3f\n' % (i, -i * 0.5) for i in range(400))
+        archive_file = os.path.join(self.test_path, 'test.tgz')
+        archive = ArchiveWriter(archive_file, threads=3)
+        archive.add_directory('test')
+        archive.add_file(self.write('test.ene', energies), 'test/test.ene')
+        archive.add_bytes('test/setup.log', 'done\n')
+        archive.close()
+
+        assert self.members(archive_file) == {'test': None, 'test/test.ene': energies, 'test/setup.log': 'done\n'}
+        assert read_member(archive_file, 'test/test.ene') == energies
+        assert read_member(archive_file, 'test/setup.log') == 'done\n'
+
+    def test_segment(self):
+        segment_file = os.path.join(self.test_path, 'segment')
+        segment = ArchiveWriter(segment_file)
+        for i in range(5):
+            segment.add_bytes('test/models/mug_test_%d.pdb' % i, 'ATOM %d\n' % i * 100)
+        segment.close(finish=False)
+        archive_file = os.path.join(self.test_path, 'test.tgz')
+        archive = ArchiveWriter(archive_file, segment=segment_file)
+        archive.add_bytes('test/test.ene', 'energies')
+        archive.close()
+
+        members = self.members(archive_file)
+        assert len(members) == 6 and members['test/models/mug_test_4.pdb'] == 'ATOM 4\n' * 100
+        assert read_member(archive_file, 'test/models/mug_test_3.pdb') == 'ATOM 3\n' * 100
+
+    def test_create_compress_results(self):
+        self.write('test.ene', 'energies')
+        self.write('models/mug_test_1.pdb', 'ATOM 1\n')
+        segment = ArchiveWriter(os.path.join(self.test_path, models_segment_file))
+        segment.add_directory('test')
+        segment.add_directory('test/models')
+        segment.add_bytes('test/models/mug_test_1.pdb', 'ATOM 1\n')
+        segment.close(finish=False)
+
+        archive_file = create_compress_results(self.test_path, 'test', 2)
+
+        assert self.members(os.path.join(self.test_path, archive_file)) == \
+            {'test': None, 'test/models': None, 'test/models/mug_test_1.pdb': 'ATOM 1\n', 'test/test.ene': 'energies'}
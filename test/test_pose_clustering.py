@@ -0,0 +1,68 @@
+"""
+Testing module for pose_clustering
+"""
+import os
+import shutil
+import numpy as np
+from .test_docking_dna import RegressionTest
+from .. import pose_clustering
+from ..model_builder import read_rot, read_pdb, transform
+from ..scoring_engine import score
+from ..energy_table import parse_ene
+
+
+test_scratch_folder = 'scratch'
+
+
+class TestPoseClustering(RegressionTest):
+
+    def setup(self):
+        self.path = os.path.dirname(os.path.realpath(__file__))
+        self.test_path = os.path.join(self.path, test_scratch_folder)
+        self.ini_test_path()
+        self.mock = os.path.normpath(os.path.join(self.path, '..', 'mock', '3mfk', '3mfk'))
+        self.rotations, self.translations, self.confs = read_rot(self.mock + '.rot')
+        _, self.ligand = read_pdb(self.mock + '_lig.pdb.H')
+
+    def teardown(self):
+        self.clean_test_path()
+
+    def test_ligand_rmsd(self):
+        center = self.ligand.mean(axis=0)
+        first = transform(self.ligand, center, self.rotations[:20], self.translations[:20])
+        second = transform(self.ligand, center, self.rotations[20:40], self.translations[20:40])
+        expected = np.sqrt(((first - second) ** 2).sum(axis=2).mean(axis=1))
+
+        rmsd = pose_clustering.ligand_rmsd(pose_clustering.gyration_tensor(self.ligand), self.rotations[:20],
+                                           self.translations[:20], self.rotations[20:40], self.translations[20:40])
+
+        # The rotations of the .rot file are rounded, so not exactly orthogonal
+        assert np.allclose(rmsd, expected, atol=0.01)
+
+    def test_cluster(self):
+        rotations = self.rotations[[0, 0, 0, 1]]
+        translations = self.translations[[0, 0, 0, 1]] + np.array([[0, 0, 0], [0.5, 0, 0], [3.0, 0, 0], [0, 0, 0]])
+
+        representatives = pose_clustering.cluster(rotations, translations, self.ligand, 1.0)
+
+        assert list(representatives) == [0, 0, 2, 3]
+        # The visiting order picks the representatives
+        assert list(pose_clustering.cluster(rotations, translations, self.ligand, 1.0, [1, 0, 2, 3])) == [1, 1, 2, 3]
+        representatives = pose_clustering.cluster(self.rotations, self.translations, self.ligand, 2.0)
+        assert len(np.unique(representatives)) < len(self.confs)
+        assert np.all(representatives[representatives] == representatives)
+
+    def test_score_clusters(self):
+        for suffix in ['_rec.pdb.H', '_lig.pdb.H', '_rec.pdb.amber', '_lig.pdb.amber']:
+            shutil.copyfile(self.mock + suffix, os.path.join(self.test_path, 'test' + suffix))
+        with open(self.mock + '.rot') as input_file:
+            lines = input_file.readlines()[:4]
+        with open(os.path.join(self.test_path, 'test.rot'), 'w') as output:
+            output.writelines(lines)
+        os.chdir(self.test_path)
+
+        score('test', 1, clusters=np.array([1, 2, 1, 4]))
+
+        table = parse_ene('test.ene')
+        energies = dict((row['Conf'], row['Total']) for row in table)
+        assert len(table) == 4 and energies[3] == energies[1] and energies[2] != energies[1]
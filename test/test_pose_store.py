@@ -0,0 +1,57 @@
+"""
+Testing module for pose_store
+"""
+import os
+import numpy as np
+from .test_docking_dna import RegressionTest
+from .. import pose_store
+from ..model_builder import read_rot, ModelBuilder
+
+
+test_scratch_folder = 'scratch'
+
+
+class TestPoseStore(RegressionTest):
+
+    def setup(self):
+        self.path = os.path.dirname(os.path.realpath(__file__))
+        self.test_path = os.path.join(self.path, test_scratch_folder)
+        self.ini_test_path()
+        self.mock = os.path.normpath(os.path.join(self.path, '..', 'mock', '3mfk', '3mfk'))
+        self.store_file = os.path.join(self.test_path, 'test.poses')
+
+    def teardown(self):
+        self.clean_test_path()
+
+    def test_rot_round_trip(self):
+        pose_store.rot_to_store(self.mock + '.rot', self.store_file, self.mock + '.ftdock', self.mock + '_rec.pdb')
+        rotations, translations, ids = read_rot(self.mock + '.rot')
+        store = pose_store.PoseStore(self.store_file)
+
+        assert len(store) == 10000 and store.header['grid_size'] == 208
+        assert os.path.getsize(self.store_file) < os.path.getsize(self.mock + '.rot') / 2
+        # The poses are exactly the ones of the .rot file
+        stored_rotations, stored_translations, stored_ids = store.poses(100, 200)
+        assert (stored_ids == ids[100:200]).all()
+        assert np.array_equal(stored_rotations, rotations[100:200])
+        assert np.array_equal(stored_translations, translations[100:200])
+        assert pose_store.load(self.store_file)[0].shape == (10000, 3, 3)
+
+        rot_file = pose_store.store_to_rot(self.store_file, os.path.join(self.test_path, 'test.rot'))
+        assert all(np.array_equal(values, expected) for values, expected in zip(read_rot(rot_file),
+                                                                                 (rotations, translations, ids)))
+
+    def test_ftdock_round_trip(self):
+        pose_store.ftdock_to_store(self.mock + '.ftdock', self.mock + '_rec.pdb', self.store_file)
+        ftdock_file = pose_store.store_to_ftdock(self.store_file, os.path.join(self.test_path, 'test.ftdock'))
+
+        assert open(ftdock_file).read() == open(self.mock + '.ftdock').read()
+
+    def test_model_builder(self):
+        pose_store.rot_to_store(self.mock + '.rot', self.store_file)
+        args = (self.mock + '_rec.pdb.H', self.mock + '_lig.pdb.H', self.mock + '.rot')
+        from_rot = ModelBuilder(*args)
+        from_store = ModelBuilder(*args, store=pose_store.PoseStore(self.store_file))
+
+        # The same models as from the .rot file, byte for byte
+        assert list(from_rot.build([2, 3, 500])) == list(from_store.build([2, 3, 500]))
@@ -0,0 +1,72 @@
+"""
+Testing module for refinement
+"""
+import os
+import shutil
+import numpy as np
+from .test_docking_dna import RegressionTest
+from .. import refinement
+from ..energy_table import open_table
+from ..pose_store import PoseStore, rot_to_store
+from ..scoring_engine import write_ene, load_molecules, score_transforms
+
+
+test_scratch_folder = 'scratch'
+
+
+class TestRefinement(RegressionTest):
+
+    def setup(self):
+        self.path = os.path.dirname(os.path.realpath(__file__))
+        self.test_path = os.path.join(self.path, test_scratch_folder)
+        self.ini_test_path()
+        mock = os.path.join(self.path, '..', 'mock', '3mfk', '3mfk')
+        for suffix in ['_rec.pdb.H', '_lig.pdb.H', '_rec.pdb.amber', '_lig.pdb.amber']:
+            shutil.copyfile(mock + suffix, os.path.join(self.test_path, 'test' + suffix))
+        with open(mock + '.rot') as input_file:
+            lines = input_file.readlines()[:4]
+        with open(os.path.join(self.test_path, 'test.rot'), 'w') as output:
+            output.writelines(lines)
+        os.chdir(self.test_path)
+
+    def teardown(self):
+        self.clean_test_path()
+
+    def test_neighbourhood(self):
+        rotations, translations = refinement.neighbourhood(6.0, 0.5)
+
+        assert len(rotations) == len(translations) == 48
+        angles = np.degrees(np.arccos(np.clip((np.trace(rotations, axis1=1, axis2=2) - 1) / 2, -1, 1)))
+        assert np.allclose(angles[angles > 1e-3], 6.0)
+        assert np.allclose(np.sqrt((translations ** 2).sum(axis=1))[np.abs(translations).sum(axis=1) > 0], 0.5)
+        # Every move is a different one, and none is the identity
+        moves = set((tuple(np.round(rotation, 6).ravel()), tuple(translation))
+                    for rotation, translation in zip(rotations, translations))
+        assert len(moves) == 48
+        assert (tuple(np.eye(3).ravel()), (0.0, 0.0, 0.0)) not in moves
+
+    def test_refine(self):
+        rot_to_store('test.rot', 'test.poses')
+        store = PoseStore('test.poses')
+        write_ene('test.ene', store.records['id'], np.array([-10.0, -30.0, -20.0, -5.0]), np.zeros(4), np.zeros(4))
+        rounds = refinement.refine_rounds
+        refinement.refine_rounds = 1
+        try:
+            added = refinement.refine('test', 1, 1, store, 'test.ene', 'test.refined.ene', 'test.refined.poses')
+        finally:
+            refinement.refine_rounds = rounds
+
+        refined = PoseStore('test.refined.poses')
+        table = open_table('test.refined.ene')
+        assert added == 48 and len(refined) == len(table) == 52
+        # New Conf IDs after the last pose, the poses scored before keep their energies
+        assert sorted(table['Conf'])[4:] == range(5, 53)
+        assert -30.0 in table['Total'] and -5.0 in table['Total']
+        assert list(table['RANK']) == range(1, 53)
+        assert np.all(np.diff(table['Total']) >= 0)
+        # The energies are the ones of the stored poses
+        receptor, ligand = load_molecules('test')
+        rotations, translations, confs = refined.select([10, 30])
+        ele, desolv, vdw = score_transforms(receptor, ligand, rotations, translations, 1)
+        energies = dict((row['Conf'], row['Ele']) for row in table)
+        assert np.allclose([energies[conf] for conf in confs], ele, atol=0.001)
@@ -0,0 +1,64 @@
+"""
+Testing module for restraints
+"""
+import os
+import shutil
+import numpy as np
+from .test_docking_dna import RegressionTest
+from .. import restraints
+from ..molecule import load
+from ..model_builder import read_rot, transform
+from ..pose_store import PoseStore, rot_to_store
+
+
+test_scratch_folder = 'scratch'
+
+
+class TestRestraints(RegressionTest):
+
+    def setup(self):
+        self.path = os.path.dirname(os.path.realpath(__file__))
+        self.test_path = os.path.join(self.path, test_scratch_folder)
+        self.ini_test_path()
+        mock = os.path.join(self.path, '..', 'mock', '3mfk', '3mfk')
+        for suffix in ['_rec.pdb.H', '_lig.pdb.H', '.rot']:
+            shutil.copyfile(mock + suffix, os.path.join(self.test_path, 'test' + suffix))
+        os.chdir(self.test_path)
+        self.receptor = load('test_rec.pdb.H')
+        self.ligand = load('test_lig.pdb.H')
+        self.rotations, self.translations, _ = read_rot('test.rot')
+
+    def teardown(self):
+        self.clean_test_path()
+
+    def test_satisfied(self):
+        receptor_residues, ligand_residues = ['A.LEU.342', 'A.ILE.402'], ['C.DG.1', 'C.DC.14']
+        restraint_filter = restraints.RestraintFilter(self.receptor, self.ligand, receptor_residues, ligand_residues)
+
+        satisfied = restraint_filter.satisfied(self.rotations[:100], self.translations[:100])
+
+        moved = transform(self.ligand.coordinates, self.ligand.coordinates.mean(axis=0), self.rotations[:100],
+                          self.translations[:100])
+        receptor_residue = np.array([restraints.residue_key(key) for key in self.receptor.keys()])
+        ligand_residue = np.array([restraints.residue_key(key) for key in self.ligand.keys()])
+        for pose in range(100):
+            close = ((self.receptor.coordinates[:, np.newaxis] - moved[pose][np.newaxis]) ** 2).sum(axis=2) < 36.0
+            expected = sum(close[receptor_residue == residue].any() for residue in receptor_residues)
+            expected += sum(close[:, ligand_residue == residue].any() for residue in ligand_residues)
+            assert satisfied[pose] == expected
+        assert satisfied.max() > 0
+
+    def test_filter_poses(self):
+        rot_to_store('test.rot', 'test.poses')
+        store = PoseStore('test.poses')
+
+        kept = restraints.filter_poses('test', ['A.LEU.342', 'A.ILE.402'], ['C.DG.1'], 2, store, 'test.filtered.poses')
+
+        filtered = PoseStore('test.filtered.poses')
+        assert 0 < kept == len(filtered) < len(store)
+        assert np.all(np.in1d(filtered.records['id'], store.records['id']))
+        try:
+            restraints.filter_poses('test', ['A.XXX.1'], [], 1, store, 'test.filtered.poses')
+            assert False
+        except ValueError:
+            pass
@@ -0,0 +1,87 @@
+"""
+Testing module for result_cache
+"""
+import os
+import time
+import shutil
+from .test_docking_dna import RegressionTest
+from ..result_cache import ResultCache, normalized_structure, chain_selection
+from .. import result_cache
+
+
+test_scratch_folder = 'scratch'
+
+
+class TestResultCache(RegressionTest):
+
+    def setup(self):
+        self.path = os.path.dirname(os.path.realpath(__file__))
+        self.test_path = os.path.join(self.path, test_scratch_folder)
+        self.ini_test_path()
+        self.mock_path = os.path.normpath(os.path.join(self.path, '..', 'mock', '3mfk'))
+        self.cache_path = os.path.join(self.test_path, 'cache')
+
+    def teardown(self):
+        self.clean_test_path()
+
+    def write(self, file_name, content):
+        file_name = os.path.join(self.test_path, file_name)
+        with open(file_name, 'w') as output:
+            output.write(content)
+        return file_name
+
+    def test_normalized_structure(self):
+        first = self.write('first.pdb', 'REMARK first upload\n'
+                           'ATOM      1  N   GLY A 302      97.037  77.521  79.330  1.00102.62\n')
+        second = self.write('second.pdb', 'ATOM     27  N   GLY A 302      97.037  77.521  79.330  0.50 10.00\n')
+
+        assert normalized_structure(first) == normalized_structure(second)
+        assert chain_selection(os.path.join(self.mock_path, '3mfk.ini')) == \
+            '[receptor]\nmol=A,B\nnewmol=A,B\n[ligand]\nmol=C,D\nnewmol=C,D'
+
+    def test_store_and_fetch(self):
+        cache = ResultCache(self.cache_path, 1024)
+        key = cache.key('scoring', 'dockser', 'abc')
+        source = self.write('source.ene', 'energies')
+        destination = os.path.join(self.test_path, 'destination.ene')
+
+        assert not cache.fetch(key, {'.ene': destination})
+        cache.store(key, {'.ene': source})
+        assert cache.fetch(key, {'.ene': destination})
+        assert open(destination).read() == 'energies'
+        assert not cache.fetch(key, {'.ene': destination, '.rot': destination})
+        assert key != cache.key('scoring', 'dockser', 'abd')
+
+    def test_fetch_evicted(self):
+        cache = ResultCache(self.cache_path, 1024)
+        source = self.write('source.rot', 'poses')
+        cache.store(cache.key('sampling'), {'.ftdock': source, '.rot': source})
+        destinations = {'.ftdock': os.path.join(self.test_path, 'copy.ftdock'),
+                        '.rot': os.path.join(self.test_path, 'copy.rot')}
+        copyfile = shutil.copyfile
+
+        def evicted(source, destination):
+            # Another job evicts the entry after the first artifact is copied
+            copyfile(source, destination)
+            shutil.rmtree(cache.entry_path(cache.key('sampling')))
+        result_cache.shutil.copyfile = evicted
+        try:
+            fetched = cache.fetch(cache.key('sampling'), destinations)
+        finally:
+            result_cache.shutil.copyfile = copyfile
+
+        assert not fetched
+        assert sorted(os.listdir(self.test_path)) == ['cache', 'source.rot']
+
+    def test_evict(self):
+        cache = ResultCache(self.cache_path, 25)
+        source = self.write('source.rot', 'x' * 10)
+        for age, name in [(300, 'first'), (200, 'second')]:
+            cache.store(cache.key(name), {'.rot': source})
+            os.utime(cache.entry_path(cache.key(name)), (time.time() - age, time.time() - age))
+        # Using the first entry makes the second one the least recently used
+        assert cache.fetch(cache.key('first'), {'.rot': os.path.join(self.test_path, 'copy.rot')})
+        cache.store(cache.key('third'), {'.rot': source})
+
+        stored = [name for name in ['first', 'second', 'third'] if os.path.exists(cache.entry_path(cache.key(name)))]
+        assert stored == ['first', 'third']
@@ -0,0 +1,90 @@
+"""
+Testing module for scoring_engine
+"""
+import os
+import numpy as np
+from .test_docking_dna import RegressionTest
+from ..model_builder import read_rot
+from ..scoring_engine import NeighbourGrid, ScoringMolecule, ScoringEngine, read_amber, write_ene
+
+
+test_scratch_folder = 'scratch'
+
+
+class TestScoringEngine(RegressionTest):
+
+    def setup(self):
+        self.path = os.path.dirname(os.path.realpath(__file__))
+        self.test_path = os.path.join(self.path, test_scratch_folder)
+        self.ini_test_path()
+        self.mock_path = os.path.normpath(os.path.join(self.path, '..', 'mock', '3mfk'))
+
+    def teardown(self):
+        self.clean_test_path()
+
+    def test_read_amber(self):
+        names, types, charges, radii = read_amber(os.path.join(self.mock_path, '3mfk_rec.pdb.amber'))
+
+        assert len(names) == 4484
+        assert names[0] == 'A.GLY.302.N' and types[0] == 'N'
+        assert np.isclose(charges[0], 0.2943) and np.isclose(radii[0], 1.824)
+
+    def test_neighbour_grid(self):
+        generator = np.random.RandomState(1)
+        atoms = generator.uniform(0, 30, (500, 3))
+        points = generator.uniform(-5, 35, (200, 3))
+        grid = NeighbourGrid(atoms, 2.5)
+
+        point_ids, atom_ids, distances = grid.pairs(points, 5.0)
+
+        all_distances = ((points[:, np.newaxis, :] - atoms[np.newaxis, :, :]) ** 2).sum(axis=2)
+        expected = set(zip(*np.nonzero(all_distances < 25.0)))
+        assert set(zip(point_ids, atom_ids)) == expected
+        assert np.allclose(distances, all_distances[point_ids, atom_ids])
+
+    def test_score_poses(self):
+        os.chdir(self.mock_path)
+        receptor = ScoringMolecule('3mfk_rec.pdb.H', '3mfk_rec.pdb.amber')
+        ligand = ScoringMolecule('3mfk_lig.pdb.H', '3mfk_lig.pdb.amber')
+        rotations, translations, confs = read_rot('3mfk.rot')
+        engine = ScoringEngine(receptor, ligand, rotations[:3], translations[:3])
+
+        ele, desolv, vdw = engine.score_poses([0, 1, 2])
+
+        # Conformations 1, 2 and 3 as scored by pyDock in 3mfk.ene
+        assert np.allclose(ele, [-366.937, -605.588, -598.788], atol=1.0)
+        assert np.allclose(vdw, [-38.053, -35.664, -74.765], atol=1.0)
+        assert np.all(desolv > 0)
+
+    def test_agreement(self):
+        os.chdir(self.mock_path)
+        receptor = ScoringMolecule('3mfk_rec.pdb.H', '3mfk_rec.pdb.amber')
+        ligand = ScoringMolecule('3mfk_lig.pdb.H', '3mfk_lig.pdb.amber')
+        rotations, translations, confs = read_rot('3mfk.rot')
+        engine = ScoringEngine(receptor, ligand, rotations[:100], translations[:100])
+        with open('3mfk.ene') as input_file:
+            expected = dict((int(fields[0]), [float(value) for value in fields[1:4]])
+                            for fields in [line.split() for line in input_file.readlines()[2:]])
+        expected = np.array([expected[conf] for conf in confs[:100]])
+
+        ele, desolv, vdw = engine.score_poses(np.arange(100))
+
+        # Electrostatics and van der Waals within 1 kcal/mol of pyDock. The published solvation
+        # parameters follow its desolvation but stay tens of kcal/mol away, so the engine is opt-in
+        assert np.abs(ele - expected[:, 0]).max() < 1.0
+        assert np.abs(vdw - expected[:, 2]).max() < 1.0
+        assert np.abs(desolv - expected[:, 1]).max() < 50.0
+        assert np.corrcoef(desolv, expected[:, 1])[0, 1] > 0.95
+
+    def test_write_ene(self):
+        ene_file = os.path.join(self.test_path, 'test.ene')
+        write_ene(ene_file, [1, 2, 3], np.array([-366.937, -605.588, -598.788]),
+                  np.array([46.913, 62.464, 61.214]), np.array([-38.053, -35.664, -74.765]))
+
+        with open(os.path.join(self.mock_path, '3mfk.ene')) as expected_file:
+            expected = expected_file.readlines()[:3]
+        with open(ene_file) as output_file:
+            output = output_file.readlines()
+        assert output[:3] == expected
+        assert output[3].split()[0] == '3'
+        assert output[4].split()[0] == '1' and output[4].split()[-1] == '3'
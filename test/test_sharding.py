@@ -0,0 +1,98 @@
+"""
+Testing module for sharding
+"""
+import os
+import time
+import shutil
+import filecmp
+import multiprocessing
+from .test_docking_dna import RegressionTest
+from .. import sharding
+from .. import fft_sampling
+from .. import scoring_engine
+
+
+test_scratch_folder = 'scratch'
+
+
+class TestSharding(RegressionTest):
+
+    def setup(self):
+        self.path = os.path.dirname(os.path.realpath(__file__))
+        self.test_path = os.path.join(self.path, test_scratch_folder)
+        self.ini_test_path()
+        mock = os.path.join(self.path, '..', 'mock', '3mfk', '3mfk')
+        for folder in ['single', 'sharded']:
+            os.makedirs(os.path.join(self.test_path, folder))
+            for suffix in ['_rec.pdb', '_lig.pdb', '_rec.pdb.H', '_lig.pdb.H', '_rec.pdb.amber', '_lig.pdb.amber']:
+                shutil.copyfile(mock + suffix, os.path.join(self.test_path, folder, 'test' + suffix))
+            with open(mock + '.rot') as input_file:
+                lines = input_file.readlines()[:100]
+            with open(os.path.join(self.test_path, folder, 'test.rot'), 'w') as output:
+                output.writelines(lines)
+        self.root = os.path.join(self.test_path, 'shards')
+        self.configuration = (fft_sampling.grid_size, fft_sampling.angle_step, fft_sampling.keep_total,
+                              scoring_engine.far_grid_spacing, sharding.rotations_per_shard, sharding.poses_per_shard,
+                              sharding.poll_interval)
+        fft_sampling.grid_size, fft_sampling.angle_step, fft_sampling.keep_total = 48, 30, 60
+        scoring_engine.far_grid_spacing = 2.0
+        sharding.rotations_per_shard, sharding.poses_per_shard, sharding.poll_interval = 20, 30, 0.1
+
+    def teardown(self):
+        (fft_sampling.grid_size, fft_sampling.angle_step, fft_sampling.keep_total, scoring_engine.far_grid_spacing,
+         sharding.rotations_per_shard, sharding.poses_per_shard, sharding.poll_interval) = self.configuration
+        self.clean_test_path()
+
+    def test_sharded(self):
+        os.chdir(os.path.join(self.test_path, 'single'))
+        scoring_engine.score('test', 1)
+        fft_sampling.sample('test', 'test_rec.pdb', 'test_lig.pdb', 1)
+        os.chdir(os.path.join(self.test_path, 'sharded'))
+        workers = [multiprocessing.Process(target=sharding.serve, args=(self.root, 1)) for _ in range(2)]
+        for worker in workers:
+            worker.start()
+        try:
+            sharding.score('test', 1, self.root)
+            sharding.sample('test', 'test_rec.pdb', 'test_lig.pdb', 1, self.root)
+        finally:
+            for worker in workers:
+                worker.terminate()
+                worker.join()
+
+        # Same files as a single host, and no task left behind
+        for file_name in ['test.ene', 'test.ftdock', 'test.rot']:
+            assert filecmp.cmp(os.path.join(self.test_path, 'single', file_name), file_name, shallow=False)
+        assert os.listdir(self.root) == []
+
+    def test_claims(self):
+        task = sharding.ShardTask.create(self.root, 'scoring', {}, sharding.ranges(5, 2), {})
+
+        assert task.shards == [[0, 2], [2, 4], [4, 5]]
+        assert task.claim(0) and not task.claim(0)
+        assert [task.state(shard) for shard in range(3)] == ['running', 'pending', 'pending']
+        # A claim not touched for the lease time is given back
+        old = time.time() - 2 * sharding.lease_time
+        os.utime(task.shard_file(0, '.claim'), (old, old))
+        assert task.state(0) == 'stale'
+        task.release(0)
+        assert task.state(0) == 'pending' and task.claim(0)
+        # The claims are aged by the clock of the shared folder, a host clock ahead does not matter
+        local_time = time.time
+        sharding.time.time = lambda: local_time() + 10 * sharding.lease_time
+        try:
+            assert task.state(0) == 'running'
+        finally:
+            sharding.time.time = local_time
+        # The scoring inputs are missing, so the shard fails
+        assert not task.run(0, 1)
+        assert task.state(0) == 'failed' and not task.claim(0)
+
+    def test_retries(self):
+        task = sharding.ShardTask.create(self.root, 'scoring', {}, sharding.ranges(2, 2), {})
+
+        try:
+            sharding.coordinate(task, 1)
+            assert False
+        except sharding.ShardFailed, e:
+            assert 'failed %d times' % sharding.max_attempts in str(e)
+        assert not os.path.exists(task.path)
@@ -0,0 +1,123 @@
+"""
+Testing module for stages
+"""
+import os
+import threading
+from nose.tools import raises
+from .test_docking_dna import RegressionTest
+from ..docking_dna import check_output
+from ..stages import Scheduler, StageFailed, CoreBudget
+
+
+test_scratch_folder = 'scratch'
+
+
+class TestStages(RegressionTest):
+
+    def setup(self):
+        self.path = os.path.dirname(os.path.realpath(__file__))
+        self.test_path = os.path.join(self.path, test_scratch_folder)
+        self.ini_test_path()
+        self.calls = []
+
+    def teardown(self):
+        self.clean_test_path()
+
+    def file(self, name):
+        return os.path.join(self.test_path, name)
+
+    def writer(self, name, content):
+        def write():
+            self.calls.append(name)
+            with open(self.file(name), 'w') as output:
+                output.write(content)
+        return write
+
+    def pipeline(self, resume=False, ene='energies'):
+        scheduler = Scheduler(self.test_path, check_output, resume=resume)
+        scheduler.add('sampling', self.writer('test.rot', 'poses'), outputs=[self.file('test.rot')])
+        scheduler.add('scoring', self.writer('test.ene', ene), inputs=[self.file('test.rot')],
+                      outputs=[self.file('test.ene')], requires=['sampling'])
+        scheduler.add('csv', self.writer('result.csv', 'csv'), inputs=[self.file('test.ene')],
+                      outputs=[self.file('result.csv')], requires=['scoring'])
+        scheduler.add('models', self.writer('top_1.pdb', 'model'), inputs=[self.file('test.ene')],
+                      outputs=[self.file('top_1.pdb')], requires=['scoring'])
+        return scheduler
+
+    def test_check_output(self):
+        self.writer('test.ene', 'energies')()
+
+        assert check_output(self.file('test.ene'), 8)
+        assert not check_output(self.file('test.ene'), 9)
+        assert check_output(self.file('test.ene'), digest='4a5e4bf1ed7e49a84b5d514257c46703a6bc014e')
+        assert not check_output(self.file('test.ene'), digest='0' * 40)
+
+    def test_run(self):
+        assert self.pipeline().run() == []
+        assert self.calls[:2] == ['test.rot', 'test.ene']
+        assert sorted(self.calls[2:]) == ['result.csv', 'top_1.pdb']
+
+    def test_concurrent(self):
+        # Both stages wait for each other, which only finishes if they run at the same time
+        barrier = [threading.Event(), threading.Event()]
+
+        def stage(index):
+            def run():
+                barrier[index].set()
+                assert barrier[1 - index].wait(10)
+                self.writer('out_%d' % index, 'done')()
+            return run
+        scheduler = Scheduler(self.test_path, check_output)
+        scheduler.add('first', stage(0), outputs=[self.file('out_0')])
+        scheduler.add('second', stage(1), outputs=[self.file('out_1')])
+        scheduler.run()
+
+        assert sorted(self.calls) == ['out_0', 'out_1']
+
+    def test_core_budget(self):
+        # Two compute stages of 2 cores each cannot share a budget of 3 cores
+        active = []
+        overlaps = []
+
+        def stage(name):
+            def run():
+                active.append(name)
+                overlaps.append(len(active))
+                threading.Event().wait(0.2)
+                active.remove(name)
+                self.writer(name, 'done')()
+            return run
+        scheduler = Scheduler(self.test_path, check_output, budget=CoreBudget(3))
+        scheduler.add('sampling', stage('test.ftdock'), outputs=[self.file('test.ftdock')], cores=2)
+        scheduler.add('scoring', stage('test.ene'), outputs=[self.file('test.ene')], cores=2)
+        scheduler.run()
+
+        assert overlaps == [1, 1]
+
+    def test_resume(self):
+        self.pipeline().run()
+        self.calls = []
+
+        assert self.pipeline(resume=True).run() == ['sampling', 'scoring', 'csv', 'models']
+        assert self.calls == []
+
+        # A damaged output reruns its stage and the stages that depend on it
+        self.writer('result.csv', 'damaged')()
+        self.calls = []
+        assert self.pipeline(resume=True).run() == ['sampling', 'scoring', 'models']
+        assert self.calls == ['result.csv']
+
+        os.remove(self.file('test.ene'))
+        self.calls = []
+        assert self.pipeline(resume=True).run() == ['sampling', 'scoring', 'csv', 'models']
+
+        self.writer('result.csv', 'damaged')()
+        self.calls = []
+        assert self.pipeline(resume=True, ene='new energies').run() == ['sampling']
+        assert sorted(self.calls) == ['result.csv', 'test.ene', 'top_1.pdb']
+
+    @raises(StageFailed)
+    def test_missing_output(self):
+        scheduler = Scheduler(self.test_path, check_output)
+        scheduler.add('sampling', lambda: None, outputs=[self.file('test.rot')])
+        scheduler.run()
@@ -0,0 +1,89 @@
+"""
+Testing module for staging
+"""
+import os
+from .test_docking_dna import RegressionTest
+from .. import staging
+
+
+test_scratch_folder = 'scratch'
+
+
+class TestStaging(RegressionTest):
+
+    def setup(self):
+        self.path = os.path.dirname(os.path.realpath(__file__))
+        self.test_path = os.path.join(self.path, test_scratch_folder)
+        self.ini_test_path()
+        self.spill_path = os.path.join(self.test_path, 'project', '.tmp')
+        self.area = staging.StagingArea(os.path.join(self.test_path, 'local'), os.path.join(self.test_path, 'project'),
+                                        3000, self.spill_path)
+
+    def teardown(self):
+        self.clean_test_path()
+
+    def write(self, name, size):
+        with open(os.path.join(self.area.working_path, name), 'w') as output:
+            output.write('x' * size)
+
+    def test_spill(self):
+        self.write('small', 500)
+        self.write('large', 2000)
+        os.makedirs(os.path.join(self.area.working_path, 'models'))
+        with open(os.path.join(self.area.working_path, 'models', 'model.pdb'), 'w') as output:
+            output.write('x' * 1500)
+
+        spilled = self.area.staged(lambda: 'done')
+
+        assert spilled() == 'done'
+        assert os.path.islink(os.path.join(self.area.working_path, 'large'))
+        assert not os.path.islink(os.path.join(self.area.working_path, 'small'))
+        assert open(os.path.join(self.area.working_path, 'large')).read() == 'x' * 2000
+        assert os.path.getsize(os.path.join(self.spill_path, 'large')) == 2000
+        assert self.area.usage() <= 3000
+        # Staged again on a resumed run, the links are kept
+        assert staging.StagingArea(os.path.join(self.test_path, 'local'), os.path.join(self.test_path, 'project'),
+                                   3000, self.spill_path).enforce() == []
+
+    def test_busy(self):
+        self.write('large', 2000)
+        self.write('ranking', 1500)
+        running = self.area.staged(lambda: self.area.enforce(), [os.path.join(self.area.working_path, 'large')])
+
+        # Spilling while a stage writes the large file moves the next largest one instead
+        assert running() == ['ranking']
+        assert not os.path.islink(os.path.join(self.area.working_path, 'large'))
+        assert self.area.busy == []
+
+    def test_large_stage(self):
+        self.write('ranking', 1500)
+        models = os.path.join(self.area.working_path, 'models')
+
+        def write_models():
+            if not os.path.exists(models):
+                os.makedirs(models)
+            for i in range(5):
+                self.write(os.path.join('models', 'model_%d.pdb' % i), 1000)
+        writing = self.area.staged(write_models, [models], lambda: 5000, [models])
+
+        # More than the budget, room is made and the models are written to the project storage
+        writing()
+        assert os.path.islink(os.path.join(self.area.working_path, 'ranking'))
+        assert os.path.islink(models) and len(os.listdir(os.path.join(self.spill_path, 'models'))) == 5
+        assert self.area.usage() <= 3000
+
+    def test_flush(self):
+        with open(os.path.join(self.area.results_path, 'result.csv'), 'w') as output:
+            output.write('Conf\n')
+        with open(os.path.join(self.area.results_path, 'scratch.log'), 'w') as output:
+            output.write('log\n')
+        results_path = os.path.join(self.test_path, 'project')
+
+        written = self.area.flush(['result.csv', 'top_1.pdb'], results_path)
+
+        assert written == [os.path.join(results_path, 'result.csv')]
+        assert sorted(os.listdir(results_path)) == ['.tmp', 'result.csv']
+        self.write('large', 4000)
+        self.area.enforce()
+        self.area.remove()
+        assert not os.path.exists(self.area.path) and os.listdir(self.spill_path) == []
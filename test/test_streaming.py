@@ -0,0 +1,76 @@
+"""
+Testing module for streaming
+"""
+import os
+import shutil
+import filecmp
+from .test_docking_dna import RegressionTest
+from .. import streaming
+from .. import docking_dna
+from .. import fft_sampling
+from .. import scoring_engine
+from ..energy_table import open_table, top
+from ..pose_store import PoseStore, rot_to_store
+from ..result_cache import ResultCache
+
+
+test_scratch_folder = 'scratch'
+
+
+class TestStreaming(RegressionTest):
+
+    def setup(self):
+        self.path = os.path.dirname(os.path.realpath(__file__))
+        self.test_path = os.path.join(self.path, test_scratch_folder)
+        self.ini_test_path()
+        mock = os.path.join(self.path, '..', 'mock', '3mfk', '3mfk')
+        for folder in ['batch', 'stream']:
+            os.makedirs(os.path.join(self.test_path, folder))
+            for suffix in ['_rec.pdb', '_lig.pdb', '_rec.pdb.H', '_lig.pdb.H', '_rec.pdb.amber', '_lig.pdb.amber',
+                           '.ini']:
+                shutil.copyfile(mock + suffix, os.path.join(self.test_path, folder, 'test' + suffix))
+        self.configuration = (fft_sampling.grid_size, fft_sampling.angle_step, fft_sampling.keep_total,
+                              scoring_engine.far_grid_spacing)
+        fft_sampling.grid_size, fft_sampling.angle_step, fft_sampling.keep_total = 48, 30, 60
+        scoring_engine.far_grid_spacing = 2.0
+
+    def teardown(self):
+        (fft_sampling.grid_size, fft_sampling.angle_step, fft_sampling.keep_total,
+         scoring_engine.far_grid_spacing) = self.configuration
+        self.clean_test_path()
+
+    def test_stream(self):
+        os.chdir(os.path.join(self.test_path, 'batch'))
+        fft_sampling.sample('test', 'test_rec.pdb', 'test_lig.pdb', 2)
+        rot_to_store('test.rot', 'test.poses')
+        scoring_engine.score('test', 2, store=PoseStore('test.poses'))
+        os.chdir(os.path.join(self.test_path, 'stream'))
+        sampled = []
+        confirmed = []
+
+        scored = streaming.stream('test', 'test_rec.pdb', 'test_lig.pdb', 2, 5,
+                                  sampled=lambda: sampled.append(os.path.exists('test.rot')),
+                                  confirmed=confirmed.extend)
+
+        # Same poses and energies as sampling then scoring
+        for file_name in ['test.ftdock', 'test.rot', 'test.ene']:
+            assert filecmp.cmp(os.path.join(self.test_path, 'batch', file_name), file_name, shallow=False)
+        assert scored >= 60 and sampled == [True]
+        assert sorted(confirmed) == sorted(top(open_table('test.ene'), 5)['Conf'])
+
+    def test_cached(self):
+        cache = ResultCache(os.path.join(self.test_path, 'cache'), 10 ** 9)
+        stream_path, batch_path = os.path.join(self.test_path, 'stream'), os.path.join(self.test_path, 'batch')
+        os.chdir(self.test_path)
+
+        done = docking_dna.streamed_docking(stream_path, 'test_rec.pdb', 'test_lig.pdb', 'test', 2, 5, False,
+                                            cache=cache)
+        cached = docking_dna.streamed_docking(batch_path, 'test_rec.pdb', 'test_lig.pdb', 'test', 2, 5, False,
+                                              cache=cache)
+
+        # The streamed results are cached as the sampling and scoring results, found again without streaming
+        assert done == set(['scoring']) and cached == set()
+        assert filecmp.cmp(os.path.join(stream_path, 'test.rot'), os.path.join(batch_path, 'test.rot'), shallow=False)
+        os.chdir(batch_path)
+        assert cache.fetch(docking_dna.scoring_key(cache, 'test', 'dockser'), {'.ene': 'test.ene'})
+        assert filecmp.cmp(os.path.join(stream_path, 'test.ene'), 'test.ene', shallow=False)
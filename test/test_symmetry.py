@@ -0,0 +1,90 @@
+"""
+Testing module for symmetry
+"""
+import os
+import numpy as np
+from .test_docking_dna import RegressionTest
+from .. import symmetry
+from ..fft_sampling import rotation_angles, rotation_matrix
+from ..model_builder import read_rot, transform
+from ..molecule import load
+from ..pose_store import PoseStore, rot_to_store
+
+
+test_scratch_folder = 'scratch'
+
+
+class TestSymmetry(RegressionTest):
+
+    def setup(self):
+        self.path = os.path.dirname(os.path.realpath(__file__))
+        self.test_path = os.path.join(self.path, test_scratch_folder)
+        self.ini_test_path()
+        self.mock = os.path.normpath(os.path.join(self.path, '..', 'mock', '3mfk', '3mfk'))
+        self.receptor = load(self.mock + '_rec.pdb.H')
+
+    def teardown(self):
+        self.clean_test_path()
+
+    def test_detect(self):
+        c2 = symmetry.detect(self.receptor)
+
+        assert c2 is not None
+        alpha = self.receptor.atoms[self.receptor.atoms['name'] == 'CA']
+        first, second = alpha[alpha['chain'] == 'A'], alpha[alpha['chain'] == 'B']
+        common = np.intersect1d(first['res_seq'], second['res_seq'])
+        a = first['coordinates'][np.in1d(first['res_seq'], common)]
+        b = second['coordinates'][np.in1d(second['res_seq'], common)]
+        moved = np.dot(a - c2.point, c2.matrix.T) + c2.point
+        assert np.sqrt(((moved - b) ** 2).sum(axis=1).mean()) < symmetry.rmsd_cutoff
+        # A single chain has no symmetry
+        single = load(self.mock + '_lig.pdb.H')
+        single.atoms = self.receptor.atoms[self.receptor.atoms['chain'] == 'A']
+        assert symmetry.detect(single) is None
+
+    def test_mates(self):
+        c2 = symmetry.C2Symmetry([0.0, 0.0, 2.0], [1.0, 2.0, 3.0])
+        rotations, translations, _ = read_rot(self.mock + '.rot')
+        rotations, translations = rotations[:10], translations[:10]
+        ligand = load(self.mock + '_lig.pdb.H').coordinates
+        center = ligand.mean(axis=0)
+
+        mate_rotations, mate_translations = c2.mates(rotations, translations)
+
+        # The mate complex is the pose seen from the symmetric receptor
+        moved = transform(ligand, center, mate_rotations, mate_translations)
+        expected = np.dot(transform(ligand, center, rotations, translations) - c2.point, c2.matrix.T) + c2.point
+        assert np.allclose(moved, expected)
+        again = c2.mates(mate_rotations, mate_translations)
+        assert np.allclose(again[0], rotations) and np.allclose(again[1], translations)
+
+    def test_asymmetric_angles(self):
+        c2 = symmetry.detect(self.receptor)
+        angles = rotation_angles(12)
+
+        kept = symmetry.asymmetric_angles(angles, c2)
+
+        assert 0 < len(kept) < 0.6 * len(angles)
+        rotations = np.array([rotation_matrix(*angle) for angle in angles])
+        mates, _ = c2.mates(rotations, np.zeros((len(rotations), 3)))
+        inside, mates_inside = c2.asymmetric_unit(rotations), c2.asymmetric_unit(mates)
+        # Out of the border, a rotation or its mate is sampled, never both
+        border = np.abs(np.dot(rotations[:, :, 0], c2.normal)) < 1e-6
+        assert np.all((inside != mates_inside)[~border])
+
+    def test_with_mates(self):
+        c2 = symmetry.detect(self.receptor)
+        store_file = os.path.join(self.test_path, 'test.poses')
+        rot_to_store(self.mock + '.rot', store_file, extra_header={'symmetry': c2.header()})
+        store = PoseStore(store_file)
+        mates_file = os.path.join(self.test_path, 'test.mates.poses')
+
+        count = symmetry.with_mates(store, mates_file)
+
+        mates = PoseStore(mates_file)
+        assert count == len(mates) == 2 * len(store)
+        assert list(mates.records['id'][len(store):]) == list(store.records['id'] + store.records['id'].max())
+        rotations, translations, _ = mates.poses(len(store), len(store) + 5)
+        expected = c2.mates(*store.poses(0, 5)[:2])
+        # Stored with the 3 decimals of the .rot file
+        assert np.allclose(rotations, expected[0], atol=1e-3) and np.allclose(translations, expected[1], atol=1e-3)
@@ -0,0 +1,51 @@
+"""
+Testing module for trajectory
+"""
+import os
+import json
+import shutil
+from .test_docking_dna import RegressionTest
+from .. import trajectory
+from ..model_builder import make_pdb
+from ..docking_dna import mark_as_complete
+
+
+test_scratch_folder = 'scratch'
+
+
+class TestTrajectory(RegressionTest):
+
+    def setup(self):
+        self.path = os.path.dirname(os.path.realpath(__file__))
+        self.test_path = os.path.join(self.path, test_scratch_folder)
+        self.ini_test_path()
+        mock = os.path.join(self.path, '..', 'mock', '3mfk', '3mfk')
+        for suffix in ['_rec.pdb.H', '_lig.pdb.H', '.rot']:
+            shutil.copyfile(mock + suffix, os.path.join(self.test_path, '3mfk' + suffix))
+        os.chdir(self.test_path)
+
+    def teardown(self):
+        self.clean_test_path()
+
+    def test_round_trip(self):
+        confs = range(300, 0, -3)
+        os.makedirs('models')
+        file_names = make_pdb('3mfk', confs, 'mug_', 'models')
+
+        trajectory_file = trajectory.make_trajectory('3mfk', confs, '3mfk.traj')
+
+        models = trajectory.Trajectory(trajectory_file)
+        assert models.ids == confs and len(models) == 100
+        for conf, file_name in zip(confs, file_names)[::7]:
+            assert models.model(conf) == open(file_name).read()
+        assert os.path.getsize(trajectory_file) * 20 < sum(os.path.getsize(name) for name in file_names)
+        models.extract(150, 'extracted.pdb')
+        assert open('extracted.pdb').read() == open(os.path.join('models', 'mug_3mfk_150.pdb')).read()
+
+    def test_results_entry(self):
+        json_file = mark_as_complete(self.test_path, '3mfk', '3mfk.tgz', '3mfk.traj')
+
+        output_files = json.load(open(json_file))['output_files']
+        assert [entry['name'] for entry in output_files][:4] == ['top_structures', 'results', 'energy_table', 'models']
+        assert output_files[3]['file_path'] == os.path.join(self.test_path, '3mfk.traj')
+        assert len(output_files) == 14
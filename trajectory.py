@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+"""Single-file compressed multi-model trajectory of docking models, with an extractor to PDB"""
+
+import os
+import io
+import json
+import zlib
+import struct
+import argparse
+import numpy as np
+import molecule
+import model_builder
+
+
+""" Trajectory configuration """
+trajectory_suffix = '.traj'
+magic = 'PYDKTRAJ'
+version = 1
+models_per_chunk = 64
+compression_level = 6
+""" End of configuration """
+
+preamble = struct.Struct('<8sIQQ')
+
+
+def pack_topology(receptor, ligand):
+    """Compressed arrays of the receptor and ligand records, the text shared by every model"""
+    buffer = io.BytesIO()
+    np.savez(buffer, receptor_atoms=receptor.atoms, receptor_others=receptor.others,
+             ligand_atoms=ligand.atoms, ligand_others=ligand.others)
+    return zlib.compress(buffer.getvalue(), compression_level)
+
+
+def unpack_topology(data):
+    with np.load(io.BytesIO(zlib.decompress(data))) as arrays:
+        return (molecule.Molecule(arrays['receptor_atoms'], arrays['receptor_others']),
+                molecule.Molecule(arrays['ligand_atoms'], arrays['ligand_others']))
+
+
+class TrajectoryWriter(object):
+    """Writes models as the shared topology once and the ligand coordinates of every model.
+
+    Coordinates are rounded as in PDB files and kept as float32, compressed in
+    chunks of models_per_chunk models. The index at the end of the file maps
+    every pose ID to its chunk.
+    """
+    def __init__(self, trajectory_file, receptor, ligand):
+        self.trajectory_file = trajectory_file
+        self.num_atoms = len(ligand)
+        self.output = open(trajectory_file + '.partial', 'wb')
+        self.output.write(preamble.pack(magic, version, 0, 0))
+        topology = pack_topology(receptor, ligand)
+        self.topology = [self.output.tell(), len(topology)]
+        self.output.write(topology)
+        self.ids = []
+        self.chunks = []
+        self.pending = []
+
+    def add(self, pose_id, coordinates):
+        self.ids.append(int(pose_id))
+        self.pending.append(np.round(coordinates, 3).astype('<f4'))
+        if len(self.pending) == models_per_chunk:
+            self.flush_chunk()
+
+    def flush_chunk(self):
+        if not self.pending:
+            return
+        data = zlib.compress(np.array(self.pending).tostring(), compression_level)
+        self.chunks.append([self.output.tell(), len(data), len(self.pending)])
+        self.output.write(data)
+        self.pending = []
+
+    def close(self):
+        self.flush_chunk()
+        index = json.dumps({'atoms': self.num_atoms, 'topology': self.topology, 'ids': self.ids,
+                            'chunks': self.chunks})
+        index_offset = self.output.tell()
+        self.output.write(index)
+        self.output.seek(0)
+        self.output.write(preamble.pack(magic, version, index_offset, len(index)))
+        self.output.close()
+        os.rename(self.trajectory_file + '.partial', self.trajectory_file)
+        return self.trajectory_file
+
+
+class Trajectory(object):
+    """Random access to the models of a trajectory file by pose ID, one chunk decompressed per model"""
+    def __init__(self, trajectory_file):
+        self.trajectory_file = trajectory_file
+        with open(trajectory_file, 'rb') as input_file:
+            file_magic, file_version, index_offset, index_length = preamble.unpack(input_file.read(preamble.size))
+            if file_magic != magic or file_version != version:
+                raise ValueError("%s is not a version %d trajectory" % (trajectory_file, version))
+            input_file.seek(index_offset)
+            index = json.loads(input_file.read(index_length))
+            offset, length = index['topology']
+            input_file.seek(offset)
+            self.receptor, self.ligand = unpack_topology(input_file.read(length))
+        self.num_atoms = index['atoms']
+        self.ids = index['ids']
+        self.chunks = index['chunks']
+        self.position = dict((pose_id, position) for position, pose_id in enumerate(self.ids))
+        self.receptor_block = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def coordinates(self, pose_id):
+        """Ligand coordinates of the model of pose_id"""
+        chunk, row = divmod(self.position[int(pose_id)], models_per_chunk)
+        offset, length, count = self.chunks[chunk]
+        with open(self.trajectory_file, 'rb') as input_file:
+            input_file.seek(offset)
+            data = zlib.decompress(input_file.read(length))
+        return np.fromstring(data, dtype='<f4').reshape(count, self.num_atoms, 3)[row].astype(np.float64)
+
+    def model(self, pose_id):
+        """PDB text of the model of pose_id, as model_builder builds it"""
+        if self.receptor_block is None:
+            self.receptor_block = self.receptor.text()
+        return self.receptor_block + self.ligand.text(self.coordinates(pose_id))
+
+    def extract(self, pose_id, pdb_file):
+        with open(pdb_file, 'w') as output:
+            output.write(self.model(pose_id))
+        return pdb_file
+
+
+def make_trajectory(project_name, confs, trajectory_file, store=None):
+    """Writes the models of the given conformations as a trajectory, in order"""
+    builder = model_builder.ModelBuilder("%s%s" % (project_name, model_builder.receptor_suffix),
+                                         "%s%s" % (project_name, model_builder.ligand_suffix),
+                                         "%s%s" % (project_name, model_builder.rot_suffix), store)
+    writer = TrajectoryWriter(trajectory_file, builder.receptor, builder.ligand)
+    for conf, coordinates in builder.coordinates(confs):
+        writer.add(conf, coordinates)
+    return writer.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="trajectory")
+    parser.add_argument("trajectory", help="Trajectory file")
+    parser.add_argument("--conf", help="Pose IDs of the models to extract, all by default", type=int, nargs='+')
+    parser.add_argument("--prefix", help="Prefix of the PDB files written", default='model_')
+    parser.add_argument("--output", help="Folder of the PDB files written", default='.')
+    args = parser.parse_args()
+
+    trajectory = Trajectory(args.trajectory)
+    for conf in args.conf or trajectory.ids:
+        print trajectory.extract(conf, os.path.join(args.output, '%s%d.pdb' % (args.prefix, conf)))